@@ -0,0 +1,306 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+from telemetry import Histogram, telemetry
+
+class CircuitBreaker:
+    """Stops sending to a backend after failure_threshold consecutive failures.
+
+    An open breaker lets calls through again once cooldown_seconds have
+    passed; the first success closes it and another failure reopens it.
+    """
+
+    def __init__(self, failure_threshold: int, cooldown_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half_open" if time.monotonic() - self.opened_at >= self.cooldown_seconds else "open"
+
+    def allow(self) -> bool:
+        return self.state != "open"
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+class Backend:
+    """One OpenAI-compatible endpoint and model, with its own latency record and circuit breaker"""
+
+    def __init__(self, settings: Mapping[str, Any], openai_settings: Mapping[str, Any],
+                 breaker_settings: Mapping[str, Any]):
+        self.name = settings["name"]
+        self.model = settings.get("model") or openai_settings["model"]
+        # None keeps the process-wide api_base and API key that load_openai() applied
+        self.api_base = settings.get("api_base")
+        self.api_key_env = settings.get("api_key_env")
+        self.request_timeout = settings.get("request_timeout") or openai_settings["request_timeout"]
+        self.breaker = CircuitBreaker(breaker_settings["failure_threshold"], breaker_settings["cooldown_seconds"])
+        self._latency = {}
+        self._lock = threading.Lock()
+
+    def request_options(self) -> Dict[str, Any]:
+        """Keyword arguments that point a ChatCompletion call at this backend"""
+        options = {"model": self.model, "request_timeout": self.request_timeout}
+        if self.api_base:
+            options["api_base"] = self.api_base
+        # Read per call: load_openai() loads .env on the first model call, after backends are built
+        api_key = os.getenv(self.api_key_env) if self.api_key_env else None
+        if api_key:
+            options["api_key"] = api_key
+        return options
+
+    def observe(self, call_site: str, stream: bool, seconds: float):
+        """Record how long a successful call took; for streams, until the response started"""
+        with self._lock:
+            histogram = self._latency.get((call_site, stream))
+            if histogram is None:
+                histogram = self._latency[(call_site, stream)] = Histogram()
+            histogram.observe(seconds)
+        telemetry.observe("backend_seconds", seconds, backend=self.name, call_site=call_site)
+
+    def latency(self, call_site: str, stream: bool, quantile: float, min_samples: int) -> Optional[float]:
+        """Observed latency percentile (0-100) for this kind of call, or None before min_samples calls"""
+        with self._lock:
+            histogram = self._latency.get((call_site, stream))
+            if histogram is None or histogram.count < min_samples:
+                return None
+            return histogram.percentile(quantile)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latency = {f"{call_site}{'/stream' if stream else ''}": histogram.summary()
+                       for (call_site, stream), histogram in self._latency.items()}
+        return {"model": self.model, "circuit": self.breaker.state, "latency_seconds": latency}
+
+class BackendRouter:
+    """Sends each model call to the configured backends with failover and hedging.
+
+    Backends are tried in configured order, skipping those whose circuit is
+    open. A retryable error counts against the backend's breaker and the call
+    fails over to the next backend; other errors are raised at once. For call
+    sites listed under hedge, a duplicate is sent to the next backend (or the
+    same one, if it is the only one) when the first has not answered by its
+    observed latency percentile, and whichever answers first is used. Before
+    min_samples calls have been seen, the duplicate waits max_delay_seconds.
+    With a single usable backend there is nothing to hedge to, so calls are
+    only retried there by the scheduler.
+
+    The first request of a call was admitted by the caller's scheduler; every
+    further request goes through `admit(wait)` first. Failovers wait for
+    admission, while a duplicate that cannot be admitted at once is not sent.
+    A losing duplicate's result is passed to `discard` after it is closed, so
+    its usage can still be counted.
+    """
+
+    def __init__(self, settings: Mapping[str, Any], openai_settings: Mapping[str, Any],
+                 retryable_errors: Callable[[], Tuple[type, ...]]):
+        self.backends = [Backend(backend, openai_settings, settings["circuit_breaker"])
+                         for backend in settings["endpoints"]]
+        hedge = settings["hedge"]
+        self.hedge_enabled = hedge["enabled"]
+        self.hedge_call_sites = frozenset(hedge["call_sites"])
+        self.hedge_quantile = hedge["quantile"]
+        self.hedge_min_samples = hedge["min_samples"]
+        self.hedge_min_delay = hedge["min_delay_seconds"]
+        self.hedge_max_delay = hedge["max_delay_seconds"]
+        self.retryable_errors = retryable_errors
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def candidates(self) -> List[Backend]:
+        """Backends to try, in order; if every circuit is open, all of them rather than none"""
+        allowed = [backend for backend in self.backends if backend.breaker.allow()]
+        return allowed or list(self.backends)
+
+    def hedge_delay(self, backends: List[Backend], call_site: str, stream: bool) -> Optional[float]:
+        """Seconds to wait for the first backend before sending a duplicate, or None to never hedge"""
+        if not self.hedge_enabled or call_site not in self.hedge_call_sites or len(backends) < 2:
+            return None
+        latency = backends[0].latency(call_site, stream, self.hedge_quantile, self.hedge_min_samples)
+        if latency is None:
+            return self.hedge_max_delay
+        return min(max(latency, self.hedge_min_delay), self.hedge_max_delay)
+
+    def call(self, request: Callable[[Backend], Any], call_site: str, stream: bool,
+             admit: Callable[[bool], bool] = lambda wait: True,
+             discard: Callable[[Any], None] = lambda result: None) -> Any:
+        """Run request(backend) with failover, hedging when the call site allows it"""
+        backends = self.candidates()
+        delay = self.hedge_delay(backends, call_site, stream)
+        if delay is None:
+            return self._call_in_order(request, backends, call_site, stream, admit)
+
+        executor = self._get_executor()
+        pending: Dict[Future, Backend] = {}
+        queue, hedged, last_error = list(backends), False, None
+
+        def launch(backend: Backend):
+            start = time.perf_counter()
+            future = executor.submit(request, backend)
+            future.add_done_callback(lambda done: self._settle(done, backend, call_site, stream, start))
+            pending[future] = backend
+
+        launch(queue.pop(0))
+        try:
+            while pending:
+                done, _ = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+                if not done:
+                    # One duplicate at most, and only when the rate budget has room for it now
+                    if queue and admit(False):
+                        hedged = True
+                        telemetry.increment("backend_hedges", call_site=call_site)
+                        launch(queue.pop(0))
+                    delay = None
+                    continue
+                for future in done:
+                    backend = pending.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        if hedged:
+                            telemetry.increment("backend_hedge_wins", backend=backend.name, call_site=call_site)
+                        return future.result()
+                    if not isinstance(error, self.retryable_errors()):
+                        raise error
+                    last_error = error
+                    if queue and not pending:
+                        telemetry.increment("backend_failovers", backend=backend.name, call_site=call_site)
+                        admit(True)
+                        launch(queue.pop(0))
+            raise last_error
+        finally:
+            for future in pending:
+                # A slower duplicate still running: its stream is closed as soon as it arrives, and
+                # its usage is counted in the caller's context
+                context = contextvars.copy_context()
+                future.add_done_callback(lambda done: context.run(_discard_result, done, discard))
+
+    async def acall(self, request: Callable[[Backend], Awaitable[Any]], call_site: str, stream: bool,
+                    aadmit: Callable[[bool], Awaitable[bool]] = None,
+                    discard: Callable[[Any], None] = lambda result: None) -> Any:
+        """Async variant of call; the losing duplicate is cancelled instead of left to finish"""
+        backends = self.candidates()
+        delay = self.hedge_delay(backends, call_site, stream)
+        pending: Dict[asyncio.Task, Backend] = {}
+        queue, hedged, last_error = list(backends), False, None
+        aadmit = aadmit or _admit_all
+
+        def launch(backend: Backend):
+            pending[asyncio.create_task(self._atimed(request, backend, call_site, stream))] = backend
+
+        launch(queue.pop(0))
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if queue and await aadmit(False):
+                        hedged = True
+                        telemetry.increment("backend_hedges", call_site=call_site)
+                        launch(queue.pop(0))
+                    delay = None
+                    continue
+                for task in done:
+                    backend = pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        if hedged:
+                            telemetry.increment("backend_hedge_wins", backend=backend.name, call_site=call_site)
+                        return task.result()
+                    if not isinstance(error, self.retryable_errors()):
+                        raise error
+                    last_error = error
+                    if queue and not pending:
+                        telemetry.increment("backend_failovers", backend=backend.name, call_site=call_site)
+                        await aadmit(True)
+                        launch(queue.pop(0))
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+            # A duplicate that finished before it could be cancelled may hold an open stream
+            for result in await asyncio.gather(*pending, return_exceptions=True):
+                if not isinstance(result, BaseException):
+                    await _aclose_result(result)
+                    discard(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {backend.name: backend.stats() for backend in self.backends}
+
+    def _call_in_order(self, request: Callable[[Backend], Any], backends: List[Backend],
+                       call_site: str, stream: bool, admit: Callable[[bool], bool]) -> Any:
+        """Failover without hedging, on the caller's thread"""
+        for position, backend in enumerate(backends):
+            if position:
+                admit(True)
+            start = time.perf_counter()
+            try:
+                result = request(backend)
+            except self.retryable_errors():
+                backend.breaker.record_failure()
+                if position == len(backends) - 1:
+                    raise
+                telemetry.increment("backend_failovers", backend=backend.name, call_site=call_site)
+                continue
+            backend.breaker.record_success()
+            backend.observe(call_site, stream, time.perf_counter() - start)
+            return result
+
+    async def _atimed(self, request: Callable[[Backend], Awaitable[Any]], backend: Backend,
+                      call_site: str, stream: bool) -> Any:
+        start = time.perf_counter()
+        try:
+            result = await request(backend)
+        except self.retryable_errors():
+            backend.breaker.record_failure()
+            raise
+        backend.breaker.record_success()
+        backend.observe(call_site, stream, time.perf_counter() - start)
+        return result
+
+    def _settle(self, future: Future, backend: Backend, call_site: str, stream: bool, start: float):
+        """Update a backend's breaker and latency when a threaded call finishes, winner or not"""
+        error = future.exception()
+        if error is None:
+            backend.breaker.record_success()
+            backend.observe(call_site, stream, time.perf_counter() - start)
+        elif isinstance(error, self.retryable_errors()):
+            backend.breaker.record_failure()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(thread_name_prefix="backend")
+        return self._executor
+
+def _discard_result(future: Future, discard: Callable[[Any], None]):
+    if not future.cancelled() and future.exception() is None:
+        result = future.result()
+        getattr(result, "close", lambda: None)()
+        discard(result)
+
+async def _admit_all(wait: bool) -> bool:
+    return True
+
+async def _aclose_result(result: Any):
+    aclose = getattr(result, "aclose", None)
+    if aclose is not None:
+        await aclose()
@@ -0,0 +1,204 @@
+"""
+Offline performance benchmark for the story pipeline.
+
+Runs the real StoryTeller/StoryJudge generate -> judge -> improve flow (under
+the improvement controller's budget) for the easy/medium/hard prompt sets
+against the local mock LLM server, and reports throughput, end-to-end and
+per-stage latency percentiles, improvement convergence, and CPU time spent in
+local metrics. Pass --baseline with an earlier report to fail on regressions.
+
+    python benchmark.py --latency-scale 0.05 --repeat 3 --output bench_report.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from config_loader import config
+from improvement_controller import ImprovementController
+from mock_llm_server import MockLLMServer
+from openai_client import OpenAIClient, load_openai, retryable_errors
+from request_scheduler import RequestScheduler
+from story_teller import StoryTeller
+from story_judge import StoryJudge
+from telemetry import telemetry
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Linear-interpolated percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+def latency_summary(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered) if ordered else 0.0,
+        "p50": percentile(ordered, 50),
+        "p95": percentile(ordered, 95),
+        "p99": percentile(ordered, 99)
+    }
+
+def build_pipeline(use_cache: bool):
+    """Create a StoryTeller/StoryJudge pair sharing one client, without production rate limits"""
+    client = OpenAIClient()
+    client.cache.enabled = use_cache
+    # The mock has no quota, so only the retry behaviour of the scheduler is kept
+    client.scheduler = RequestScheduler(
+        {**config.get_scheduler_settings(), "requests_per_minute": 1e9, "tokens_per_minute": 1e12},
+        retryable_errors
+    )
+    return StoryTeller(client), StoryJudge(client)
+
+def run_request(controller: ImprovementController, prompt: str) -> Dict:
+    """One test.py-style request: generate, judge, and improve within the budget if needed"""
+    start = time.perf_counter()
+    result = controller.run(prompt)
+    return {
+        "latency": time.perf_counter() - start,
+        "improved": result.rounds > 0,
+        "passed": result.evaluation["passed"],
+        "llm_judge_fallback": result.evaluation["llm_judge_fallback"]
+    }
+
+def run_prompt_set(prompts: List[str], storyteller: StoryTeller, judge: StoryJudge,
+                   repeat: int, concurrency: int) -> Dict:
+    """Benchmark one prompt set and summarize it from the results and telemetry"""
+    telemetry.reset()
+    controller = ImprovementController(storyteller, judge)
+    requests = prompts * repeat
+    results, errors = [], 0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(run_request, controller, prompt) for prompt in requests]
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception:
+                errors += 1
+    wall_seconds = time.perf_counter() - start
+
+    stages, local_metrics_cpu = {}, None
+    for histogram in telemetry.snapshot()["histograms"]:
+        labels = histogram["labels"]
+        if histogram["name"] == "stage_seconds":
+            name = labels["stage"] + (f"[{labels['call_site']}]" if "call_site" in labels else "")
+            stages[name] = {key: histogram[key] for key in ("count", "p50", "p95", "p99")}
+        elif histogram["name"] == "stage_cpu_seconds" and labels.get("stage") == "analyze_metrics":
+            local_metrics_cpu = {
+                "total_seconds": histogram["sum"],
+                "mean_seconds": histogram["sum"] / histogram["count"],
+                "p95_seconds": histogram["p95"]
+            }
+
+    return {
+        "requests": len(requests),
+        "errors": errors,
+        "wall_seconds": wall_seconds,
+        "throughput_rps": len(results) / wall_seconds if wall_seconds else 0.0,
+        "end_to_end_seconds": latency_summary([result["latency"] for result in results]),
+        "improve_rate": sum(result["improved"] for result in results) / len(results) if results else 0.0,
+        "pass_rate": sum(result["passed"] for result in results) / len(results) if results else 0.0,
+        "llm_judge_fallbacks": sum(result["llm_judge_fallback"] for result in results),
+        "improvement": controller.summary(),
+        "stages": stages,
+        "local_metrics_cpu": local_metrics_cpu
+    }
+
+def find_regressions(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Compare p95 latency, throughput and local-metrics CPU against a baseline report"""
+    regressions = []
+    for name, current in report["prompt_sets"].items():
+        previous = baseline.get("prompt_sets", {}).get(name)
+        if previous is None:
+            continue
+        checks = [
+            ("end-to-end p95", current["end_to_end_seconds"]["p95"], previous["end_to_end_seconds"]["p95"], True),
+            ("throughput", current["throughput_rps"], previous["throughput_rps"], False),
+        ]
+        if current["local_metrics_cpu"] and previous["local_metrics_cpu"]:
+            checks.append(("local metrics CPU/call", current["local_metrics_cpu"]["mean_seconds"],
+                           previous["local_metrics_cpu"]["mean_seconds"], True))
+        for label, now, before, lower_is_better in checks:
+            if not before:
+                continue
+            change = (now - before) / before
+            if (change > tolerance) if lower_is_better else (change < -tolerance):
+                regressions.append(f"{name}: {label} {before:.4f} -> {now:.4f} ({change:+.0%})")
+    return regressions
+
+def print_report(report: Dict):
+    print(f"\n{'='*80}")
+    print("STORY PIPELINE BENCHMARK (mock LLM server)")
+    print(f"{'='*80}")
+    for name, result in report["prompt_sets"].items():
+        e2e = result["end_to_end_seconds"]
+        print(f"\n{name.upper()}: {result['requests']} requests, {result['errors']} errors, "
+              f"{result['throughput_rps']:.2f} req/s")
+        print(f"   End-to-end: p50 {e2e['p50']:.3f}s  p95 {e2e['p95']:.3f}s  p99 {e2e['p99']:.3f}s")
+        print(f"   Improve rate: {result['improve_rate']:.0%}  Pass rate: {result['pass_rate']:.0%}  "
+              f"Judge fallbacks: {result['llm_judge_fallbacks']}")
+        improvement = result["improvement"]
+        print(f"   Improvement: {improvement['mean_rounds']:.2f} passes/request, "
+              f"{improvement['mean_tokens']:.0f} tokens/request, stops: "
+              f"{', '.join(f'{reason} {count}' for reason, count in sorted(improvement['stop_reasons'].items()))}")
+        if result["local_metrics_cpu"]:
+            cpu = result["local_metrics_cpu"]
+            print(f"   Local metrics CPU: {cpu['total_seconds'] * 1000:.1f}ms total, "
+                  f"{cpu['mean_seconds'] * 1000:.2f}ms/call")
+        for stage, summary in sorted(result["stages"].items()):
+            print(f"   {stage:<32} n={summary['count']:<5} p50 {summary['p50']:.4f}s  "
+                  f"p95 {summary['p95']:.4f}s  p99 {summary['p99']:.4f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark against a local mock LLM server")
+    parser.add_argument("--sets", default="easy,medium,hard", help="Comma-separated prompt sets from config test_prompts")
+    parser.add_argument("--repeat", type=int, default=1, help="Times each prompt is replayed")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent requests")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplier on mock latency distributions")
+    parser.add_argument("--error-rate", type=float, default=None, help="Override mock error rate")
+    parser.add_argument("--use-cache", action="store_true", help="Keep the response cache enabled")
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression vs baseline")
+    args = parser.parse_args()
+
+    os.environ["OPENAI_API_KEY"] = "mock-key"
+    prompt_sets = config.get_test_prompts()
+    with MockLLMServer(latency_scale=args.latency_scale, error_rate=args.error_rate) as server:
+        storyteller, judge = build_pipeline(args.use_cache)
+        load_openai().api_base = server.url
+
+        report = {
+            "settings": vars(args),
+            "prompt_sets": {
+                name: run_prompt_set(prompt_sets[name], storyteller, judge, args.repeat, args.concurrency)
+                for name in args.sets.split(",")
+            },
+            "mock_server": dict(server.stats)
+        }
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = find_regressions(report, json.load(f), args.tolerance)
+        if regressions:
+            print("\nREGRESSIONS:")
+            for regression in regressions:
+                print(f"   {regression}")
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+if __name__ == "__main__":
+    main()
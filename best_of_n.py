@@ -0,0 +1,67 @@
+import asyncio
+from typing import Dict, Tuple
+from config_loader import config
+from story_teller import StoryTeller
+from story_judge import StoryJudge
+
+class BestOfNGenerator:
+    """Races N candidate story generations and keeps the first that clears the quality bar"""
+    
+    def __init__(self, storyteller: StoryTeller, judge: StoryJudge):
+        self.storyteller = storyteller
+        self.judge = judge
+        settings = config.get_best_of_n_settings()
+        self.candidates = settings["candidates"]
+        self.timeout_seconds = settings["timeout_seconds"]
+    
+    def generate(self, user_input: str) -> Tuple[str, str, Dict]:
+        """Blocking wrapper around agenerate for the synchronous main loop"""
+        return asyncio.run(self._generate_in_private_session(user_input))
+    
+    async def _generate_in_private_session(self, user_input: str) -> Tuple[str, str, Dict]:
+        # A session is bound to its event loop, so this one lives and dies with asyncio.run
+        # rather than closing the shared pool other threads may be using
+        async with self.storyteller.client.private_session():
+            return await self.agenerate(user_input)
+    
+    async def agenerate(self, user_input: str) -> Tuple[str, str, Dict]:
+        """Return (story, category, local evaluation) for the first passing candidate.
+        
+        Each candidate is scored with local metrics as soon as it finishes. The
+        remaining generations are cancelled once one passes. If none passes
+        before the timeout, the best-scoring finished candidate is returned.
+        Candidates go through the storyteller's safety guard. Raises
+        RuntimeError when no candidate finishes.
+        """
+        category = self.storyteller.categorize_request(user_input)
+        prompt = self.storyteller.create_prompt(user_input, category)
+        tasks = [
+            asyncio.create_task(self.storyteller.agenerate_from_prompt(prompt, category, call_site="best_of_n"))
+            for _ in range(self.candidates)
+        ]
+        
+        best_story, best_evaluation = None, None
+        try:
+            for finished in asyncio.as_completed(tasks, timeout=self.timeout_seconds):
+                try:
+                    story = await finished
+                except asyncio.TimeoutError:
+                    raise
+                except Exception:
+                    continue  # One failed candidate should not sink the others
+                
+                evaluation = await asyncio.to_thread(self.judge.evaluate_locally, story)
+                if evaluation["passed"]:
+                    return story, category, evaluation
+                if best_evaluation is None or evaluation["composite_score"] > best_evaluation["composite_score"]:
+                    best_story, best_evaluation = story, evaluation
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+        if best_story is None:
+            raise RuntimeError("No candidate story finished within the best-of-N timeout")
+        return best_story, category, best_evaluation
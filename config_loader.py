@@ -1,82 +1,551 @@
 import json
 import os
-from typing import Dict, Any
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, Any, FrozenSet, List, Mapping, Tuple
+from keyword_matcher import KeywordMatcher
+
+# Marks "no default given", so falsy defaults like 0, False or "" are still returned
+_MISSING = object()
+
+NUMBER = (int, float)
+
+# Required keys and their types. A nested dict describes a nested section;
+# keys not listed here are allowed and passed through unchecked.
+CONFIG_SCHEMA = {
+    "story_evaluation": {
+        "skip_llm_judge_on_local_failure": bool,
+        "default_llm_scores": dict,
+        "composite_score_weights": {
+            "predictability": NUMBER,
+            "vocabulary": NUMBER,
+            "age_level": NUMBER,
+            "safety": NUMBER
+        },
+        "quality_thresholds": {
+            "min_word_count": int,
+            "max_word_count": int,
+            "min_reading_level": NUMBER,
+            "max_reading_level": NUMBER,
+            "target_reading_level": NUMBER,
+            "min_overall_score": NUMBER,
+            "min_safety_score": NUMBER,
+            "min_composite_score": NUMBER
+        },
+        "vocabulary_settings": {
+            "richness_multiplier": NUMBER,
+            "max_vocabulary_score": NUMBER
+        },
+        "age_level_scoring": {
+            "target_grade": NUMBER,
+            "penalty_per_grade_diff": NUMBER,
+            "min_age_score": NUMBER,
+            "max_age_score": NUMBER
+        }
+    },
+    "story_categories": dict,
+    "safety_filters": {
+        "calming_words": list,
+        "unsafe_words": list,
+        "safety_penalty_per_word": NUMBER
+    },
+    "openai_settings": {
+        "model": str,
+        "max_tokens": int,
+        "temperature": NUMBER,
+        "judge_max_tokens": int,
+        "judge_temperature": NUMBER,
+        "request_timeout": NUMBER,
+        "connection_pool": dict
+    },
+    "story_generation": {
+        "base_prompt_template": str,
+        "improvement_prompt_template": str,
+        "modification_prompt_template": str,
+        "session_system_prompt_template": str,
+        "patch_prompt_template": str
+    },
+    "safety_guard": {
+        "enabled": bool,
+        "max_retries": int,
+        "retry_instructions": str
+    },
+    "story_sessions": {
+        "enabled": bool,
+        "max_history_rounds": int,
+        "patch_max_tokens": int
+    },
+    "request_scheduler": dict,
+    "response_cache": dict,
+    "telemetry": dict,
+    "service": dict,
+    "story_library": {
+        "enabled": bool,
+        "db_path": str,
+        "reuse_policy": str,
+        "min_similarity": NUMBER,
+        "min_composite_score": NUMBER,
+        "user_freshness_days": NUMBER,
+        "max_variants_per_request": int,
+        "default_user_id": str,
+        "shingle_size": int,
+        "num_permutations": int,
+        "lsh_bands": int,
+        "minhash_seed": int,
+        "stopwords": list
+    },
+    "story_pool": {
+        "enabled": bool,
+        "target_size": int,
+        "low_watermark": int,
+        "ttl_seconds": NUMBER,
+        "workers": int,
+        "max_attempts_per_story": int,
+        "sweep_interval_seconds": NUMBER,
+        "general_request": str
+    },
+    "backends": {
+        "endpoints": list,
+        "hedge": {
+            "enabled": bool,
+            "call_sites": list,
+            "quantile": NUMBER,
+            "min_samples": int,
+            "min_delay_seconds": NUMBER,
+            "max_delay_seconds": NUMBER
+        },
+        "circuit_breaker": {
+            "failure_threshold": int,
+            "cooldown_seconds": NUMBER
+        }
+    },
+    "token_sizing": {
+        "enabled": bool,
+        "percentile": NUMBER,
+        "margin_ratio": NUMBER,
+        "min_tokens": int,
+        "min_samples": int,
+        "window": int,
+        "widen_factor": NUMBER,
+        "stream_usage": bool
+    },
+    "improvement_controller": {
+        "max_rounds": int,
+        "time_budget_seconds": NUMBER,
+        "token_budget": int,
+        "min_composite_gain": NUMBER,
+        "temperature_schedule": list
+    },
+    "batch_judge": {
+        "context_window_tokens": int,
+        "max_stories_per_batch": int,
+        "output_tokens_per_story": int,
+        "max_rounds": int
+    },
+    "corpus_scoring": {
+        "workers": int,
+        "chunk_size": int,
+        "max_pending_chunks_per_worker": int,
+        "progress_interval_seconds": NUMBER,
+        "id_field": str,
+        "text_field": str,
+        "file_pattern": str
+    },
+    "load_test": {
+        "sessions": int,
+        "concurrency": int,
+        "max_turns": int,
+        "behaviour_mix": dict,
+        "accept_after_modify": NUMBER,
+        "think_time": dict,
+        "custom_feedback": list,
+        "seed": int,
+        "top_allocations": int
+    },
+    "config_reload": {
+        "poll_interval_seconds": NUMBER
+    },
+    "best_of_n": dict,
+    "mock_llm_server": dict,
+    "test_prompts": dict,
+    "display_settings": dict
+}
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """Immutable, validated view of config.json with derived lookup structures.
+
+    Sections are read-only mappings (lists become tuples). A reload builds a
+    new snapshot and swaps it in whole, so a reader holding one never sees a
+    half-applied change.
+    """
+    version: int
+    sections: Mapping[str, Any]
+    quality_thresholds: Mapping[str, Any]
+    default_llm_scores: Mapping[str, float]
+    composite_weights: Mapping[str, float]
+    vocabulary_settings: Mapping[str, float]
+    age_level_scoring: Mapping[str, float]
+    story_categories: Mapping[str, Mapping]
+    safety_filters: Mapping[str, Any]
+    openai_settings: Mapping[str, Any]
+    story_generation: Mapping[str, str]
+    display_settings: Mapping[str, Any]
+    skip_llm_judge_on_local_failure: bool
+    # Derived artefacts, built once per snapshot instead of per request
+    word_count_range: Tuple[int, int]
+    reading_level_range: Tuple[float, float]
+    calming_words: FrozenSet[str]
+    unsafe_words: FrozenSet[str]
+    keyword_matcher: KeywordMatcher
+
+    def get(self, key_path: str, default=_MISSING):
+        """Get configuration value using dot notation (e.g., 'story_evaluation.default_llm_scores')"""
+        value = self.sections
+        try:
+            for key in key_path.split('.'):
+                value = value[key]
+            return value
+        except (KeyError, TypeError):
+            if default is not _MISSING:
+                return default
+            raise KeyError(f"Configuration key '{key_path}' not found")
+
+def validate_config(raw: Dict[str, Any]) -> List[str]:
+    """Return every schema and consistency problem found in a raw config dict"""
+    problems = []
+    _check_schema(raw, CONFIG_SCHEMA, "", problems)
+    if problems:
+        return problems
+
+    thresholds = raw["story_evaluation"]["quality_thresholds"]
+    if thresholds["min_word_count"] > thresholds["max_word_count"]:
+        problems.append("story_evaluation.quality_thresholds: min_word_count exceeds max_word_count")
+    if thresholds["min_reading_level"] > thresholds["max_reading_level"]:
+        problems.append("story_evaluation.quality_thresholds: min_reading_level exceeds max_reading_level")
+    if sum(raw["story_evaluation"]["composite_score_weights"].values()) <= 0:
+        problems.append("story_evaluation.composite_score_weights: weights must sum to a positive number")
+    for name, category in raw["story_categories"].items():
+        if not isinstance(category, dict):
+            problems.append(f"story_categories.{name}: expected an object")
+            continue
+        keywords = category.get("keywords")
+        if not isinstance(keywords, list) or not all(isinstance(keyword, str) and keyword for keyword in keywords):
+            problems.append(f"story_categories.{name}.keywords: expected a list of non-empty strings")
+        if not isinstance(category.get("prompt_strategy"), str):
+            problems.append(f"story_categories.{name}.prompt_strategy: expected a string")
+        _check_inflections(category.get("inflections", {}), keywords, f"story_categories.{name}.inflections", problems)
+    library = raw["story_library"]
+    if library["reuse_policy"] not in ("off", "exact", "similar"):
+        problems.append("story_library.reuse_policy: expected one of off, exact, similar")
+    if library["lsh_bands"] <= 0 or library["num_permutations"] % library["lsh_bands"]:
+        problems.append("story_library.lsh_bands: must evenly divide num_permutations")
+    pool = raw["story_pool"]
+    if not 0 <= pool["low_watermark"] < pool["target_size"]:
+        problems.append("story_pool.low_watermark: must be at least 0 and below target_size")
+    if pool["workers"] < 1:
+        problems.append("story_pool.workers: must be at least 1")
+    endpoints = raw["backends"]["endpoints"]
+    if not endpoints:
+        problems.append("backends.endpoints: expected at least one backend")
+    for index, endpoint in enumerate(endpoints):
+        if not isinstance(endpoint, dict) or not isinstance(endpoint.get("name"), str):
+            problems.append(f"backends.endpoints[{index}]: expected an object with a name")
+    if not 0 < raw["backends"]["hedge"]["quantile"] <= 100:
+        problems.append("backends.hedge.quantile: must be above 0 and at most 100")
+    sizing = raw["token_sizing"]
+    if not 0 < sizing["percentile"] <= 1:
+        problems.append("token_sizing.percentile: must be above 0 and at most 1")
+    if sizing["widen_factor"] <= 1:
+        problems.append("token_sizing.widen_factor: must be above 1")
+    if not 1 <= sizing["min_samples"] <= sizing["window"]:
+        problems.append("token_sizing.min_samples: must be at least 1 and at most window")
+    schedule = raw["improvement_controller"]["temperature_schedule"]
+    if not schedule or not all(isinstance(value, NUMBER) and 0 <= value <= 2 for value in schedule):
+        problems.append("improvement_controller.temperature_schedule: expected a non-empty list of numbers from 0 to 2")
+    load_test = raw["load_test"]
+    mix = load_test["behaviour_mix"]
+    if set(mix) - {"keep", "longer", "shorter", "regenerate", "custom"}:
+        problems.append("load_test.behaviour_mix: expected weights for keep, longer, shorter, regenerate, custom")
+    elif not all(isinstance(weight, NUMBER) and weight >= 0 for weight in mix.values()) or not sum(mix.values()) > 0:
+        problems.append("load_test.behaviour_mix: weights must be at least 0 and not all 0")
+    if not 0 <= load_test["accept_after_modify"] <= 1:
+        problems.append("load_test.accept_after_modify: must be from 0 to 1")
+    if mix.get("custom") and not (load_test["custom_feedback"] and
+                                  all(isinstance(text, str) for text in load_test["custom_feedback"])):
+        problems.append("load_test.custom_feedback: expected a non-empty list of strings when custom has weight")
+    for key in ("calming_words", "unsafe_words"):
+        if not all(isinstance(word, str) for word in raw["safety_filters"][key]):
+            problems.append(f"safety_filters.{key}: expected a list of strings")
+    filters = raw["safety_filters"]
+    _check_inflections(filters.get("inflections", {}), filters["calming_words"] + filters["unsafe_words"],
+                       "safety_filters.inflections", problems)
+    return problems
+
+def _check_inflections(inflections: Any, words: Any, path: str, problems: List[str]):
+    """Optional extra forms: an object mapping configured words to lists of non-empty strings"""
+    if not isinstance(inflections, dict) or not all(
+            isinstance(words, list) and word in words and isinstance(forms, list)
+            and all(isinstance(form, str) and form for form in forms)
+            for word, forms in inflections.items()):
+        problems.append(f"{path}: expected configured word -> list of non-empty strings")
+
+def _check_schema(value: Any, schema: Any, path: str, problems: List[str]):
+    if isinstance(schema, dict):
+        if not isinstance(value, dict):
+            problems.append(f"{path or 'config'}: expected an object")
+            return
+        for key, child_schema in schema.items():
+            child_path = f"{path}.{key}" if path else key
+            if key not in value:
+                problems.append(f"{child_path}: missing")
+            else:
+                _check_schema(value[key], child_schema, child_path, problems)
+    elif isinstance(value, bool) and schema is not bool:
+        # bool is an int subclass, but true is never a valid count or threshold
+        problems.append(f"{path}: expected {_type_name(schema)}, got a boolean")
+    elif not isinstance(value, schema):
+        problems.append(f"{path}: expected {_type_name(schema)}, got {type(value).__name__}")
+
+def _type_name(schema: Any) -> str:
+    return "a number" if schema is NUMBER else schema.__name__
+
+def _freeze(value: Any) -> Any:
+    """Recursively turn dicts into read-only mappings and lists into tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+def compile_config(raw: Dict[str, Any], version: int) -> ConfigSnapshot:
+    """Validate a raw config dict and build its immutable snapshot"""
+    problems = validate_config(raw)
+    if problems:
+        raise ValueError("Invalid configuration:\n  " + "\n  ".join(problems))
+
+    sections = _freeze(raw)
+    evaluation = sections["story_evaluation"]
+    thresholds = evaluation["quality_thresholds"]
+    safety_filters = sections["safety_filters"]
+    return ConfigSnapshot(
+        version=version,
+        sections=sections,
+        quality_thresholds=thresholds,
+        default_llm_scores=evaluation["default_llm_scores"],
+        composite_weights=evaluation["composite_score_weights"],
+        vocabulary_settings=evaluation["vocabulary_settings"],
+        age_level_scoring=evaluation["age_level_scoring"],
+        story_categories=sections["story_categories"],
+        safety_filters=safety_filters,
+        openai_settings=sections["openai_settings"],
+        story_generation=sections["story_generation"],
+        display_settings=sections["display_settings"],
+        skip_llm_judge_on_local_failure=evaluation["skip_llm_judge_on_local_failure"],
+        word_count_range=(thresholds["min_word_count"], thresholds["max_word_count"]),
+        reading_level_range=(thresholds["min_reading_level"], thresholds["max_reading_level"]),
+        calming_words=frozenset(word.lower() for word in safety_filters["calming_words"]),
+        unsafe_words=frozenset(word.lower() for word in safety_filters["unsafe_words"]),
+        keyword_matcher=KeywordMatcher(sections["story_categories"])
+    )
 
 class ConfigLoader:
-    """Loads and manages configuration from JSON file"""
+    """Loads config.json into a compiled snapshot and hot-reloads it when the file changes"""
     
     def __init__(self, config_file: str = "config.json"):
         self.config_file = config_file
-        self.config = self._load_config()
+        self.config_path = os.path.join(os.path.dirname(__file__), config_file)
+        self.last_reload_error = None
+        self._reload_lock = threading.Lock()
+        self._stop_watching = threading.Event()
+        self._watcher = None
+        self._file_signature = None
+        self._snapshot = None
+    
+    @property
+    def snapshot(self) -> ConfigSnapshot:
+        """The current compiled config; config.json is read on first access rather than at import"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._reload_lock:
+                if self._snapshot is None:
+                    self._file_signature = self._signature()
+                    self._snapshot = compile_config(self._load_config(), version=1)
+                snapshot = self._snapshot
+        return snapshot
+    
+    @property
+    def config(self) -> Mapping[str, Any]:
+        """The raw (read-only) configuration tree of the current snapshot"""
+        return self.snapshot.sections
     
     def _load_config(self) -> Dict[str, Any]:
         """Load configuration from JSON file"""
         try:
-            config_path = os.path.join(os.path.dirname(__file__), self.config_file)
-            with open(config_path, 'r', encoding='utf-8') as f:
+            with open(self.config_path, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except FileNotFoundError:
             raise FileNotFoundError(f"Configuration file {self.config_file} not found")
         except json.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON in configuration file: {e}")
     
-    def get(self, key_path: str, default=None):
-        """Get configuration value using dot notation (e.g., 'story_evaluation.default_llm_scores')"""
-        keys = key_path.split('.')
-        value = self.config
-        
+    def _signature(self) -> Tuple[int, int]:
+        stat = os.stat(self.config_path)
+        return stat.st_mtime_ns, stat.st_size
+    
+    def reload(self) -> ConfigSnapshot:
+        """Re-read and recompile the config file, then swap the new snapshot in atomically.
+    
+        Raises ValueError or FileNotFoundError and keeps the current snapshot
+        if the file is invalid.
+        """
+        with self._reload_lock:
+            signature = self._signature()
+            version = self._snapshot.version + 1 if self._snapshot is not None else 1
+            snapshot = compile_config(self._load_config(), version=version)
+            self._file_signature = signature
+            self._snapshot = snapshot
+            return snapshot
+    
+    def reload_if_changed(self) -> bool:
+        """Reload when the file's mtime or size changed; an invalid file leaves the old snapshot live"""
         try:
-            for key in keys:
-                value = value[key]
-            return value
-        except (KeyError, TypeError):
-            if default is not None:
-                return default
-            raise KeyError(f"Configuration key '{key_path}' not found")
+            if self._signature() == self._file_signature:
+                return False
+            self.reload()
+        except (ValueError, FileNotFoundError) as e:
+            if str(e) != self.last_reload_error:
+                print(f"Config reload failed, keeping version {self.snapshot.version}: {e}")
+            self.last_reload_error = str(e)
+            return False
+        self.last_reload_error = None
+        return True
+    
+    def start_watching(self, poll_interval: float = None):
+        """Poll the config file from a daemon thread and hot-reload it on change"""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        if poll_interval is None:
+            poll_interval = self.snapshot.get('config_reload.poll_interval_seconds')
+        self._stop_watching.clear()
+    
+        def watch():
+            while not self._stop_watching.wait(poll_interval):
+                self.reload_if_changed()
     
-    def get_default_llm_scores(self) -> Dict[str, float]:
+        self._watcher = threading.Thread(target=watch, name="config-watcher", daemon=True)
+        self._watcher.start()
+    
+    def stop_watching(self):
+        self._stop_watching.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+    
+    def get(self, key_path: str, default=_MISSING):
+        """Get configuration value using dot notation (e.g., 'story_evaluation.default_llm_scores')"""
+        return self.snapshot.get(key_path, default)
+    
+    def get_default_llm_scores(self) -> Mapping[str, float]:
         """Get default LLM scores"""
-        return self.get('story_evaluation.default_llm_scores')
+        return self.snapshot.default_llm_scores
     
-    def get_composite_weights(self) -> Dict[str, float]:
+    def get_composite_weights(self) -> Mapping[str, float]:
         """Get composite score weights"""
-        return self.get('story_evaluation.composite_score_weights')
+        return self.snapshot.composite_weights
     
-    def get_quality_thresholds(self) -> Dict[str, float]:
+    def get_quality_thresholds(self) -> Mapping[str, float]:
         """Get quality thresholds"""
-        return self.get('story_evaluation.quality_thresholds')
+        return self.snapshot.quality_thresholds
     
-    def get_vocabulary_settings(self) -> Dict[str, float]:
+    def get_vocabulary_settings(self) -> Mapping[str, float]:
         """Get vocabulary settings"""
-        return self.get('story_evaluation.vocabulary_settings')
+        return self.snapshot.vocabulary_settings
     
-    def get_age_level_scoring(self) -> Dict[str, float]:
+    def get_age_level_scoring(self) -> Mapping[str, float]:
         """Get age level scoring settings"""
-        return self.get('story_evaluation.age_level_scoring')
+        return self.snapshot.age_level_scoring
     
-    def get_story_categories(self) -> Dict[str, Dict]:
+    def get_story_categories(self) -> Mapping[str, Mapping]:
         """Get story categories configuration"""
-        return self.get('story_categories')
+        return self.snapshot.story_categories
     
-    def get_safety_filters(self) -> Dict[str, Any]:
+    def get_safety_filters(self) -> Mapping[str, Any]:
         """Get safety filter settings"""
-        return self.get('safety_filters')
+        return self.snapshot.safety_filters
     
-    def get_openai_settings(self) -> Dict[str, Any]:
+    def get_openai_settings(self) -> Mapping[str, Any]:
         """Get OpenAI API settings"""
-        return self.get('openai_settings')
+        return self.snapshot.openai_settings
     
-    def get_story_generation_settings(self) -> Dict[str, str]:
-        """Get story generation settings"""
-        return self.get('story_generation')
+    def get_response_cache_settings(self) -> Mapping[str, Any]:
+        """Get LLM response cache settings"""
+        return self.snapshot.sections['response_cache']
+    
+    def get_scheduler_settings(self) -> Mapping[str, Any]:
+        """Get request scheduler rate limit and retry settings"""
+        return self.snapshot.sections['request_scheduler']
     
-    def get_story_settings(self) -> Dict[str, Any]:
+    def get_telemetry_settings(self) -> Mapping[str, Any]:
+        """Get telemetry settings"""
+        return self.snapshot.sections['telemetry']
+    
+    def get_mock_server_settings(self) -> Mapping[str, Any]:
+        """Get local mock LLM server settings used by benchmarks"""
+        return self.snapshot.sections['mock_llm_server']
+    
+    def get_service_settings(self) -> Mapping[str, Any]:
+        """Get HTTP service mode settings"""
+        return self.snapshot.sections['service']
+    
+    def get_story_library_settings(self) -> Mapping[str, Any]:
+        """Get story library storage and reuse settings"""
+        return self.snapshot.sections['story_library']
+    
+    def get_story_pool_settings(self) -> Mapping[str, Any]:
+        """Get background pre-generation pool settings"""
+        return self.snapshot.sections['story_pool']
+    
+    def get_backend_settings(self) -> Mapping[str, Any]:
+        """Get model backends, hedging and circuit breaker settings"""
+        return self.snapshot.sections['backends']
+    
+    def get_token_sizing_settings(self) -> Mapping[str, Any]:
+        """Get adaptive max_tokens sizing settings"""
+        return self.snapshot.sections['token_sizing']
+    
+    def get_improvement_controller_settings(self) -> Mapping[str, Any]:
+        """Get budget-aware improvement loop settings"""
+        return self.snapshot.sections['improvement_controller']
+    
+    def get_batch_judge_settings(self) -> Mapping[str, Any]:
+        """Get batched LLM judge settings"""
+        return self.snapshot.sections['batch_judge']
+    
+    def get_corpus_scoring_settings(self) -> Mapping[str, Any]:
+        """Get offline corpus scoring settings"""
+        return self.snapshot.sections['corpus_scoring']
+    
+    def get_load_test_settings(self) -> Mapping[str, Any]:
+        """Get concurrent-session load generator settings"""
+        return self.snapshot.sections['load_test']
+    
+    def get_best_of_n_settings(self) -> Mapping[str, Any]:
+        """Get best-of-N candidate generation settings"""
+        return self.snapshot.sections['best_of_n']
+    
+    def get_story_generation_settings(self) -> Mapping[str, str]:
         """Get story generation settings"""
-        return self.get('story_settings')
+        return self.snapshot.story_generation
+    
+    def get_test_prompts(self) -> Mapping[str, tuple]:
+        """Get the easy/medium/hard prompt sets used by test.py and the benchmark"""
+        return self.snapshot.sections['test_prompts']
     
-    def get_display_settings(self) -> Dict[str, Any]:
+    def get_display_settings(self) -> Mapping[str, Any]:
         """Get display settings"""
-        return self.get('display_settings')
+        return self.snapshot.display_settings
 
 # Global configuration instance
 config = ConfigLoader()
@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional
+from config_loader import config
+from openai_client import model_errors, usage_scope
+from story_judge import StoryJudge
+from story_teller import StoryTeller
+from telemetry import telemetry
+
+@dataclass
+class ImprovementResult:
+    """Outcome of one controller run; story and evaluation are the best seen, not the last"""
+    story: str
+    category: Optional[str]
+    evaluation: Dict
+    rounds: int
+    best_round: int
+    stop_reason: str
+    elapsed_seconds: float
+    tokens: int
+    composite_history: List[float] = field(default_factory=list)
+
+class ImprovementController:
+    """Generate, evaluate and improve a story until it passes or is not worth another round.
+
+    Improve rounds run while the story fails the judge's quality gate. The loop
+    stops when a story passes ("passed"), when a round raised the composite
+    score by less than min_composite_gain ("converged"), when the evaluation
+    asks for no changes ("no_changes"), after max_rounds ("max_rounds"), or when
+    the wall-clock or token budget would be exceeded by another round
+    ("time_budget", "token_budget"); the next round is assumed to cost what the
+    last one did. Each round lowers the temperature along temperature_schedule.
+    The best story seen (passing first, then highest composite score) is
+    always returned, and convergence statistics are kept for tuning.
+    """
+
+    def __init__(self, storyteller: StoryTeller, judge: StoryJudge, settings: Mapping[str, Any] = None):
+        self.storyteller = storyteller
+        self.judge = judge
+        settings = settings or config.get_improvement_controller_settings()
+        self.max_rounds = settings["max_rounds"]
+        self.time_budget_seconds = settings["time_budget_seconds"]
+        self.token_budget = settings["token_budget"]
+        self.min_composite_gain = settings["min_composite_gain"]
+        self.temperature_schedule = settings["temperature_schedule"]
+        self.stats = {"runs": 0, "passed": 0, "rounds": 0, "seconds": 0.0, "tokens": 0, "stop_reasons": Counter()}
+        self._lock = threading.Lock()
+
+    def run(self, user_input: str) -> ImprovementResult:
+        """Generate a story for a request and improve it within the budget"""
+        start = time.perf_counter()
+        with usage_scope() as usage:
+            story, category = self.storyteller.generate_story(user_input)
+            evaluation = self.judge.judge_story(story)
+            result = self.improve(story, evaluation, started=start, spent_tokens=usage.total)
+        result.category = category
+        return result
+
+    def improve(self, story: str, evaluation: Dict, display: Callable[[Iterator[str], int], str] = None,
+                started: float = None, spent_tokens: int = 0) -> ImprovementResult:
+        """Improve an already judged story within the budget.
+
+        `started` (a time.perf_counter() value) and `spent_tokens` charge work
+        done before this call, such as generating the story, to the budget.
+        With `display`, each round is streamed and display(chunks, round)
+        must consume the chunks and return the story text.
+        """
+        started = time.perf_counter() if started is None else started
+        best_story, best_evaluation, best_round = story, evaluation, 0
+        history = [evaluation["composite_score"]]
+        rounds, stop_reason = 0, None
+        last_round_seconds, last_round_tokens = 0.0, 0
+
+        with usage_scope() as usage:
+            while stop_reason is None:
+                elapsed = time.perf_counter() - started
+                spent = spent_tokens + usage.total
+                if evaluation["passed"]:
+                    stop_reason = "passed"
+                elif rounds >= self.max_rounds:
+                    stop_reason = "max_rounds"
+                elif elapsed + last_round_seconds > self.time_budget_seconds:
+                    stop_reason = "time_budget"
+                elif spent + last_round_tokens > self.token_budget:
+                    stop_reason = "token_budget"
+                elif not self.storyteller.improvement_instructions(evaluation):
+                    stop_reason = "no_changes"
+                if stop_reason is not None:
+                    break
+
+                round_start, round_start_tokens = time.perf_counter(), usage.total
+                temperature = self.temperature_schedule[min(rounds, len(self.temperature_schedule) - 1)]
+                try:
+                    if display is None:
+                        improved = self.storyteller.improve_story(story, evaluation, temperature=temperature)
+                    else:
+                        chunks = self.storyteller.improve_story(story, evaluation, stream=True, temperature=temperature)
+                        improved = display(chunks, rounds + 1)
+                    improved_evaluation = self.judge.judge_story(improved, base=story)
+                except model_errors():
+                    stop_reason = "error"
+                    break
+                rounds += 1
+                telemetry.increment("improve_loops")
+                last_round_seconds = time.perf_counter() - round_start
+                last_round_tokens = usage.total - round_start_tokens
+
+                gain = improved_evaluation["composite_score"] - evaluation["composite_score"]
+                history.append(improved_evaluation["composite_score"])
+                if _rank(improved_evaluation) > _rank(best_evaluation):
+                    best_story, best_evaluation, best_round = improved, improved_evaluation, rounds
+                story, evaluation = improved, improved_evaluation
+                if not evaluation["passed"] and gain < self.min_composite_gain:
+                    stop_reason = "converged"
+
+        result = ImprovementResult(
+            story=best_story,
+            category=None,
+            evaluation=best_evaluation,
+            rounds=rounds,
+            best_round=best_round,
+            stop_reason=stop_reason,
+            elapsed_seconds=time.perf_counter() - started,
+            tokens=spent_tokens + usage.total,
+            composite_history=history
+        )
+        self._record(result)
+        return result
+
+    def summary(self) -> Dict[str, Any]:
+        """Convergence statistics over all runs: pass rate, mean rounds, time and tokens, stop reasons"""
+        with self._lock:
+            runs = self.stats["runs"]
+            return {
+                "runs": runs,
+                "pass_rate": self.stats["passed"] / runs if runs else 0.0,
+                "mean_rounds": self.stats["rounds"] / runs if runs else 0.0,
+                "mean_seconds": self.stats["seconds"] / runs if runs else 0.0,
+                "mean_tokens": self.stats["tokens"] / runs if runs else 0.0,
+                "stop_reasons": dict(self.stats["stop_reasons"])
+            }
+
+    def _record(self, result: ImprovementResult):
+        with self._lock:
+            self.stats["runs"] += 1
+            self.stats["passed"] += result.evaluation["passed"]
+            self.stats["rounds"] += result.rounds
+            self.stats["seconds"] += result.elapsed_seconds
+            self.stats["tokens"] += result.tokens
+            self.stats["stop_reasons"][result.stop_reason] += 1
+        telemetry.increment("improve_stops", reason=result.stop_reason)
+        telemetry.observe("improve_rounds", result.rounds)
+        telemetry.observe("improve_seconds", result.elapsed_seconds)
+        telemetry.increment("improve_tokens", result.tokens)
+
+def _rank(evaluation: Dict) -> tuple:
+    return evaluation["passed"], evaluation["composite_score"]
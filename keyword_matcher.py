@@ -0,0 +1,104 @@
+import re
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+# Only plural and third-person endings are generated; any other form ("magical", "exploring")
+# must be listed in the config's "inflections", so "bearing" never counts as "bear"
+SIBILANT_ENDINGS = ("s", "x", "z", "ch", "sh")
+VOWELS = frozenset("aeiou")
+
+class KeywordMatcher:
+    """Single-pass, whole-word keyword matcher compiled from story category keywords.
+
+    Every keyword and its inflected forms are folded into one trie-shaped
+    regular expression, so the input is scanned once no matter how many
+    categories or keywords exist. Matches respect word boundaries ("cat" does
+    not match "education" or "cater"). Plural and third-person forms
+    ("foxes", "puppies", "helps") match automatically; other inflections are
+    taken only from a category's optional "inflections" mapping
+    (keyword -> list of forms), because suffixes such as "-er" and "-ing"
+    turn nouns into unrelated words ("homer", "bearing").
+    """
+
+    def __init__(self, categories: Dict[str, Dict]):
+        self.category_order = list(categories)
+        self.keyword_categories = {}
+        inflections = {}
+        for category, category_config in categories.items():
+            for keyword in category_config["keywords"]:
+                keyword = keyword.lower()
+                owners = self.keyword_categories.setdefault(keyword, [])
+                if category not in owners:
+                    owners.append(category)
+            for keyword, forms in category_config.get("inflections", {}).items():
+                inflections.setdefault(keyword.lower(), []).extend(forms)
+        self.form_keywords = word_forms(self.keyword_categories, inflections)
+        self.pattern = self._compile(self.form_keywords)
+
+    def match(self, text: str) -> Dict[str, int]:
+        """Return keyword hit counts per matching category, in config order"""
+        hits = {}
+        if self.pattern is None:
+            return hits
+        for found in self.pattern.finditer(text.lower()):
+            for category in self.keyword_categories[self.form_keywords[found.group(1)]]:
+                hits[category] = hits.get(category, 0) + 1
+        return {category: hits[category] for category in self.category_order if category in hits}
+
+    def rank(self, text: str) -> List[Tuple[str, int]]:
+        """Return (category, hits) pairs, most hits first; ties keep config order"""
+        return sorted(self.match(text).items(), key=lambda item: -item[1])
+
+    def first(self, text: str) -> str:
+        """The first category in config order with any hit, or "general" """
+        return next(iter(self.match(text)), "general")
+
+    @classmethod
+    def _compile(cls, keywords) -> Optional[re.Pattern]:
+        if not keywords:
+            return None
+        trie = {}
+        for keyword in keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[""] = True
+        return re.compile(r"\b(" + cls._trie_pattern(trie) + r")\b")
+
+    @classmethod
+    def _trie_pattern(cls, node: Dict) -> str:
+        """Render a trie as a regex with shared prefixes factored out"""
+        optional = "" in node
+        alternatives = [
+            re.escape(char) + cls._trie_pattern(child)
+            for char, child in sorted(node.items()) if char != ""
+        ]
+        if not alternatives:
+            return ""
+        if len(alternatives) == 1 and not optional:
+            return alternatives[0]
+        return "(?:" + "|".join(alternatives) + ")" + ("?" if optional else "")
+
+def word_forms(words: Iterable[str], inflections: Optional[Mapping[str, Iterable[str]]] = None) -> Dict[str, str]:
+    """Map every accepted surface form to its word: the word itself, its plural forms and its configured inflections.
+
+    An exact word wins over another word's inflection.
+    """
+    forms = {}
+    words = [word.lower() for word in words]
+    lowered = {word.lower(): extra for word, extra in (inflections or {}).items()}
+    for word in words:
+        for form in _plural_forms(word):
+            forms.setdefault(form, word)
+        for form in lowered.get(word, ()):
+            forms.setdefault(form.lower(), word)
+    forms.update({word: word for word in words})
+    return forms
+
+def _plural_forms(keyword: str) -> Iterator[str]:
+    """The keyword's plural / third-person forms: "fox" -> "foxes", "puppy" -> "puppies", "help" -> "helps" """
+    if keyword.endswith("y") and keyword[-2:-1] not in VOWELS:
+        yield keyword[:-1] + "ies"
+    elif keyword.endswith(SIBILANT_ENDINGS):
+        yield keyword + "es"
+    else:
+        yield keyword + "s"
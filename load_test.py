@@ -0,0 +1,325 @@
+"""
+Concurrent-session load generator for the interactive feedback loop.
+
+Simulates many users of main.py at once, in-process, against the local mock
+LLM server. Each session sends a request from the config test_prompts,
+generates (streamed), judges and improves the story like main.py does, then
+follows a scripted user: after a think time it picks keep, longer, shorter,
+regenerate or custom feedback from `behaviour_mix`. A modified story is
+accepted with probability `accept_after_modify`; otherwise the user picks
+again from the feedback menu for the modified story, as in main.py. Sessions
+end when the story is kept or accepted, or after `max_turns` generate/modify
+turns.
+
+The report covers sessions per second, per-turn latency percentiles (time the
+user waits, think time excluded), time to the first story chunk, tokens per
+session and memory growth traced with tracemalloc, for sizing capacity at
+peak bedtime hours:
+
+    python load_test.py --sessions 200 --concurrency 50 --latency-scale 0.05 --think-scale 0.01
+
+tracemalloc slows allocation-heavy code; pass --no-trace-memory when only the
+latency numbers matter. The warm pool and story library are not used, so
+every session reaches the model.
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import random
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+from benchmark import build_pipeline, latency_summary
+from best_of_n import BestOfNGenerator
+from config_loader import config
+from improvement_controller import ImprovementController
+from main import PRESET_FEEDBACK
+from mock_llm_server import MockLLMServer
+from openai_client import load_openai, model_errors, usage_scope
+from safety_guard import STREAM_RESTART, final_text
+from story_judge import StoryJudge
+from story_teller import StoryTeller
+from telemetry import telemetry
+
+class ScriptedUser:
+    """The choices of one simulated user, drawn from the configured mix with the session's own seed"""
+
+    def __init__(self, settings: Mapping[str, Any], seed: str, think_scale: float):
+        self.random = random.Random(seed)
+        self.behaviours = tuple(settings["behaviour_mix"])
+        self.weights = tuple(settings["behaviour_mix"].values())
+        self.accept_after_modify = settings["accept_after_modify"]
+        self.think_time = settings["think_time"]
+        self.custom_feedback = settings["custom_feedback"]
+        self.think_scale = think_scale
+
+    def choose(self) -> Tuple[str, Optional[str]]:
+        """(behaviour, feedback) for the feedback menu; feedback is None for keep and regenerate"""
+        behaviour = self.random.choices(self.behaviours, self.weights)[0]
+        if behaviour == "longer":
+            return behaviour, PRESET_FEEDBACK["2"]
+        if behaviour == "shorter":
+            return behaviour, PRESET_FEEDBACK["3"]
+        if behaviour == "custom":
+            return behaviour, self.random.choice(self.custom_feedback)
+        return behaviour, None
+
+    def accepts_changes(self) -> bool:
+        """Answer to "Are you happy with these changes?" """
+        return self.random.random() < self.accept_after_modify
+
+    def think(self):
+        """Read the story before answering"""
+        if self.think_time["distribution"] == "lognormal":
+            seconds = self.random.lognormvariate(math.log(self.think_time["median_seconds"]), self.think_time["sigma"])
+        else:
+            seconds = self.think_time["median_seconds"]
+        time.sleep(seconds * self.think_scale)
+
+class MemoryTracker:
+    """Traced memory at the start of the run, after every tenth of the sessions, and at the end"""
+
+    def __init__(self, sessions: int, top_allocations: int):
+        self.sample_every = max(1, sessions // 10)
+        self.top_allocations = top_allocations
+        self.samples = []
+        self.baseline = None
+        self.start_bytes = 0
+
+    def start(self):
+        tracemalloc.start()
+        gc.collect()
+        self.baseline = tracemalloc.take_snapshot()
+        self.start_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    def sample(self, completed: int):
+        if completed % self.sample_every == 0:
+            self.samples.append((completed, tracemalloc.get_traced_memory()[0] - self.start_bytes))
+
+    def stop(self, sessions: int) -> Dict[str, Any]:
+        """Growth still held once the sessions are gone, and the allocation sites that hold most of it"""
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().compare_to(self.baseline, "lineno")[:self.top_allocations]
+        tracemalloc.stop()
+        growth = current - self.start_bytes
+        # Caches fill during the first half; growth that continues in the second half suggests a leak
+        middle = next(((completed, used) for completed, used in self.samples if completed >= sessions / 2), None)
+        late_growth = None
+        if middle and self.samples[-1][0] > middle[0]:
+            late_growth = (self.samples[-1][1] - middle[1]) / (self.samples[-1][0] - middle[0])
+        return {
+            "start_bytes": self.start_bytes,
+            "growth_bytes": growth,
+            "peak_growth_bytes": peak - self.start_bytes,
+            "growth_per_session_bytes": growth / sessions if sessions else 0.0,
+            "late_growth_per_session_bytes": late_growth,
+            "samples": [{"sessions": completed, "growth_bytes": used} for completed, used in self.samples],
+            "top_allocations": [{"site": str(stat.traceback), "growth_bytes": stat.size_diff, "count_diff": stat.count_diff}
+                                for stat in top]
+        }
+
+class LoadTest:
+    """Runs scripted sessions through one StoryTeller/StoryJudge pair, as main.py's loop would"""
+
+    def __init__(self, storyteller: StoryTeller, judge: StoryJudge, settings: Mapping[str, Any],
+                 think_scale: float):
+        self.storyteller = storyteller
+        self.judge = judge
+        self.best_of_n = BestOfNGenerator(storyteller, judge) if config.get_best_of_n_settings()["enabled"] else None
+        self.controller = ImprovementController(storyteller, judge)
+        self.settings = settings
+        self.think_scale = think_scale
+
+    def run_session(self, index: int, prompt: str) -> Dict[str, Any]:
+        """One user from request to kept story; model errors end the session with outcome "error" """
+        user = ScriptedUser(self.settings, f"{self.settings['seed']}:{index}", self.think_scale)
+        turns, first_chunks, behaviours = [], [], []
+        kind, outcome, feedback = "generate", "max_turns", None
+        start = time.perf_counter()
+        with usage_scope() as usage:
+            try:
+                while len(turns) < self.settings["max_turns"]:
+                    turn_start = time.perf_counter()
+                    if kind == "modify":
+                        previous_story = story
+                        chunks, _ = self.storyteller.modify_in_session(session, feedback, stream=True)
+                        final_text(chunks)
+                        story = session.story
+                        evaluation = self.judge.judge_story(story, base=previous_story)
+                    else:
+                        story, category, evaluation, first_chunk = self.generate(prompt)
+                        session = self.storyteller.start_session(prompt, story, category)
+                        if first_chunk is not None:
+                            first_chunks.append(first_chunk)
+                    turns.append((kind, time.perf_counter() - turn_start))
+
+                    user.think()
+                    if kind == "modify":
+                        if user.accepts_changes():
+                            outcome = "accepted"
+                            break
+                        # Like main.py, rejected changes lead to another feedback round on the modified story
+                    behaviour, feedback = user.choose()
+                    behaviours.append(behaviour)
+                    if behaviour == "keep":
+                        outcome = "kept"
+                        break
+                    kind = "regenerate" if feedback is None else "modify"
+            except model_errors():
+                outcome = "error"
+        return {
+            "seconds": time.perf_counter() - start,
+            "tokens": usage.total,
+            "turns": turns,
+            "first_chunks": first_chunks,
+            "behaviours": behaviours,
+            "outcome": outcome
+        }
+
+    def warm_up(self, prompt: str):
+        """Generate and judge one story, so lazy imports and caches set up once are not counted as growth"""
+        try:
+            story, _ = self.storyteller.generate_story(prompt)
+            self.judge.judge_story(story)
+        except model_errors():
+            pass
+
+    def generate(self, prompt: str) -> Tuple[str, str, Dict, Optional[float]]:
+        """main.generate_and_evaluate without the printing; also returns seconds to the first streamed chunk"""
+        start = time.perf_counter()
+        first_chunk = None
+        raced = False
+        with usage_scope() as usage:
+            if self.best_of_n:
+                try:
+                    story, category, _ = self.best_of_n.generate(prompt)
+                    raced = True
+                except RuntimeError:
+                    pass  # No candidate finished; main.py falls back to a single generation too
+            if not raced:
+                chunks, category = self.storyteller.generate_story(prompt, stream=True)
+                story, first_chunk = _read_stream(chunks, start)
+            evaluation = self.judge.judge_story(story)
+        if not raced and not evaluation["passed"]:
+            result = self.controller.improve(story, evaluation, display=lambda chunks, _: final_text(chunks).strip(),
+                                             started=start, spent_tokens=usage.total)
+            story, evaluation = result.story, result.evaluation
+        return story, category, evaluation, first_chunk
+
+def _read_stream(chunks: Iterator, start: float) -> Tuple[str, Optional[float]]:
+    """Join a guarded story stream and time its first chunk of text"""
+    parts, first_chunk = [], None
+    for chunk in chunks:
+        if chunk is STREAM_RESTART:
+            parts = []
+            continue
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - start
+        parts.append(chunk)
+    return "".join(parts).strip(), first_chunk
+
+def run_load_test(load_test: LoadTest, prompts: List[str], sessions: int, concurrency: int,
+                  memory: Optional[MemoryTracker]) -> Dict[str, Any]:
+    """Run `sessions` scripted sessions, `concurrency` at a time, and summarize them"""
+    load_test.warm_up(prompts[0])
+    telemetry.reset()
+    results = []
+    if memory:
+        memory.start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(load_test.run_session, index, prompts[index % len(prompts)])
+                   for index in range(sessions)]
+        for future in as_completed(futures):
+            results.append(future.result())
+            if memory:
+                memory.sample(len(results))
+    wall_seconds = time.perf_counter() - start
+
+    turns = {}
+    for result in results:
+        for kind, seconds in result["turns"]:
+            turns.setdefault(kind, []).append(seconds)
+    return {
+        "sessions": len(results),
+        "wall_seconds": wall_seconds,
+        "sessions_per_second": len(results) / wall_seconds if wall_seconds else 0.0,
+        "session_seconds": latency_summary([result["seconds"] for result in results]),
+        "turn_seconds": {kind: latency_summary(values) for kind, values in sorted(turns.items())},
+        "first_chunk_seconds": latency_summary([seconds for result in results for seconds in result["first_chunks"]]),
+        "turns_per_session": sum(len(result["turns"]) for result in results) / len(results) if results else 0.0,
+        "tokens_per_session": latency_summary([result["tokens"] for result in results]),
+        "outcomes": dict(Counter(result["outcome"] for result in results)),
+        "behaviours": dict(Counter(behaviour for result in results for behaviour in result["behaviours"])),
+        "improvement": load_test.controller.summary(),
+        "memory": memory.stop(len(results)) if memory else None
+    }
+
+def print_report(report: Dict):
+    print(f"\n{'='*80}")
+    print("INTERACTIVE SESSION LOAD TEST (mock LLM server)")
+    print(f"{'='*80}")
+    print(f"\n{report['sessions']} sessions, {report['settings']['concurrency']} concurrent, "
+          f"in {report['wall_seconds']:.1f}s: {report['sessions_per_second']:.2f} sessions/s "
+          f"({report['sessions_per_second'] * 3600:,.0f}/hour)")
+    print(f"   Outcomes: {', '.join(f'{name} {count}' for name, count in sorted(report['outcomes'].items()))}")
+    print(f"   Choices: {', '.join(f'{name} {count}' for name, count in sorted(report['behaviours'].items()))}")
+    print(f"   Turns per session: {report['turns_per_session']:.2f}")
+    session = report["session_seconds"]
+    print(f"   Session length (with think time): p50 {session['p50']:.2f}s  p95 {session['p95']:.2f}s")
+    for name, summary in [*report["turn_seconds"].items(), ("first chunk", report["first_chunk_seconds"])]:
+        print(f"   {name:<12} n={summary['count']:<5} p50 {summary['p50']:.3f}s  "
+              f"p95 {summary['p95']:.3f}s  p99 {summary['p99']:.3f}s")
+    tokens = report["tokens_per_session"]
+    print(f"   Tokens per session: mean {tokens['mean']:,.0f}  p50 {tokens['p50']:,.0f}  p95 {tokens['p95']:,.0f}")
+    memory = report["memory"]
+    if memory:
+        late = memory["late_growth_per_session_bytes"]
+        print(f"   Memory: {memory['growth_bytes'] / 1024:,.0f} KiB retained, "
+              f"peak +{memory['peak_growth_bytes'] / 1024:,.0f} KiB, "
+              f"{memory['growth_per_session_bytes'] / 1024:,.1f} KiB/session"
+              + (f" ({late / 1024:,.1f} KiB/session in the second half)" if late is not None else ""))
+        for allocation in memory["top_allocations"]:
+            print(f"      {allocation['growth_bytes'] / 1024:>+9,.1f} KiB  {allocation['site']}")
+
+def main():
+    settings = config.get_load_test_settings()
+    parser = argparse.ArgumentParser(description="Simulate concurrent interactive sessions against a local mock LLM server")
+    parser.add_argument("--sessions", type=int, default=settings["sessions"], help="Sessions to run")
+    parser.add_argument("--concurrency", type=int, default=settings["concurrency"], help="Sessions running at once")
+    parser.add_argument("--think-scale", type=float, default=1.0, help="Multiplier on the think time distribution")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplier on mock latency distributions")
+    parser.add_argument("--error-rate", type=float, default=None, help="Override mock error rate")
+    parser.add_argument("--use-cache", action="store_true", help="Keep the response cache enabled")
+    parser.add_argument("--no-trace-memory", action="store_true", help="Skip tracemalloc")
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    os.environ["OPENAI_API_KEY"] = "mock-key"
+    prompts = [prompt for prompt_set in config.get_test_prompts().values() for prompt in prompt_set]
+    memory = None if args.no_trace_memory else MemoryTracker(args.sessions, settings["top_allocations"])
+    with MockLLMServer(latency_scale=args.latency_scale, error_rate=args.error_rate) as server:
+        storyteller, judge = build_pipeline(args.use_cache)
+        load_openai().api_base = server.url
+        load_test = LoadTest(storyteller, judge, settings, args.think_scale)
+        report = {
+            "settings": vars(args),
+            **run_load_test(load_test, prompts, args.sessions, args.concurrency, memory),
+            "mock_server": dict(server.stats)
+        }
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,16 @@
+import argparse
+import time
+from openai_client import load_openai, shared_client, usage_scope
 from story_teller import StoryTeller
 from story_judge import StoryJudge
+from best_of_n import BestOfNGenerator
+from improvement_controller import ImprovementController
+from story_library import StoryLibrary
+from story_pool import StoryPool
+from safety_guard import STREAM_RESTART
+from startup_profile import StartupProfiler
 from config_loader import config
+from telemetry import telemetry
 
 """
 Before submitting the assignment, describe here in a few sentences what you would have built next if you spent 2 more hours on this project:
@@ -10,12 +20,16 @@ I would add text-to-audio functionality so children could listen to their bedtim
 
 def print_evaluation(evaluation: dict, category: str):
     """Display story evaluation results"""
-    display_settings = config.get_display_settings()
+    settings = config.snapshot
+    display_settings = settings.display_settings
     
     if not display_settings["show_detailed_metrics"]:
         # Simple display
         print(f"\nStory Category: {category.title()}")
-        print(f"Overall Score: {evaluation['overall_score']:.0f}/100")
+        if evaluation["llm_judge"] is not None:
+            print(f"Overall Score: {evaluation['overall_score']:.0f}/100")
+        else:
+            print(f"Composite Score: {evaluation['composite_score']:.0f}/100")
         return
     
     print("\n" + "="*60)
@@ -24,15 +38,20 @@ def print_evaluation(evaluation: dict, category: str):
     
     print(f"\nStory Category: {category.title()}")
     
-    print("\nLLM Judge Evaluation:")
-    for key, value in evaluation["llm_judge"].items():
-        formatted_key = key.replace("_", " ").title()
-        print(f"   {formatted_key}: {value:.0f}/100")
-    
-    print(f"\nOverall Score: {evaluation['overall_score']:.0f}/100")
+    if evaluation["llm_judge"] is not None:
+        print("\nLLM Judge Evaluation:")
+        for key, value in evaluation["llm_judge"].items():
+            formatted_key = key.replace("_", " ").title()
+            print(f"   {formatted_key}: {value:.0f}/100")
+        
+        print(f"\nOverall Score: {evaluation['overall_score']:.0f}/100")
+    elif evaluation["failed_checks"]:
+        failed = ", ".join(check.replace("_", " ") for check in evaluation["failed_checks"])
+        print(f"\nLLM Judge Evaluation: skipped (failed local checks: {failed})\n")
+    else:
+        print("\nLLM Judge Evaluation: not run (local checks only)\n")
     
-    quality_thresholds = config.get_quality_thresholds()
-    quality_thresholds = config.get_quality_thresholds()
+    quality_thresholds = settings.quality_thresholds
     rating = ("Excellent" if evaluation["composite_score"] >= 90 else
               "Very Good" if evaluation["composite_score"] >= quality_thresholds["min_composite_score"] + 10 else
               "Good" if evaluation["composite_score"] >= quality_thresholds["min_composite_score"] else
@@ -45,20 +64,37 @@ def print_evaluation(evaluation: dict, category: str):
     print(f"   • Content safety: {evaluation['metrics']['safety']:.1f}/100")
     print(f"   • Composite Score: {evaluation['composite_score']:.1f}/100")
     
-    story_settings = config.get_story_settings()
-    print(f"\nStory Length: {evaluation['metrics']['word_count']} words (target: {story_settings['min_word_count']}-{story_settings['max_word_count']})")
+    min_words, max_words = settings.word_count_range
+    print(f"\nStory Length: {evaluation['metrics']['word_count']} words (target: {min_words}-{max_words})")
     print("="*60)
 
 def needs_improvement(evaluation: dict) -> bool:
-    """Check if story needs improvement"""
-    quality_thresholds = config.get_quality_thresholds()
-    story_settings = config.get_story_settings()
-    
-    return (evaluation["composite_score"] < quality_thresholds["min_composite_score"] or 
-            evaluation["metrics"]["word_count"] < story_settings["min_word_count"] or 
-            evaluation["metrics"]["word_count"] > story_settings["max_word_count"] or
-            evaluation["metrics"]["grade_level"] > story_settings["max_grade_level"] or
-            evaluation["metrics"]["grade_level"] < story_settings["min_grade_level"])
+    """Check if story needs improvement, using the judge's local gate result"""
+    return not evaluation["passed"]
+
+def display_stream(chunks) -> str:
+    """Print story chunks as they arrive and return the full story text"""
+    parts = []
+    for chunk in chunks:
+        if chunk is STREAM_RESTART:
+            # The safety guard stopped this draft; a gentler one follows
+            print("\n\n[That draft was getting too scary, starting a gentler one...]\n")
+            parts = []
+            continue
+        print(chunk, end="", flush=True)
+        parts.append(chunk)
+    print()
+    return "".join(parts).strip()
+
+# Feedback sent for menu choices 2-7 of get_user_feedback
+PRESET_FEEDBACK = {
+    "2": "Please make this story longer with more details and description.",
+    "3": "Please make this story shorter and more concise.",
+    "4": "Please make this story more exciting with more adventure and action.",
+    "5": "Please make this story calmer and more gentle for bedtime.",
+    "6": "Please add more characters to make the story more interesting.",
+    "7": "Please change the setting to somewhere different and interesting."
+}
 
 def get_user_feedback(story: str, category: str):
     """Get user feedback on the generated story"""
@@ -80,18 +116,8 @@ def get_user_feedback(story: str, category: str):
         
         if choice == "1":
             return None, "keep"
-        elif choice == "2":
-            return "Please make this story longer with more details and description.", "modify"
-        elif choice == "3":
-            return "Please make this story shorter and more concise.", "modify"
-        elif choice == "4":
-            return "Please make this story more exciting with more adventure and action.", "modify"
-        elif choice == "5":
-            return "Please make this story calmer and more gentle for bedtime.", "modify"
-        elif choice == "6":
-            return "Please add more characters to make the story more interesting.", "modify"
-        elif choice == "7":
-            return "Please change the setting to somewhere different and interesting.", "modify"
+        elif choice in PRESET_FEEDBACK:
+            return PRESET_FEEDBACK[choice], "modify"
         elif choice == "8":
             custom_feedback = input("What would you like me to change about the story? ")
             return custom_feedback, "modify"
@@ -100,10 +126,146 @@ def get_user_feedback(story: str, category: str):
         else:
             print("Please enter a number between 1-9.")
 
+def handle_feedback(storyteller: StoryTeller, judge: StoryJudge, library: StoryLibrary, session,
+                    feedback: str, action: str, evaluation: dict, stored: bool):
+    """Act on one feedback choice for the session's story and return (approved, evaluation).
+    
+    A modification is applied in the session, so a "no" leads to another
+    feedback round on the modified story instead of a new story. `stored`
+    says the story shown came from the library, so keeping it stores nothing.
+    """
+    if action == "keep":
+        if not stored:
+            library.add(session.request, session.category, session.story, evaluation)
+        print("\n Great! Glad you enjoyed your story!")
+        return True, evaluation
+    if action == "regenerate":
+        telemetry.increment("regenerate_loops")
+        print("\n Let's create a completely new story...")
+        return False, evaluation
+    
+    telemetry.increment("modify_loops")
+    print(f"\n Modifying story based on your feedback...")
+    previous_story = session.story
+    chunks, patched = storyteller.modify_in_session(session, feedback, stream=True)
+    print("\n" + "="*60)
+    print("MODIFIED STORY" + (" (only the affected paragraphs were rewritten)" if patched else ""))
+    print("="*60)
+    display_stream(chunks)
+    
+    # Re-evaluate modified story; unchanged paragraphs reuse their cached metrics
+    evaluation = judge.judge_story(session.story, base=previous_story)
+    print_evaluation(evaluation, session.category)
+    
+    # Ask if they're satisfied with the changes
+    satisfied = input("\nAre you happy with these changes? (yes/no): ").lower().strip()
+    if satisfied in ['yes', 'y']:
+        library.add(session.request, session.category, session.story, evaluation)
+        print("\n Perfect! Enjoy your customized bedtime story!")
+        return True, evaluation
+    print("\n Let's try different changes...")
+    return False, evaluation
+
+def display_improvement(chunks, round_number: int) -> str:
+    """Stream one improvement round under its own heading"""
+    print("Improving story based on evaluation...")
+    print("\n" + "="*60)
+    print("IMPROVED BEDTIME STORY" + (f" (pass {round_number})" if round_number > 1 else ""))
+    print("="*60)
+    return display_stream(chunks)
+
+def generate_and_evaluate(storyteller: StoryTeller, judge: StoryJudge, best_of_n, controller: ImprovementController,
+                          user_input: str):
+    """Generate a story (best-of-N or streamed), judge it and improve it within the budget if needed"""
+    start = time.perf_counter()
+    with usage_scope() as usage:
+        story, category, evaluation, raced = _generate_and_judge(storyteller, judge, best_of_n, user_input)
+    
+    # Best-of-N already fell back to its best candidate, so skip the serial improve loop
+    if not raced and needs_improvement(evaluation):
+        result = controller.improve(story, evaluation, display=display_improvement,
+                                    started=start, spent_tokens=usage.total)
+        print(f"\nImprovement stopped after {result.rounds} pass(es): {result.stop_reason.replace('_', ' ')}")
+        if result.best_round != result.rounds:
+            # A later pass scored worse, so the story shown last is not the one kept
+            print("Keeping the " + (f"pass {result.best_round} version" if result.best_round else "original story") + ":")
+            print(result.story)
+        story, evaluation = result.story, result.evaluation
+    return story, category, evaluation
+
+def _generate_and_judge(storyteller: StoryTeller, judge: StoryJudge, best_of_n, user_input: str):
+    """Return (story, category, evaluation, raced); raced is False when best-of-N is off or had no candidate"""
+    print("\nGenerating your bedtime story...")
+    raced = False
+    if best_of_n:
+        try:
+            story, category, _ = best_of_n.generate(user_input)
+            raced = True
+        except RuntimeError:
+            print("No best-of-N candidate finished in time, generating a single story instead...")
+    if raced:
+        print(f"Story Category: {category.title()}")
+        print("\n" + "="*60)
+        print("YOUR BEDTIME STORY")
+        print("="*60)
+        print(story)
+    else:
+        chunks, category = storyteller.generate_story(user_input, stream=True)
+        print(f"Story Category: {category.title()}")
+        print("\n" + "="*60)
+        print("YOUR BEDTIME STORY")
+        print("="*60)
+        story = display_stream(chunks)
+    
+    print("\nEvaluating story quality...")
+    return story, category, judge.judge_story(story), raced
+
+def export_telemetry():
+    """Write the telemetry snapshot configured in telemetry settings"""
+    telemetry_settings = config.get_telemetry_settings()
+    if telemetry_settings["enabled"] and telemetry_settings["export_path"]:
+        telemetry.export(telemetry_settings["export_path"], telemetry_settings["export_format"])
+
+def profile_startup():
+    """Report what a cold start of the CLI costs, step by step"""
+    profiler = StartupProfiler("main")
+    with profiler.step("config_loader: read and compile config.json"):
+        library_settings = config.get_story_library_settings()
+    with profiler.step("openai_client: shared client (response cache, scheduler)"):
+        client = shared_client()
+    with profiler.step("story_teller: StoryTeller"):
+        storyteller = StoryTeller(client)
+    with profiler.step("story_judge: StoryJudge"):
+        judge = StoryJudge(client)
+    with profiler.step("story_library: open SQLite store, load LSH index"):
+        StoryLibrary(library_settings)
+    with profiler.step("story_pool: StoryPool (workers not started)"):
+        StoryPool(storyteller, judge, config.get_story_pool_settings(), library_settings["stopwords"])
+    with profiler.step("openai: SDK import on the first model call"):
+        load_openai()
+    with profiler.step("textstat: dictionaries loaded by the first evaluation"):
+        judge.evaluate_locally("The sleepy cat curled up by the fire and closed her eyes.")
+    profiler.print_report()
+
 def main():
     """Main application loop"""
-    storyteller = StoryTeller()
-    judge = StoryJudge()
+    parser = argparse.ArgumentParser(description="Interactive bedtime story generator")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Report import and initialization cost per module, then exit")
+    if parser.parse_args().profile_startup:
+        profile_startup()
+        return
+    
+    client = shared_client()
+    storyteller = StoryTeller(client)
+    judge = StoryJudge(client)
+    best_of_n = BestOfNGenerator(storyteller, judge) if config.get_best_of_n_settings()["enabled"] else None
+    controller = ImprovementController(storyteller, judge)
+    library_settings = config.get_story_library_settings()
+    library = StoryLibrary(library_settings)
+    user_id = library_settings["default_user_id"]
+    pool = StoryPool(storyteller, judge, config.get_story_pool_settings(), library_settings["stopwords"])
+    pool.start()
     
     print("Welcome to the Bedtime Story Generator for Ages 5-10!")
     print("I create personalized bedtime stories with quality evaluation.")
@@ -131,59 +293,53 @@ def main():
         user_input = input("What kind of story would you like to hear? ")
         
         if user_input.lower().strip() == 'quit':
+            pool.stop()
+            export_telemetry()
             print("Thank you for using the Bedtime Story Generator! Sweet dreams!")
             break
         
         # Story generation and improvement loop
         story_approved = False
+        reuse_stored = True
+        session = None
         while not story_approved:
-            print("\nGenerating your bedtime story...")
-            story, category = storyteller.generate_story(user_input)
-            
-            print(f"Story Category: {category.title()}")
-            print("\nEvaluating story quality...")
-            evaluation = judge.judge_story(story)
-            
-            if needs_improvement(evaluation):
-                print("Improving story based on evaluation...")
-                story = storyteller.improve_story(story, evaluation)
-                evaluation = judge.judge_story(story)
-            
-            print("\n" + "="*60)
-            print("YOUR BEDTIME STORY")
-            print("="*60)
-            print(story)
-            
-            print_evaluation(evaluation, category)
+            if session is None:
+                # A bare category request is answered from the warm pool, and a close
+                # enough, well-rated earlier story from the library, without any model call
+                pooled = pool.take(user_input) if reuse_stored else None
+                match = library.find_similar(user_input, user_id) if reuse_stored and not pooled else None
+                if pooled:
+                    story, category, evaluation = pooled
+                    print(f"\nStory Category: {category.title()}")
+                    print("\n" + "="*60)
+                    print("YOUR BEDTIME STORY")
+                    print("="*60)
+                    print(story)
+                elif match:
+                    story, category, evaluation = match["story"], match["category"], match["evaluation"]
+                    library.record_delivery(match["id"], user_id)
+                    print(f"\nFound a matching story in the library (request: '{match['request']}')")
+                    print(f"Story Category: {category.title()}")
+                    print("\n" + "="*60)
+                    print("YOUR BEDTIME STORY")
+                    print("="*60)
+                    print(story)
+                else:
+                    story, category, evaluation = generate_and_evaluate(storyteller, judge, best_of_n, controller, user_input)
+                
+                print_evaluation(evaluation, category)
+                # Kept until the story is approved or replaced, so every feedback round sees the earlier ones
+                session = storyteller.start_session(user_input, story, category)
+                stored = match is not None
             
             # Get user feedback
-            feedback, action = get_user_feedback(story, category)
-            
-            if action == "keep":
-                story_approved = True
-                print("\n Great! Glad you enjoyed your story!")
-            elif action == "regenerate":
-                print("\n Let's create a completely new story...")
-                continue
+            feedback, action = get_user_feedback(session.story, session.category)
+            story_approved, evaluation = handle_feedback(storyteller, judge, library, session, feedback, action,
+                                                         evaluation, stored)
+            if action == "regenerate":
+                session, reuse_stored = None, False
             elif action == "modify":
-                print(f"\n Modifying story based on your feedback...")
-                story = storyteller.modify_story_with_feedback(story, feedback, category)
-                print("\n" + "="*60)
-                print("MODIFIED STORY")
-                print("="*60)
-                print(story)
-                
-                # Re-evaluate modified story
-                evaluation = judge.judge_story(story)
-                print_evaluation(evaluation, category)
-                
-                # Ask if they're satisfied with the changes
-                satisfied = input("\nAre you happy with these changes? (yes/no): ").lower().strip()
-                if satisfied in ['yes', 'y']:
-                    story_approved = True
-                    print("\n Perfect! Enjoy your customized bedtime story!")
-                else:
-                    print("\n Let's try different changes...")
+                stored = False
         
         print("\n" + "="*60)
         print("READY FOR ANOTHER STORY!")
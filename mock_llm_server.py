@@ -0,0 +1,235 @@
+"""
+Local stand-in for the OpenAI chat-completions endpoint.
+
+Story prompts are answered with recorded stories (matched on the user request
+when possible), judge prompts (single or batched) with fixed scores. Latency
+and error rate follow the mock_llm_server settings in config.json, so the real
+StoryTeller/StoryJudge pipeline can be benchmarked without network access.
+"""
+
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List
+from config_loader import config
+
+USER_REQUEST_PATTERN = re.compile(r"User request: (.+)")
+PARAGRAPH_NUMBER_PATTERN = re.compile(r"^\[(\d+)\] ", re.MULTILINE)
+CHUNK_PATTERN = re.compile(r"\S+\s*")
+BATCH_STORY_ID_PATTERN = re.compile(r'<story id="(\d+)">')
+
+class MockLLMServer:
+    """Threaded HTTP server that replays recorded stories with simulated latency and errors"""
+
+    def __init__(self, settings: Dict[str, Any] = None, latency_scale: float = 1.0, error_rate: float = None):
+        self.settings = settings or config.get_mock_server_settings()
+        self.latency_scale = latency_scale
+        self.error_rate = self.settings["error_rate"] if error_rate is None else error_rate
+        self.recordings = self._load_recordings(self.settings["recordings_path"])
+        self.by_request = {record["request"].strip().lower(): record["story"] for record in self.recordings}
+        self.random = random.Random(self.settings["seed"])
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "streams": 0}
+
+        self.httpd = ThreadingHTTPServer((self.settings["host"], self.settings["port"]), _MockHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def sample_latency(self, kind: str) -> float:
+        """Draw a response latency in seconds from the configured distribution"""
+        latency = self.settings[f"{kind}_latency"]
+        with self.lock:
+            if latency["distribution"] == "lognormal":
+                value = self.random.lognormvariate(math.log(latency["median_seconds"]), latency["sigma"])
+            else:
+                value = latency["median_seconds"]
+        return value * self.latency_scale
+
+    def count(self, name: str):
+        with self.lock:
+            self.stats[name] += 1
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def pick_error_status(self) -> int:
+        with self.lock:
+            return self.random.choice(self.settings["error_statuses"])
+
+    def respond_to(self, prompt: str):
+        """Return (kind, content) for a prompt: judge scores, a paragraph patch or a recorded story"""
+        if "Rate this bedtime story" in prompt:
+            return "judge", ", ".join(str(score) for score in self.settings["judge_scores"])
+        if "Rate each of these bedtime stories" in prompt:
+            return "judge", self._batch_scores_for(prompt)
+        if "Current story paragraphs:" in prompt:
+            return "patch", self._patch_for(prompt)
+        request = USER_REQUEST_PATTERN.search(prompt)
+        if request and request.group(1).strip().lower() in self.by_request:
+            return "story", self.by_request[request.group(1).strip().lower()]
+        # Improvements, modifications and unknown requests get a stable pick per prompt
+        index = int(hashlib.sha1(prompt.encode("utf-8")).hexdigest(), 16) % len(self.recordings)
+        return "story", self.recordings[index]["story"]
+
+    def _batch_scores_for(self, prompt: str) -> str:
+        """JSON scores for every <story id="N"> block in a batch judge prompt"""
+        fields = ("age_appropriateness", "bedtime_suitability", "story_structure",
+                  "engagement", "originality", "educational_value")
+        scores = [{"id": int(story_id), **dict(zip(fields, self.settings["judge_scores"]))}
+                  for story_id in BATCH_STORY_ID_PATTERN.findall(prompt)]
+        return json.dumps({"scores": scores})
+
+    def _patch_for(self, prompt: str) -> str:
+        """Replace the story's last paragraph with the closing paragraph of a recorded story"""
+        paragraph_count = max(int(number) for number in PARAGRAPH_NUMBER_PATTERN.findall(prompt))
+        index = int(hashlib.sha1(prompt.encode("utf-8")).hexdigest(), 16) % len(self.recordings)
+        closing = self.recordings[index]["story"].strip().split("\n\n")[-1]
+        return json.dumps({"edits": [{"op": "replace", "paragraph": paragraph_count, "text": closing}]})
+
+    @staticmethod
+    def _load_recordings(path: str) -> List[Dict[str, str]]:
+        recordings_path = os.path.join(os.path.dirname(__file__), path)
+        with open(recordings_path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+    def do_POST(self):
+        mock = self.server.mock
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+
+        prompt = "\n".join(message.get("content", "") for message in body.get("messages", []))
+        kind, content = mock.respond_to(prompt)
+        latency = mock.sample_latency(kind)
+        mock.count("requests")
+
+        if mock.should_fail():
+            mock.count("errors")
+            time.sleep(latency * mock.settings["error_latency_fraction"])
+            status = mock.pick_error_status()
+            error_type = "rate_limit_error" if status == 429 else "server_error"
+            self._send_json(status, {"error": {"message": "Simulated failure", "type": error_type}})
+            return
+
+        # Respect max_tokens so truncation paths are exercised. Each word chunk counts
+        # as one token, matching the usage block and the one-word stream deltas
+        words = CHUNK_PATTERN.findall(content)
+        token_budget = int(body.get("max_tokens") or 1e9)
+        finish_reason = "stop"
+        if len(words) > token_budget:
+            content, finish_reason = "".join(words[:token_budget]).rstrip(), "length"
+
+        if body.get("stream"):
+            mock.count("streams")
+            self._stream(body, prompt, content, latency, finish_reason)
+        else:
+            time.sleep(latency)
+            self._send_json(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": finish_reason
+                }],
+                "usage": _usage(prompt, content)
+            })
+
+    def _stream(self, body: Dict, prompt: str, content: str, latency: float, finish_reason: str):
+        """Send the content as server-sent events, one word per chunk, spread over the latency.
+
+        With stream_options.include_usage, a last chunk without choices carries the usage block.
+        """
+        chunks = CHUNK_PATTERN.findall(content) or [content]
+        first_chunk_delay = latency * self.server.mock.settings["first_chunk_fraction"]
+        per_chunk_delay = (latency - first_chunk_delay) / len(chunks)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        time.sleep(first_chunk_delay)
+        try:
+            for index, chunk in enumerate(chunks):
+                if index:
+                    time.sleep(per_chunk_delay)
+                self._send_event(body, {"content": chunk}, None)
+            self._send_event(body, {}, finish_reason)
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self._write_event({**self._event_fields(body), "choices": [], "usage": _usage(prompt, content)})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client stopped reading early, as an aborted stream does
+
+    def _send_event(self, body: Dict, delta: Dict, finish_reason):
+        self._write_event({
+            **self._event_fields(body),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        })
+
+    @staticmethod
+    def _event_fields(body: Dict) -> Dict:
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "mock")
+        }
+
+    def _write_event(self, event: Dict):
+        self.wfile.write(b"data: " + json.dumps(event).encode("utf-8") + b"\n\n")
+        self.wfile.flush()
+
+    def _send_json(self, status: int, payload: Dict):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def _usage(prompt: str, content: str) -> Dict[str, int]:
+    """Usage block counting one token per word chunk, like the one-word stream deltas"""
+    completion_tokens = len(CHUNK_PATTERN.findall(content))
+    return {"prompt_tokens": len(prompt) // 4, "completion_tokens": completion_tokens,
+            "total_tokens": len(prompt) // 4 + completion_tokens}
@@ -1,28 +1,511 @@
+import contextvars
+import json
 import os
-import openai
-from dotenv import load_dotenv
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
 from config_loader import config
+from backends import Backend, BackendRouter
+from response_cache import ResponseCache, make_cache_key
+from request_scheduler import RequestScheduler, RequestDeadlineExceeded, INTERACTIVE
+from telemetry import telemetry
+from token_sizer import TokenSizer
+
+if TYPE_CHECKING:
+    import aiohttp
+
+# openai (and the aiohttp and requests stacks under it) take ~0.4s to import, so
+# it is loaded on the first model call; cached answers and local-only runs never pay for it
+_openai = None
+_openai_lock = threading.Lock()
+
+def load_openai():
+    """Import openai and apply the API key and api_base, once per process"""
+    global _openai
+    if _openai is None:
+        with _openai_lock:
+            if _openai is None:
+                import openai
+                from dotenv import load_dotenv
+                load_dotenv()
+                openai.api_key = os.getenv("OPENAI_API_KEY")
+                api_base = config.snapshot.openai_settings["api_base"]
+                if api_base:
+                    # Any OpenAI-compatible endpoint, e.g. a local model server or the benchmark mock
+                    openai.api_base = api_base
+                _openai = openai
+    return _openai
+
+@lru_cache(maxsize=None)
+def retryable_errors() -> Tuple[type, ...]:
+    """Transient API failures worth retrying; anything else surfaces immediately"""
+    error = load_openai().error
+    return (
+        error.RateLimitError,
+        error.APIError,
+        error.Timeout,
+        error.APIConnectionError,
+        error.ServiceUnavailableError,
+        error.TryAgain,
+    )
+
+@lru_cache(maxsize=None)
+def model_errors() -> Tuple[type, ...]:
+    """Everything a model call can raise once the scheduler has given up on it"""
+    return (load_openai().error.OpenAIError, RequestDeadlineExceeded)
+
+class TokenUsage:
+    """Prompt and completion tokens spent by the model calls made inside a usage_scope()"""
+
+    def __init__(self, parent: Optional["TokenUsage"] = None):
+        self.parent = parent
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    @property
+    def total(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, kind: str, amount: int):
+        """Count tokens here and in every enclosing scope"""
+        usage = self
+        while usage is not None:
+            setattr(usage, kind, getattr(usage, kind) + amount)
+            usage = usage.parent
+
+_usage = contextvars.ContextVar("token_usage", default=None)
+_private_session = contextvars.ContextVar("aiohttp_session", default=None)
+
+@contextmanager
+def usage_scope() -> Iterator[TokenUsage]:
+    """Count the tokens of every model call made in this block (and this thread or task).
+
+    Cached answers cost nothing. Streamed calls are counted as their chunks
+    are consumed, so consume streams inside the block.
+    """
+    usage = TokenUsage(_usage.get())
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+def _count_tokens(kind: str, amount: int, call_site: str):
+    telemetry.increment(kind, amount, call_site=call_site)
+    usage = _usage.get()
+    if usage is not None:
+        usage.add(kind, amount)
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+def shared_client() -> "OpenAIClient":
+    """The process-wide client, so every component shares one cache, scheduler and connection pool"""
+    global _shared_client
+    if _shared_client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                _shared_client = OpenAIClient()
+    return _shared_client
 
 class OpenAIClient:
-    
+
     def __init__(self):
-        load_dotenv()
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-        self.openai_settings = config.get_openai_settings()
-    
-    def call_model(self, prompt: str, max_tokens: int = None, temperature: float = None) -> str:
-        """ OpenAI API calls using configuration defaults """
+        self.cache = ResponseCache(config.get_response_cache_settings())
+        self.scheduler = RequestScheduler(config.get_scheduler_settings(), retryable_errors)
+        self.sizer = TokenSizer(config.get_token_sizing_settings())
+        self.router = BackendRouter(config.get_backend_settings(), self.openai_settings, retryable_errors)
+        self._session = None
+
+    @property
+    def openai_settings(self):
+        """Model settings from the current config snapshot; the connection pool, api_base and backends are fixed at startup"""
+        return config.snapshot.openai_settings
+
+    def call_model(self, prompt: str, max_tokens: int = None, temperature: float = None, stream: bool = False,
+                   priority: int = INTERACTIVE, call_site: str = "generic", category: str = None):
+        """ OpenAI API calls using configuration defaults.
+
+        With stream=True, returns an iterator of text chunks as they arrive
+        instead of the complete response string. Calls go through the request
+        scheduler; `priority` picks the lane (interactive or batch) and
+        `call_site` labels the call's latency and token telemetry. Without
+        max_tokens, the limit is sized from earlier completions of the same
+        call site and story `category` (see TokenSizer).
+        """
+        return self.call_chat([{"role": "user", "content": prompt}], max_tokens, temperature,
+                              stream=stream, priority=priority, call_site=call_site, category=category)
+
+    def call_chat(self, messages: List[Dict[str, str]], max_tokens: int = None, temperature: float = None,
+                  stream: bool = False, priority: int = INTERACTIVE, call_site: str = "generic",
+                  category: str = None):
+        """Like call_model, but sends a full message history (system, user and assistant turns)"""
         # Use config defaults if not specified
-        if max_tokens is None:
-            max_tokens = self.openai_settings["max_tokens"]
+        sizing, max_tokens, limit = self._sizing(max_tokens, call_site, category, stream)
+        if temperature is None:
+            temperature = self.openai_settings["temperature"]
+
+        # Keyed on the configured max_tokens, so a sized limit does not split the cache
+        key, cached = self._cache_lookup(messages, max_tokens, temperature)
+        if cached is not None:
+            telemetry.increment("model_calls", call_site=call_site, source="cache")
+            return iter([cached]) if stream else cached
+        telemetry.increment("model_calls", call_site=call_site, source="api")
+
+        def create(limit: int = limit):
+            def request(backend: Backend):
+                resp = load_openai().ChatCompletion.create(
+                    messages=messages,
+                    stream=stream,
+                    max_tokens=limit,
+                    temperature=temperature,
+                    **self._stream_options(stream),
+                    **backend.request_options(),
+                )
+                return _first_chunk_ready(resp) if stream else resp
+
+            def admit(wait: bool) -> bool:
+                # Each duplicate or failover request is charged to the rate budget like the first
+                tokens = self._estimate_tokens(messages, limit)
+                if not wait:
+                    return self.scheduler.try_acquire(tokens)
+                self.scheduler.acquire(priority, tokens, time.monotonic() + self.scheduler.deadline_seconds)
+                return True
+            return self.router.call(request, call_site, stream, admit,
+                                    lambda resp: self._record_discarded(call_site, messages, resp, stream))
+
+        def complete():
+            resp = create()
+            self._record_usage(call_site, resp)
+            truncated = self._record_finish(call_site, resp, sizing, limit)
+            if truncated and limit < max_tokens:
+                # Cut off by a sized limit rather than the configured one: ask again with the full limit
+                self.scheduler.acquire(priority, self._estimate_tokens(messages, max_tokens),
+                                       time.monotonic() + self.scheduler.deadline_seconds)
+                resp = create(max_tokens)
+                self._record_usage(call_site, resp)
+                truncated = self._record_finish(call_site, resp, sizing, max_tokens)
+            return resp.choices[0].message["content"], truncated
+
+        tokens = self._estimate_tokens(messages, limit)
+        if stream:
+            start = time.perf_counter()
+            resp = self.scheduler.run(create, priority=priority, tokens=tokens)
+            return self._iter_stream(resp, key, call_site, start, sizing, limit, _prompt_chars(messages) // 4)
+        # Identical deterministic calls already in flight share one response
+        with telemetry.span("call_model", call_site=call_site):
+            content, truncated = self.scheduler.run(complete, key=key, priority=priority, tokens=tokens)
+        if key is not None and self.cache.enabled and not truncated:
+            self.cache.put(key, content)
+        return content
+
+    async def acall_model(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                          stream: bool = False, priority: int = INTERACTIVE, call_site: str = "generic",
+                          category: str = None):
+        """ Async OpenAI API call over the client's shared keep-alive connection pool.
+
+        With stream=True, returns an async iterator of text chunks.
+        """
+        return await self.acall_chat([{"role": "user", "content": prompt}], max_tokens, temperature,
+                                     stream=stream, priority=priority, call_site=call_site, category=category)
+
+    async def acall_chat(self, messages: List[Dict[str, str]], max_tokens: int = None, temperature: float = None,
+                         stream: bool = False, priority: int = INTERACTIVE, call_site: str = "generic",
+                         category: str = None):
+        """Async variant of call_chat"""
+        sizing, max_tokens, limit = self._sizing(max_tokens, call_site, category, stream)
         if temperature is None:
             temperature = self.openai_settings["temperature"]
-            
-        resp = openai.ChatCompletion.create(
-            model=self.openai_settings["model"],
-            messages=[{"role": "user", "content": prompt}],
-            stream=False,
-            max_tokens=max_tokens,
-            temperature=temperature,
+
+        key, cached = self._cache_lookup(messages, max_tokens, temperature)
+        if cached is not None:
+            telemetry.increment("model_calls", call_site=call_site, source="cache")
+            return self._aiter_cached(cached) if stream else cached
+        telemetry.increment("model_calls", call_site=call_site, source="api")
+
+        async def acreate(limit: int = limit):
+            async def request(backend: Backend):
+                openai = load_openai()
+                # openai reads the aiohttp session from a context variable, so scope it to this call
+                token = openai.aiosession.set(self._get_session())
+                try:
+                    resp = await openai.ChatCompletion.acreate(
+                        messages=messages,
+                        stream=stream,
+                        max_tokens=limit,
+                        temperature=temperature,
+                        **self._stream_options(stream),
+                        **backend.request_options(),
+                    )
+                finally:
+                    openai.aiosession.reset(token)
+                return await _afirst_chunk_ready(resp) if stream else resp
+
+            async def aadmit(wait: bool) -> bool:
+                tokens = self._estimate_tokens(messages, limit)
+                if not wait:
+                    return self.scheduler.try_acquire(tokens)
+                await self.scheduler.aacquire(priority, tokens, time.monotonic() + self.scheduler.deadline_seconds)
+                return True
+            return await self.router.acall(request, call_site, stream, aadmit,
+                                           lambda resp: self._record_discarded(call_site, messages, resp, stream))
+
+        async def acomplete():
+            resp = await acreate()
+            self._record_usage(call_site, resp)
+            truncated = self._record_finish(call_site, resp, sizing, limit)
+            if truncated and limit < max_tokens:
+                await self.scheduler.aacquire(priority, self._estimate_tokens(messages, max_tokens),
+                                              time.monotonic() + self.scheduler.deadline_seconds)
+                resp = await acreate(max_tokens)
+                self._record_usage(call_site, resp)
+                truncated = self._record_finish(call_site, resp, sizing, max_tokens)
+            return resp.choices[0].message["content"], truncated
+
+        tokens = self._estimate_tokens(messages, limit)
+        if stream:
+            start = time.perf_counter()
+            resp = await self.scheduler.arun(acreate, priority=priority, tokens=tokens)
+            return self._aiter_stream(resp, key, call_site, start, sizing, limit, _prompt_chars(messages) // 4)
+        with telemetry.span("call_model", call_site=call_site):
+            content, truncated = await self.scheduler.arun(acomplete, key=key, priority=priority, tokens=tokens)
+        if key is not None and self.cache.enabled and not truncated:
+            self.cache.put(key, content)
+        return content
+
+    def cached_response(self, prompt: str, max_tokens: int, temperature: float) -> Optional[str]:
+        """The cached response to a call_model call, or None; never calls the API"""
+        return self._cache_lookup([{"role": "user", "content": prompt}], max_tokens, temperature)[1]
+
+    async def aclose(self):
+        """Close the shared connection pool used by async calls"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @asynccontextmanager
+    async def private_session(self) -> AsyncIterator[None]:
+        """Send the async calls made in this block (and this task) through a pool of their own.
+
+        For callers that run a short-lived event loop with asyncio.run while
+        other threads use the client: the shared pool is left open, and the
+        private one is closed on exit.
+        """
+        session = self._new_session()
+        token = _private_session.set(session)
+        try:
+            yield
+        finally:
+            _private_session.reset(token)
+            await session.close()
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        """Create the pooled aiohttp session on first use (must run inside an event loop)"""
+        session = _private_session.get()
+        if session is not None:
+            return session
+        if self._session is None or self._session.closed:
+            self._session = self._new_session()
+        return self._session
+
+    def _new_session(self) -> "aiohttp.ClientSession":
+        import aiohttp
+        pool_settings = self.openai_settings["connection_pool"]
+        connector = aiohttp.TCPConnector(
+            limit=pool_settings["max_connections"],
+            keepalive_timeout=pool_settings["keepalive_timeout"],
         )
-        return resp.choices[0].message["content"]
+        return aiohttp.ClientSession(connector=connector)
+
+    def _cache_lookup(self, messages: List[Dict[str, str]], max_tokens: int,
+                      temperature: float) -> Tuple[Optional[str], Optional[str]]:
+        """Return (request key, cached response).
+
+        The key is None for high-temperature calls, which are meant to vary and
+        so are neither cached nor coalesced with identical in-flight calls.
+        """
+        if temperature > self.cache.max_cacheable_temperature:
+            if self.cache.enabled:
+                self.cache.record_bypass()
+            return None, None
+        # A lone user message keys on its text, so single-prompt entries stay valid
+        if len(messages) == 1 and messages[0]["role"] == "user":
+            prompt = messages[0]["content"]
+        else:
+            prompt = json.dumps(messages, ensure_ascii=False)
+        key = make_cache_key(self.openai_settings["model"], prompt, temperature, max_tokens)
+        if not self.cache.enabled:
+            return key, None
+        return key, self.cache.get(key)
+
+    def _sizing(self, max_tokens: Optional[int], call_site: str, category: Optional[str],
+                stream: bool) -> Tuple[Optional[Tuple[str, Optional[str]]], int, int]:
+        """Return (sizer key or None, configured max_tokens, limit to send).
+
+        Only calls that leave max_tokens to the configuration are sized; an
+        explicit max_tokens is sent as given. Streams are shown as they arrive,
+        so a cut-off stream could not be asked again unseen: they are sent the
+        configured max_tokens and only feed the sizer. Callers that wait for a
+        whole story (the guarded non-streaming paths in StoryTeller) therefore
+        call without stream.
+        """
+        if max_tokens is not None:
+            return None, max_tokens, max_tokens
+        ceiling = self.openai_settings["max_tokens"]
+        limit = ceiling if stream else self.sizer.limit(call_site, category, ceiling)
+        return (call_site, category), ceiling, limit
+
+    def _stream_options(self, stream: bool) -> Dict[str, Any]:
+        """Ask a stream for a final usage chunk, so its completion tokens are counted exactly"""
+        if stream and config.snapshot.sections["token_sizing"]["stream_usage"]:
+            return {"stream_options": {"include_usage": True}}
+        return {}
+
+    def _record_finish(self, call_site: str, resp, sizing: Optional[Tuple[str, Optional[str]]], limit: int) -> bool:
+        """Feed a finished non-streaming completion to the sizer; returns whether max_tokens cut it off"""
+        truncated = resp.choices[0].get("finish_reason") == "length"
+        usage = resp.get("usage")
+        self._record_completion(call_site, sizing, usage["completion_tokens"] if usage else None, limit, truncated)
+        return truncated
+
+    def _record_completion(self, call_site: str, sizing: Optional[Tuple[str, Optional[str]]],
+                           completion_tokens: Optional[int], limit: int, truncated: bool):
+        if truncated:
+            telemetry.increment("truncated_completions", call_site=call_site)
+        if sizing is not None and completion_tokens is not None:
+            self.sizer.record(*sizing, completion_tokens, limit, truncated)
+
+    @staticmethod
+    def _estimate_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+        """Rate-limit cost of a call: the API reserves prompt tokens (~4 chars each) plus max_tokens"""
+        return _prompt_chars(messages) // 4 + max_tokens
+
+    @staticmethod
+    def _record_usage(call_site: str, resp):
+        """Count prompt and completion tokens reported by a non-streaming response"""
+        usage = resp.get("usage")
+        if usage:
+            _count_tokens("prompt_tokens", usage["prompt_tokens"], call_site)
+            _count_tokens("completion_tokens", usage["completion_tokens"], call_site)
+
+    def _record_discarded(self, call_site: str, messages: List[Dict[str, str]], resp, stream: bool):
+        """Count the tokens of a losing hedged duplicate; its stream was closed after the first chunk"""
+        if stream:
+            _count_tokens("prompt_tokens", _prompt_chars(messages) // 4, call_site)
+        else:
+            self._record_usage(call_site, resp)
+
+    def _iter_stream(self, resp, cache_key: Optional[str], call_site: str, start: float,
+                     sizing: Optional[Tuple[str, Optional[str]]], limit: int, prompt_estimate: int) -> Iterator[str]:
+        """Yield the text content of each streamed completion chunk.
+
+        Prompt tokens come from the final usage chunk. A stream closed before
+        it (or one without it) counts prompt_estimate instead.
+        """
+        parts, finish_reason, usage = [], None, None
+        try:
+            for chunk in resp:
+                usage = chunk.get("usage") or usage
+                # The usage chunk has no choices
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].get("finish_reason") or finish_reason
+                content = chunk.choices[0].delta.get("content")
+                if content:
+                    if not parts:
+                        telemetry.observe("time_to_first_chunk_seconds", time.perf_counter() - start, call_site=call_site)
+                    parts.append(content)
+                    yield content
+        finally:
+            # Closed early (an abandoned or aborted stream): release the HTTP response now, not at GC
+            getattr(resp, "close", lambda: None)()
+            _count_tokens("prompt_tokens", usage["prompt_tokens"] if usage else prompt_estimate, call_site)
+        self._finish_stream("".join(parts), finish_reason, usage, cache_key, call_site, start, sizing, limit)
+
+    async def _aiter_stream(self, resp, cache_key: Optional[str], call_site: str, start: float,
+                            sizing: Optional[Tuple[str, Optional[str]]], limit: int,
+                            prompt_estimate: int) -> AsyncIterator[str]:
+        """Async variant of _iter_stream"""
+        parts, finish_reason, usage = [], None, None
+        try:
+            async for chunk in resp:
+                usage = chunk.get("usage") or usage
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].get("finish_reason") or finish_reason
+                content = chunk.choices[0].delta.get("content")
+                if content:
+                    if not parts:
+                        telemetry.observe("time_to_first_chunk_seconds", time.perf_counter() - start, call_site=call_site)
+                    parts.append(content)
+                    yield content
+        finally:
+            aclose = getattr(resp, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            _count_tokens("prompt_tokens", usage["prompt_tokens"] if usage else prompt_estimate, call_site)
+        self._finish_stream("".join(parts), finish_reason, usage, cache_key, call_site, start, sizing, limit)
+
+    def _finish_stream(self, content: str, finish_reason: Optional[str], usage: Optional[Dict],
+                       cache_key: Optional[str], call_site: str, start: float,
+                       sizing: Optional[Tuple[str, Optional[str]]], limit: int):
+        """Count, size and cache a stream that was read to the end"""
+        telemetry.observe("stage_seconds", time.perf_counter() - start, stage="call_model", call_site=call_site)
+        # Without a usage chunk, completion tokens are estimated like prompt tokens (~4 chars each)
+        completion_tokens = usage["completion_tokens"] if usage else len(content) // 4
+        _count_tokens("completion_tokens", completion_tokens, call_site)
+        truncated = finish_reason == "length"
+        self._record_completion(call_site, sizing, completion_tokens, limit, truncated)
+        # Only complete, untruncated streams are cached; an abandoned stream never reaches this point
+        if cache_key is not None and self.cache.enabled and not truncated:
+            self.cache.put(cache_key, content)
+
+    @staticmethod
+    async def _aiter_cached(content: str) -> AsyncIterator[str]:
+        yield content
+
+def _prompt_chars(messages: List[Dict[str, str]]) -> int:
+    return sum(len(message["content"]) for message in messages)
+
+def _first_chunk_ready(resp) -> Iterator:
+    """Wait for a stream's first chunk, so backend latency and hedging measure time to first chunk.
+
+    Returns a generator over all chunks that closes the response when closed.
+    """
+    chunks = iter(resp)
+    try:
+        first = next(chunks)
+    except StopIteration:
+        return iter(())
+
+    def replay():
+        try:
+            yield first
+            yield from chunks
+        finally:
+            getattr(resp, "close", lambda: None)()
+    return replay()
+
+async def _afirst_chunk_ready(resp) -> AsyncIterator:
+    """Async variant of _first_chunk_ready"""
+    try:
+        first = await resp.__anext__()
+    except StopAsyncIteration:
+        return _aiter_empty()
+
+    async def replay():
+        try:
+            yield first
+            async for chunk in resp:
+                yield chunk
+        finally:
+            aclose = getattr(resp, "aclose", None)
+            if aclose is not None:
+                await aclose()
+    return replay()
+
+async def _aiter_empty() -> AsyncIterator:
+    return
+    yield
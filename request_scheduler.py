@@ -0,0 +1,243 @@
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# Priority lanes: lower values are admitted first
+INTERACTIVE = 0
+BATCH = 1
+
+class RequestDeadlineExceeded(Exception):
+    """Raised when a request cannot be admitted or retried before its deadline"""
+
+class TokenBucket:
+    """Per-minute budget that refills continuously"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.refill_per_second = self.capacity / 60.0
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be consumed (0 if available now)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def consume(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+class RequestScheduler:
+    """Admits model calls under request and token rate limits.
+
+    Waiting calls are admitted by priority lane, then arrival order. Retryable
+    errors are retried with jittered exponential backoff until max_retries or
+    the per-call deadline. Calls sharing a key while one is in flight wait for
+    that call's result instead of issuing their own.
+    """
+
+    ASYNC_POLL_SECONDS = 0.01
+
+    def __init__(self, settings: Dict[str, Any], retryable_errors: Callable[[], Tuple[type, ...]] = tuple):
+        self.request_bucket = TokenBucket(settings["requests_per_minute"])
+        self.token_bucket = TokenBucket(settings["tokens_per_minute"])
+        self.max_retries = settings["max_retries"]
+        self.base_delay = settings["base_backoff_seconds"]
+        self.max_delay = settings["max_backoff_seconds"]
+        self.deadline_seconds = settings["deadline_seconds"]
+        # Called only once a call has failed, so the error classes can come from a lazily imported package
+        self.retryable_errors = retryable_errors
+        self.stats = {
+            "requests": 0, "retries": 0, "failures": 0, "coalesced": 0,
+            "rate_limited_waits": 0, "fallback_scores": 0
+        }
+
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._inflight = {}
+        self._async_inflight = {}
+
+    def run(self, call: Callable[[], Any], key: Optional[str] = None, priority: int = INTERACTIVE, tokens: int = 0):
+        """Run call() under the scheduler, sharing the result with identical in-flight keys"""
+        if key is None:
+            return self._run_with_retries(call, priority, tokens)
+
+        with self._cond:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.stats["coalesced"] += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = self._run_with_retries(call, priority, tokens)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._cond:
+                self._inflight.pop(key, None)
+
+    async def arun(self, call: Callable[[], Awaitable[Any]], key: Optional[str] = None,
+                   priority: int = INTERACTIVE, tokens: int = 0):
+        """Async variant of run; call is a coroutine function"""
+        if key is None:
+            return await self._arun_with_retries(call, priority, tokens)
+
+        inflight_key = (id(asyncio.get_running_loop()), key)
+        future = self._async_inflight.get(inflight_key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        future = self._async_inflight[inflight_key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._arun_with_retries(call, priority, tokens)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            future.exception()  # Mark retrieved so a future with no followers does not warn
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._async_inflight.pop(inflight_key, None)
+
+    def acquire(self, priority: int, tokens: int, deadline: Optional[float] = None):
+        """Block until both buckets admit a call; higher-priority waiters go first"""
+        ticket = (priority, next(self._sequence))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if self._waiting[0] == ticket:
+                        wait = max(self.request_bucket.wait_time(1, now), self.token_bucket.wait_time(tokens, now))
+                        if wait <= 0:
+                            self.request_bucket.consume(1)
+                            self.token_bucket.consume(tokens)
+                            self.stats["requests"] += 1
+                            return
+                        self.stats["rate_limited_waits"] += 1
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0 or (wait is not None and wait > remaining):
+                            raise RequestDeadlineExceeded("Rate limit wait exceeds the request deadline")
+                        wait = remaining if wait is None else wait
+                    self._cond.wait(wait)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def try_acquire(self, tokens: int) -> bool:
+        """Admit a call only if both buckets allow it now and no other call is waiting; never blocks"""
+        with self._cond:
+            if self._waiting:
+                return False
+            now = time.monotonic()
+            if self.request_bucket.wait_time(1, now) > 0 or self.token_bucket.wait_time(tokens, now) > 0:
+                return False
+            self.request_bucket.consume(1)
+            self.token_bucket.consume(tokens)
+            self.stats["requests"] += 1
+            return True
+
+    async def aacquire(self, priority: int, tokens: int, deadline: Optional[float] = None):
+        """Async variant of acquire that polls instead of parking a thread per waiting call"""
+        ticket = (priority, next(self._sequence))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+        try:
+            while True:
+                with self._cond:
+                    now = time.monotonic()
+                    wait = self.ASYNC_POLL_SECONDS
+                    if self._waiting[0] == ticket:
+                        wait = max(self.request_bucket.wait_time(1, now), self.token_bucket.wait_time(tokens, now))
+                        if wait <= 0:
+                            self.request_bucket.consume(1)
+                            self.token_bucket.consume(tokens)
+                            self.stats["requests"] += 1
+                            return
+                        self.stats["rate_limited_waits"] += 1
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0 or wait > remaining:
+                            raise RequestDeadlineExceeded("Rate limit wait exceeds the request deadline")
+                # Re-check soon even when the head's wait is long, since a higher priority may arrive
+                await asyncio.sleep(min(wait, self.ASYNC_POLL_SECONDS))
+        finally:
+            with self._cond:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for the given retry attempt (1-based)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def record_fallback(self):
+        """Count a caller substituting default scores for a failed model call"""
+        with self._cond:
+            self.stats["fallback_scores"] += 1
+
+    def _run_with_retries(self, call: Callable[[], Any], priority: int, tokens: int):
+        deadline = time.monotonic() + self.deadline_seconds
+        attempt = 0
+        while True:
+            self.acquire(priority, tokens, deadline)
+            try:
+                return call()
+            except self.retryable_errors():
+                attempt += 1
+                delay = self._next_delay(attempt, deadline)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    async def _arun_with_retries(self, call: Callable[[], Awaitable[Any]], priority: int, tokens: int):
+        deadline = time.monotonic() + self.deadline_seconds
+        attempt = 0
+        while True:
+            await self.aacquire(priority, tokens, deadline)
+            try:
+                return await call()
+            except self.retryable_errors():
+                attempt += 1
+                delay = self._next_delay(attempt, deadline)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+
+    def _next_delay(self, attempt: int, deadline: float) -> Optional[float]:
+        """Backoff before the next retry, or None when retries or the deadline are exhausted"""
+        delay = self.backoff_delay(attempt)
+        with self._cond:
+            if attempt > self.max_retries or time.monotonic() + delay > deadline:
+                self.stats["failures"] += 1
+                return None
+            self.stats["retries"] += 1
+        return delay
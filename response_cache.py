@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+def make_cache_key(model: str, prompt: str, temperature: float, max_tokens: int) -> str:
+    """Content-addressed key for a model call"""
+    payload = json.dumps([model, prompt, temperature, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """Two-tier LLM response cache: bounded in-memory LRU backed by SQLite"""
+
+    def __init__(self, settings: Dict[str, Any]):
+        self.enabled = settings["enabled"]
+        self.max_memory_entries = settings["max_memory_entries"]
+        self.ttl_seconds = settings["ttl_seconds"]
+        self.max_cacheable_temperature = settings["max_cacheable_temperature"]
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0}
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if self.enabled and settings["db_path"]:
+            db_path = os.path.join(os.path.dirname(__file__), settings["db_path"])
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        """Look up a response, promoting disk hits into the memory tier"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                response, created_at = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return response
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    response, created_at = row
+                    if not self._expired(created_at, now):
+                        self._remember(key, response, created_at)
+                        self.stats["disk_hits"] += 1
+                        return response
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, response: str):
+        """Store a response in both tiers"""
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, response, created_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created_at) VALUES (?, ?, ?)",
+                    (key, response, created_at)
+                )
+                self._db.commit()
+
+    def record_bypass(self):
+        """Count a call that skipped the cache because of its temperature"""
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def _remember(self, key: str, response: str, created_at: float):
+        """Insert into the memory tier, evicting the least recently used entry when full"""
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
@@ -0,0 +1,80 @@
+import re
+from typing import AsyncIterable, FrozenSet, Iterable, Mapping, Optional
+from keyword_matcher import word_forms
+from text_metrics import matching_words
+
+# Words are matched within whitespace-separated chunks, so text up to the last whitespace can be scanned
+UNFINISHED_WORD = re.compile(r"\S*\Z")
+
+class _StreamRestart:
+    """Type of STREAM_RESTART"""
+
+    def __repr__(self) -> str:
+        return "STREAM_RESTART"
+
+# Yielded by a guarded story stream when it abandons an unsafe draft. Everything
+# received before it should be discarded; the replacement story follows.
+STREAM_RESTART = _StreamRestart()
+
+class StreamSafetyScanner:
+    """Counts distinct unsafe words in streamed text as it arrives.
+
+    Words are matched with the judge's matching_words and the same configured
+    inflections, so "monsters" and "fighting" count. A word that touches
+    the end of a chunk may continue in the next one ("mon" + "sters"), so it
+    is held back until whitespace or the end of the stream completes it. Only
+    text that has been scanned is handed back for display.
+    """
+
+    def __init__(self, unsafe_words: FrozenSet[str], max_hits: int,
+                 inflections: Optional[Mapping[str, Iterable[str]]] = None):
+        self.unsafe_words = frozenset(unsafe_words)
+        self.unsafe_forms = word_forms(self.unsafe_words, inflections)
+        self.max_hits = max_hits
+        self.hits = set()
+        self.words_seen = 0
+        self._tail = ""
+
+    @property
+    def tripped(self) -> bool:
+        """True once the story has more distinct unsafe words than the judge's safety check allows"""
+        return len(self.hits) > self.max_hits
+
+    def feed(self, chunk: str) -> str:
+        """Scan one chunk and return the text that is now safe to show, up to the last complete word"""
+        text = self._tail + chunk
+        cut = UNFINISHED_WORD.search(text).start()
+        text, self._tail = text[:cut], text[cut:]
+        self._scan(text)
+        return text
+
+    def finish(self) -> str:
+        """Scan the held-back last word at the end of the stream and return it"""
+        text, self._tail = self._tail, ""
+        self._scan(text)
+        return text
+
+    def _scan(self, text: str):
+        chunks = text.lower().split()
+        self.words_seen += len(chunks)
+        self.hits |= matching_words(self.unsafe_forms, chunks)
+
+def final_text(chunks: Iterable) -> str:
+    """Join a guarded stream, keeping only the text after the last STREAM_RESTART"""
+    parts = []
+    for chunk in chunks:
+        if chunk is STREAM_RESTART:
+            parts = []
+        else:
+            parts.append(chunk)
+    return "".join(parts)
+
+async def afinal_text(chunks: AsyncIterable) -> str:
+    """Async variant of final_text"""
+    parts = []
+    async for chunk in chunks:
+        if chunk is STREAM_RESTART:
+            parts = []
+        else:
+            parts.append(chunk)
+    return "".join(parts)
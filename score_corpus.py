@@ -0,0 +1,200 @@
+"""
+Offline corpus scoring with the StoryJudge metrics.
+
+Re-scores an archive of stories with analyze_metrics, the composite formula
+and the local quality gate from judge_story, fanned out over a process pool:
+
+    python score_corpus.py stories.jsonl --output scores.jsonl
+    python score_corpus.py archive/ --output scores.csv --llm-judge cached --workers 8
+
+Inputs are JSONL files (one {"id": ..., "story": ...} object per line) or
+directories, whose JSONL files and text files matching `file_pattern` (one
+story per file) are read in sorted order. Stories are sent to the workers in
+chunks, with at most `max_pending_chunks_per_worker` chunks per worker in
+flight. Results are written in input order as they come back, so memory
+stays flat however large the corpus is. With --llm-judge skip (the default)
+only the local tiers run; with cached, judge scores already in the response
+cache are attached and the API is never called. With batch, each chunk's
+stories are sent to the LLM judge several per request (StoryJudge.judge_batch);
+every worker has its own request scheduler, so keep --workers low enough for
+the API rate limits.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, TextIO, Tuple
+from config_loader import config
+from story_judge import StoryJudge
+
+METRIC_FIELDS = ("word_count", "sentence_count", "grade_level", "vocabulary_richness", "predictability", "safety")
+
+# One judge per worker process, created by the pool initializer
+_judge = None
+_llm_judge = "skip"
+
+def _init_worker(llm_judge: str):
+    global _judge, _llm_judge
+    _judge = StoryJudge()
+    _llm_judge = llm_judge
+
+def score_chunk(chunk: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+    """Score (id, story) pairs in a worker; only the scores travel back, not the story text"""
+    if _llm_judge == "batch":
+        evaluations = _judge.judge_batch([story for _, story in chunk])
+    else:
+        evaluations = [_judge.judge_offline(story, _llm_judge == "cached") for _, story in chunk]
+    return [score_row(record_id, evaluation) for (record_id, _), evaluation in zip(chunk, evaluations)]
+
+def score_row(record_id: str, evaluation: Dict) -> Dict[str, Any]:
+    metrics = evaluation["metrics"]
+    return {
+        "id": record_id,
+        **{field: metrics[field] for field in METRIC_FIELDS},
+        "composite_score": evaluation["composite_score"],
+        "passed": evaluation["passed"],
+        "failed_checks": evaluation["failed_checks"],
+        "overall_score": evaluation["overall_score"],
+        "llm_judge": evaluation["llm_judge"]
+    }
+
+def iter_stories(paths: Iterable[str], settings: Mapping[str, Any], stats: Dict[str, int]) -> Iterator[Tuple[str, str]]:
+    """Lazily yield (id, story) from JSONL files, text files and directories of both"""
+    for path in map(Path, paths):
+        if path.is_dir():
+            files = sorted(file for file in path.rglob("*") if file.is_file() and
+                           (file.suffix == ".jsonl" or file.match(settings["file_pattern"])))
+            for file in files:
+                yield from _read_file(file, path, settings, stats)
+        else:
+            yield from _read_file(path, path.parent, settings, stats)
+
+def _read_file(file: Path, root: Path, settings: Mapping[str, Any], stats: Dict[str, int]) -> Iterator[Tuple[str, str]]:
+    if file.suffix != ".jsonl":
+        yield str(file.relative_to(root)), file.read_text(encoding="utf-8")
+        return
+    with open(file, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                story = record[settings["text_field"]]
+                if not isinstance(story, str):
+                    raise TypeError(f"{settings['text_field']} is not a string")
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                stats["skipped"] += 1
+                print(f"Skipping {file}:{line_number}: {e!r}", file=sys.stderr)
+                continue
+            yield str(record.get(settings["id_field"], f"{file.name}:{line_number}")), story
+
+class RowWriter:
+    """Streams result rows as JSONL, or as CSV with the LLM judge scores in llm_* columns"""
+
+    def __init__(self, out: TextIO, output_format: str):
+        self.out = out
+        self.output_format = output_format
+        self.llm_fields = tuple(config.snapshot.default_llm_scores)
+        if output_format == "csv":
+            self._csv = csv.DictWriter(out, fieldnames=[
+                "id", *METRIC_FIELDS, "composite_score", "passed", "failed_checks", "overall_score",
+                *(f"llm_{field}" for field in self.llm_fields)
+            ])
+            self._csv.writeheader()
+
+    def write(self, rows: List[Dict[str, Any]]):
+        for row in rows:
+            if self.output_format == "jsonl":
+                self.out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                continue
+            llm_judge = row.pop("llm_judge") or {}
+            row["failed_checks"] = ";".join(row["failed_checks"])
+            row.update({f"llm_{field}": llm_judge.get(field) for field in self.llm_fields})
+            self._csv.writerow(row)
+
+class Progress:
+    """Periodic progress lines on stderr, so stdout can carry the results"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last_report = self.start
+        self.scored = 0
+        self.passed = 0
+
+    def update(self, rows: List[Dict[str, Any]]):
+        self.scored += len(rows)
+        self.passed += sum(row["passed"] for row in rows)
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            print(f"Scored {self.scored:,} stories ({self.rate():,.0f}/s)", file=sys.stderr)
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.start
+        return self.scored / elapsed if elapsed else 0.0
+
+def score_corpus(stories: Iterator[Tuple[str, str]], writer: RowWriter, progress: Progress, workers: int,
+                 chunk_size: int, max_pending_chunks: int, llm_judge: str):
+    """Score stories on a process pool, writing each chunk's rows in input order"""
+    chunks = iter(lambda: list(itertools.islice(stories, chunk_size)), [])
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(llm_judge,)) as executor:
+        for chunk in chunks:
+            pending.append(executor.submit(score_chunk, chunk))
+            # Reading ahead stops once enough chunks are in flight, which bounds memory
+            if len(pending) >= max_pending_chunks:
+                rows = pending.popleft().result()
+                writer.write(rows)
+                progress.update(rows)
+        while pending:
+            rows = pending.popleft().result()
+            writer.write(rows)
+            progress.update(rows)
+
+def main():
+    settings = config.get_corpus_scoring_settings()
+    parser = argparse.ArgumentParser(description="Score a corpus of stories with the StoryJudge metrics")
+    parser.add_argument("inputs", nargs="+", help="JSONL files, text files or directories")
+    parser.add_argument("--output", help="Write results here (default: stdout)")
+    parser.add_argument("--format", choices=("jsonl", "csv"), help="Output format (default: from --output extension)")
+    parser.add_argument("--workers", type=int, default=settings["workers"], help="Worker processes (0: one per core)")
+    parser.add_argument("--chunk-size", type=int, default=settings["chunk_size"], help="Stories per worker task")
+    parser.add_argument("--llm-judge", choices=("skip", "cached", "batch"), default="skip",
+                        help="skip: local tiers only; cached: also attach judge scores found in the response cache; "
+                             "batch: call the LLM judge, several stories per request")
+    args = parser.parse_args()
+
+    output_format = args.format or ("csv" if args.output and args.output.endswith(".csv") else "jsonl")
+    workers = args.workers or os.cpu_count() or 1
+    stats = {"skipped": 0}
+    progress = Progress(settings["progress_interval_seconds"])
+
+    out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    try:
+        score_corpus(
+            iter_stories(args.inputs, settings, stats),
+            RowWriter(out, output_format),
+            progress,
+            workers=workers,
+            chunk_size=args.chunk_size,
+            max_pending_chunks=workers * settings["max_pending_chunks_per_worker"],
+            llm_judge=args.llm_judge
+        )
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print(f"Scored {progress.scored:,} stories with {workers} workers in "
+          f"{time.perf_counter() - progress.start:.1f}s ({progress.rate():,.0f}/s), "
+          f"{progress.passed:,} passed, {stats['skipped']:,} skipped", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
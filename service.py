@@ -0,0 +1,340 @@
+"""
+HTTP service mode for the story pipeline.
+
+Serves many bedtime sessions from one process on a single event loop:
+
+    POST /generate  {"request": "...", "user_id": "...", "auto_improve": true} -> SSE stream
+    POST /modify    {"story": "...", "feedback": "...", "category": "animals",
+                     "request": "...", "history": [["feedback", "reply"], ...]} -> SSE stream
+    POST /judge     {"story": "..."}                             -> JSON evaluation
+    GET  /health, GET /metrics (Prometheus text)
+
+Streamed endpoints emit `pool`, `library`, `category`, `chunk`, `restart`,
+`evaluation`, `phase`, `done` and `error` events. /generate answers from the
+warm story pool for bare category requests, or from the story library when a
+stored story matches the request, as one `chunk` with the whole story. A
+`restart` event means the safety guard dropped the draft streamed so far and
+a new one follows. /modify applies feedback as a paragraph patch when it can,
+as main.py does; the service keeps no session state, so `done` carries the
+session's `history` for the client to send back with its next round.
+Concurrency is bounded by the `service` settings in config.json: requests
+beyond `max_concurrent_sessions` wait in a bounded queue and are shed with 503
+once it is full or `queue_timeout_seconds` passes. On shutdown new work is
+refused and in-flight sessions get `drain_timeout_seconds` to finish.
+
+    python service.py --port 8080
+    python service.py --profile-startup   # import and initialization cost, then exit
+"""
+
+import argparse
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict
+from aiohttp import web
+from config_loader import config
+from openai_client import OpenAIClient, load_openai, model_errors, shared_client
+from story_teller import StoryTeller
+from story_judge import StoryJudge
+from story_library import StoryLibrary
+from story_pool import StoryPool
+from safety_guard import STREAM_RESTART
+from startup_profile import StartupProfiler
+from telemetry import telemetry
+
+class ServiceUnavailable(Exception):
+    """Raised when a request is shed by admission control"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+class AdmissionController:
+    """Bounded concurrency with a bounded wait queue in front of it"""
+
+    def __init__(self, settings: Dict[str, Any]):
+        self.max_concurrent = settings["max_concurrent_sessions"]
+        self.max_queued = settings["max_queued_requests"]
+        self.queue_timeout = settings["queue_timeout_seconds"]
+        self.active = 0
+        self.queued = 0
+        self.draining = False
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @asynccontextmanager
+    async def admit(self):
+        """Hold one session slot for the duration of the block, or raise ServiceUnavailable"""
+        if self.draining:
+            raise ServiceUnavailable("draining")
+        if not self._slots.locked():
+            await self._slots.acquire()  # A free slot is taken without suspending
+        elif self.queued >= self.max_queued:
+            raise ServiceUnavailable("queue_full")
+        else:
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise ServiceUnavailable("queue_timeout")
+            finally:
+                self.queued -= 1
+
+        self.active += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._slots.release()
+            if self.active == 0:
+                self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """Refuse new work and wait for in-flight sessions; False if the timeout ran out"""
+        self.draining = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+class StoryService:
+    """aiohttp handlers wrapping StoryTeller and StoryJudge behind admission control"""
+
+    def __init__(self, client: OpenAIClient = None, settings: Dict[str, Any] = None):
+        self.settings = settings or config.get_service_settings()
+        self.client = client or shared_client()
+        self.storyteller = StoryTeller(self.client)
+        self.judge = StoryJudge(self.client)
+        self.admission = AdmissionController(self.settings)
+        self.library_settings = config.get_story_library_settings()
+        self.library = StoryLibrary(self.library_settings)
+        self.pool = StoryPool(self.storyteller, self.judge, config.get_story_pool_settings(),
+                              self.library_settings["stopwords"])
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.post("/generate", self.handle_generate),
+            web.post("/modify", self.handle_modify),
+            web.post("/judge", self.handle_judge),
+            web.get("/health", self.handle_health),
+            web.get("/metrics", self.handle_metrics),
+        ])
+        app.on_startup.append(self._on_startup)
+        app.on_shutdown.append(self._on_shutdown)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def handle_generate(self, request: web.Request) -> web.StreamResponse:
+        body = await self._read_json(request, "request")
+        auto_improve = body.get("auto_improve", self.settings["auto_improve"])
+
+        user_id = body.get("user_id", self.library_settings["default_user_id"])
+
+        async def session(response: web.StreamResponse):
+            pooled = self.pool.take(body["request"])
+            if pooled:
+                story, category, evaluation = pooled
+                await _send_event(response, "pool", {"category": category})
+                await _send_event(response, "category", {"category": category})
+                await _send_event(response, "chunk", {"text": story})
+                await _send_event(response, "evaluation", evaluation)
+                await _send_event(response, "done", {"story": story, "category": category})
+                await asyncio.to_thread(self.library.add, body["request"], category, story, evaluation)
+                return
+
+            match = await asyncio.to_thread(self.library.find_similar, body["request"], user_id)
+            if match:
+                await asyncio.to_thread(self.library.record_delivery, match["id"], user_id)
+                await _send_event(response, "library", {"story_id": match["id"], "request": match["request"]})
+                await _send_event(response, "category", {"category": match["category"]})
+                await _send_event(response, "chunk", {"text": match["story"]})
+                await _send_event(response, "evaluation", match["evaluation"])
+                await _send_event(response, "done", {"story": match["story"], "category": match["category"]})
+                return
+
+            chunks, category = await self.storyteller.agenerate_story(body["request"], stream=True)
+            await _send_event(response, "category", {"category": category})
+            story = await _stream_story(response, chunks)
+            evaluation = await self.judge.ajudge_story(story)
+            await _send_event(response, "evaluation", evaluation)
+
+            if auto_improve and not evaluation["passed"]:
+                telemetry.increment("feedback_loops", loop="improve")
+                await _send_event(response, "phase", {"phase": "improve"})
+                draft = story
+                story = await _stream_story(response, await self.storyteller.aimprove_story(story, evaluation, stream=True))
+                evaluation = await self.judge.ajudge_story(story, base=draft)
+                await _send_event(response, "evaluation", evaluation)
+
+            if evaluation["passed"]:
+                await asyncio.to_thread(self.library.add, body["request"], category, story, evaluation)
+            await _send_event(response, "done", {"story": story, "category": category})
+
+        return await self._serve_stream(request, "generate", session)
+
+    async def handle_modify(self, request: web.Request) -> web.StreamResponse:
+        body = await self._read_json(request, "story", "feedback")
+        category = body.get("category", "general")
+        history = body.get("history", [])
+        if not (isinstance(history, list) and all(
+                isinstance(round_, list) and len(round_) == 2 and all(isinstance(text, str) for text in round_)
+                for round_ in history)):
+            raise web.HTTPBadRequest(text="history must be a list of [feedback, reply] pairs")
+
+        async def session(response: web.StreamResponse):
+            telemetry.increment("feedback_loops", loop="modify")
+            story_session = self.storyteller.start_session(body.get("request", ""), body["story"], category,
+                                                           history)
+            chunks, patched = await self.storyteller.amodify_in_session(story_session, body["feedback"], stream=True)
+            await _stream_story(response, chunks)
+            story = story_session.story
+            evaluation = await self.judge.ajudge_story(story, base=body["story"])
+            await _send_event(response, "evaluation", evaluation)
+            await _send_event(response, "done", {"story": story, "category": category, "patched": patched,
+                                                 "history": story_session.recent_history()})
+
+        return await self._serve_stream(request, "modify", session)
+
+    async def handle_judge(self, request: web.Request) -> web.Response:
+        body = await self._read_json(request, "story")
+        try:
+            async with self.admission.admit():
+                with telemetry.span("service_request", endpoint="judge"):
+                    evaluation = await self.judge.ajudge_story(body["story"])
+        except ServiceUnavailable as e:
+            return self._shed(e)
+        return web.json_response(evaluation)
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        status = {
+            "status": "draining" if self.admission.draining else "ok",
+            "active_sessions": self.admission.active,
+            "queued_requests": self.admission.queued,
+            "story_pool": {"levels": self.pool.levels(), "hit_rate": self.pool.hit_rate()},
+            "token_sizing": self.client.sizer.stats(),
+            "backends": self.client.router.stats()
+        }
+        return web.json_response(status, status=503 if self.admission.draining else 200)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=telemetry.to_prometheus(), content_type="text/plain")
+
+    async def _serve_stream(self, request: web.Request, endpoint: str, session) -> web.StreamResponse:
+        """Admit the request, then run one streamed session as server-sent events"""
+        try:
+            async with self.admission.admit():
+                response = web.StreamResponse(headers={
+                    "Content-Type": "text/event-stream",
+                    "Cache-Control": "no-cache"
+                })
+                await response.prepare(request)
+                with telemetry.span("service_request", endpoint=endpoint):
+                    try:
+                        await session(response)
+                    except model_errors() as e:
+                        await _send_event(response, "error", {"message": str(e)})
+                    except ConnectionResetError:
+                        # The client went away mid-stream; its slot is released on the way out
+                        telemetry.increment("service_disconnects", endpoint=endpoint)
+                await response.write_eof()
+                return response
+        except ServiceUnavailable as e:
+            return self._shed(e)
+
+    def _shed(self, error: ServiceUnavailable) -> web.Response:
+        telemetry.increment("service_rejections", reason=error.reason)
+        return web.json_response(
+            {"error": "Service overloaded, retry later", "reason": error.reason},
+            status=503,
+            headers={"Retry-After": str(self.settings["retry_after_seconds"])}
+        )
+
+    @staticmethod
+    async def _read_json(request: web.Request, *required: str) -> Dict[str, Any]:
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            raise web.HTTPBadRequest(text="Request body must be JSON")
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text="Request body must be a JSON object")
+        missing = [field for field in required if not isinstance(body.get(field), str) or not body[field].strip()]
+        if missing:
+            raise web.HTTPBadRequest(text=f"Missing required fields: {', '.join(missing)}")
+        return body
+
+    async def _on_startup(self, app: web.Application):
+        # Threshold, keyword and prompt edits to config.json apply without a restart
+        config.start_watching()
+        self.pool.start()
+    
+    async def _on_shutdown(self, app: web.Application):
+        drained = await self.admission.drain(self.settings["drain_timeout_seconds"])
+        if not drained:
+            print(f"Drain timed out with {self.admission.active} sessions still active")
+
+    async def _on_cleanup(self, app: web.Application):
+        config.stop_watching()
+        self.pool.stop()
+        await self.client.aclose()
+
+async def _send_event(response: web.StreamResponse, event: str, data: Dict[str, Any]):
+    payload = json.dumps(data, ensure_ascii=False)
+    await response.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+
+async def _stream_story(response: web.StreamResponse, chunks: AsyncIterator[str]) -> str:
+    """Forward story chunks to the client as they arrive and return the full text"""
+    parts = []
+    try:
+        async for chunk in chunks:
+            if chunk is STREAM_RESTART:
+                # The safety guard stopped this draft; the client discards what it has shown
+                parts = []
+                await _send_event(response, "restart", {"reason": "safety"})
+                continue
+            parts.append(chunk)
+            await _send_event(response, "chunk", {"text": chunk})
+    finally:
+        await chunks.aclose()
+    return "".join(parts)
+
+def profile_startup():
+    """Report what a cold start of the service costs, step by step"""
+    profiler = StartupProfiler("service")
+    # main() already read config.json for the argument defaults
+    with profiler.step("service: StoryService (client, storyteller, judge, library, pool)"):
+        service = StoryService()
+    with profiler.step("service: create_app"):
+        service.create_app()
+    with profiler.step("openai: SDK import on the first model call"):
+        load_openai()
+    with profiler.step("textstat: dictionaries loaded by the first evaluation"):
+        service.judge.evaluate_locally("The sleepy cat curled up by the fire and closed her eyes.")
+    profiler.print_report()
+
+def main():
+    settings = config.get_service_settings()
+    parser = argparse.ArgumentParser(description="Serve story generation over HTTP")
+    parser.add_argument("--host", default=settings["host"])
+    parser.add_argument("--port", type=int, default=settings["port"])
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Report import and initialization cost per module, then exit")
+    args = parser.parse_args()
+    if args.profile_startup:
+        profile_startup()
+        return
+
+    service = StoryService(settings=settings)
+    web.run_app(
+        service.create_app(),
+        host=args.host,
+        port=args.port,
+        # In-flight handlers get the same grace period as the drain
+        shutdown_timeout=settings["drain_timeout_seconds"]
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Startup cost report for the CLI and service entry points.
+
+    python main.py --profile-startup
+    python service.py --profile-startup
+
+Import cost is measured in a fresh interpreter with `python -X importtime`, so
+it is not hidden by modules this process has already imported. Initialization
+cost is measured in-process by timing each setup step the entry point runs
+under StartupProfiler.step(), including the lazily imported packages
+(openai, textstat) a step loads on first use.
+"""
+
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
+IMPORT_TIME_PREFIX = "import time:"
+
+def profile_imports(module: str) -> List[Tuple[str, int, int]]:
+    """(module, self microseconds, cumulative microseconds) for every module `import module` loads.
+
+    The last row is `module` itself. Modules the interpreter loads at startup
+    (site, encodings) are left out.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith(IMPORT_TIME_PREFIX):
+            continue
+        self_us, cumulative_us, name = line[len(IMPORT_TIME_PREFIX):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # Column header
+        # Children are printed before their parent, indented two spaces per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+
+    end = max(index for index, row in enumerate(rows) if row[0] == module and row[3] == 0)
+    start = max((index + 1 for index, row in enumerate(rows[:end]) if row[3] == 0), default=0)
+    return [row[:3] for row in rows[start:end + 1]]
+
+class StartupProfiler:
+    """Times the setup steps of an entry point and prints them with its import cost"""
+
+    def __init__(self, module: str):
+        self.module = module
+        self.steps = []
+
+    @contextmanager
+    def step(self, label: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((label, time.perf_counter() - start))
+
+    def print_report(self, top: int = 15):
+        """Print import cost per top-level module, then the cost of each initialization step"""
+        rows = profile_imports(self.module)
+        # Dotted names are submodules, already counted in their package's cumulative time
+        packages = sorted((row for row in rows[:-1] if "." not in row[0]), key=lambda row: row[2], reverse=True)
+
+        print("=" * 60)
+        print(f"STARTUP PROFILE: {self.module}")
+        print("=" * 60)
+        print(f"\nImport of {self.module} (fresh interpreter): {rows[-1][2] / 1000:.1f} ms")
+        print(f"{'cumulative':>12} {'self':>10}  module")
+        for name, self_us, cumulative_us in packages[:top]:
+            print(f"{cumulative_us / 1000:>9.1f} ms {self_us / 1000:>7.1f} ms  {name}")
+
+        print(f"\nInitialization: {sum(seconds for _, seconds in self.steps) * 1000:.1f} ms")
+        for label, seconds in self.steps:
+            print(f"{seconds * 1000:>9.1f} ms  {label}")
+        print("=" * 60)
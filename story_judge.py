@@ -1,51 +1,101 @@
-from openai_client import OpenAIClient
-import textstat
-from typing import Dict
+from openai_client import OpenAIClient, model_errors, shared_client
+import asyncio
+import json
+from typing import Dict, List, Optional, Tuple
 from config_loader import config
+from text_metrics import TextMetricsEngine, flesch_kincaid_grade
+from request_scheduler import BATCH
+from story_session import CODE_FENCE
+from telemetry import telemetry, timed
+
+# The six LLM judge aspects, in the order the single-story judge answers them
+LLM_SCORE_FIELDS = (
+    "age_appropriateness", "bedtime_suitability", "story_structure",
+    "engagement", "originality", "educational_value"
+)
 
 class StoryJudge:
     """Evaluates story quality using LLM judge and automated metrics"""
     
-    def __init__(self):
-        self.client = OpenAIClient()
-        self.safety_filters = config.get_safety_filters()
-        self.quality_thresholds = config.get_quality_thresholds()
-        self.vocabulary_settings = config.get_vocabulary_settings()
-        self.age_level_scoring = config.get_age_level_scoring()
-        self.composite_weights = config.get_composite_weights()
-        self.default_llm_scores = config.get_default_llm_scores()
+    def __init__(self, client: OpenAIClient = None):
+        # Share one client (and its connection pool) with StoryTeller when provided
+        self.client = client or shared_client()
+        self._metrics_engine = None
+        self._metrics_engine_version = None
+    
+    # Settings are read from the current config snapshot, so hot reloads apply to the next story
+    @property
+    def safety_filters(self):
+        return config.snapshot.safety_filters
+    
+    @property
+    def quality_thresholds(self):
+        return config.snapshot.quality_thresholds
+    
+    @property
+    def vocabulary_settings(self):
+        return config.snapshot.vocabulary_settings
+    
+    @property
+    def age_level_scoring(self):
+        return config.snapshot.age_level_scoring
     
-    def analyze_metrics(self, story: str) -> Dict:
-        """Calculate automated story metrics"""
-        words = story.split()
-        unique_words = set(word.lower() for word in words)
+    @property
+    def composite_weights(self):
+        return config.snapshot.composite_weights
+    
+    @property
+    def default_llm_scores(self):
+        return config.snapshot.default_llm_scores
+    
+    @property
+    def skip_llm_on_local_failure(self) -> bool:
+        return config.snapshot.skip_llm_judge_on_local_failure
+    
+    @property
+    def metrics_engine(self) -> TextMetricsEngine:
+        """Tokenizer for the current snapshot's word lists, rebuilt only after a reload"""
+        snapshot = config.snapshot
+        if self._metrics_engine_version != snapshot.version:
+            self._metrics_engine = TextMetricsEngine(snapshot.calming_words, snapshot.unsafe_words,
+                                                     inflections=snapshot.safety_filters.get("inflections"))
+            self._metrics_engine_version = snapshot.version
+        return self._metrics_engine
+    
+    @timed("analyze_metrics", cpu=True)
+    def analyze_metrics(self, story: str, base: str = None) -> Dict:
+        """Calculate automated story metrics, re-tokenizing only paragraphs not seen before.
+        
+        `base` is the story this one was derived from (by improve or modify);
+        its cached totals are then updated instead of rebuilt.
+        """
+        counts = self.metrics_engine.scan(story, base=base)
+        word_count = counts["word_count"]
         
         return {
-            "word_count": len(words),
-            "grade_level": textstat.flesch_kincaid_grade(story),
-            "vocabulary_richness": (len(unique_words) / len(words)) * 100,
-            "predictability": self._calculate_predictability(story),
-            "safety": self._check_safety(story)
+            "word_count": word_count,
+            "sentence_count": counts["sentence_count"],
+            "syllable_count": counts["syllable_count"],
+            "unique_word_count": counts["unique_word_count"],
+            "grade_level": flesch_kincaid_grade(counts["lexicon_count"], counts["sentence_count"], counts["syllable_count"]),
+            "vocabulary_richness": (counts["unique_word_count"] / word_count) * 100 if word_count else 0.0,
+            "predictability": self._calculate_predictability(len(counts["calming_hits"])),
+            "safety": self._check_safety(len(counts["unsafe_hits"]))
         }
     
-    def _calculate_predictability(self, story: str) -> float:
-        """Calculate how predictable/calming the story is"""
+    def _calculate_predictability(self, calming_hits: int) -> float:
+        """Calculate how predictable/calming the story is from distinct calming words found"""
         calming_words = self.safety_filters["calming_words"]
-        story_lower = story.lower()
-        found_words = sum(1 for word in calming_words if word in story_lower)
-        return min((found_words / len(calming_words)) * 100, 100)
-    
-    def _check_safety(self, story: str) -> float:
-        """Check content safety for bedtime stories"""
-        unsafe_words = self.safety_filters["unsafe_words"]
-        story_lower = story.lower()
-        unsafe_count = sum(1 for word in unsafe_words if word in story_lower)
+        return min((calming_hits / len(calming_words)) * 100, 100)
+    
+    def _check_safety(self, unsafe_hits: int) -> float:
+        """Check content safety for bedtime stories from distinct unsafe words found"""
         penalty_per_word = self.safety_filters["safety_penalty_per_word"]
-        return max(100 - (unsafe_count * penalty_per_word), 0)
+        return max(100 - (unsafe_hits * penalty_per_word), 0)
     
-    def get_llm_judgment(self, story: str) -> Dict:
-        """Get LLM evaluation of story quality"""
-        prompt = f"""
+    def _judge_prompt(self, story: str) -> str:
+        """Build the LLM judge prompt for a story"""
+        return f"""
             Rate this bedtime story for children ages 5-10 (0-100 each):
 
             Story: {story}
@@ -60,37 +110,221 @@ class StoryJudge:
 
             Respond with only numbers separated by commas in this order.
             """
-        
+    
+    def get_llm_judgment(self, story: str) -> Dict:
+        """Get LLM evaluation of story quality"""
+        return self._llm_judgment(story)[0]
+    
+    async def aget_llm_judgment(self, story: str) -> Dict:
+        """Async LLM evaluation of story quality"""
+        return (await self._allm_judgment(story))[0]
+    
+    @timed("get_llm_judgment")
+    def _llm_judgment(self, story: str) -> Tuple[Dict, bool]:
+        """Return (scores, fell_back); default scores are substituted and counted when the judge fails"""
+        openai_settings = config.snapshot.openai_settings
         try:
-            openai_settings = config.get_openai_settings()
             response = self.client.call_model(
-                prompt, 
+                self._judge_prompt(story), 
                 max_tokens=openai_settings["judge_max_tokens"], 
-                temperature=openai_settings["judge_temperature"]
+                temperature=openai_settings["judge_temperature"],
+                priority=BATCH,
+                call_site="judge"
+            )
+        except model_errors():
+            return self._fallback_scores(), True
+        return self._parse_llm_scores(response)
+    
+    @timed("get_llm_judgment")
+    async def _allm_judgment(self, story: str) -> Tuple[Dict, bool]:
+        """Async variant of _llm_judgment"""
+        openai_settings = config.snapshot.openai_settings
+        try:
+            response = await self.client.acall_model(
+                self._judge_prompt(story), 
+                max_tokens=openai_settings["judge_max_tokens"], 
+                temperature=openai_settings["judge_temperature"],
+                priority=BATCH,
+                call_site="judge"
             )
+        except model_errors():
+            return self._fallback_scores(), True
+        return self._parse_llm_scores(response)
+    
+    def _parse_llm_scores(self, response: str) -> Tuple[Dict, bool]:
+        """Parse the comma-separated judge response, falling back to default scores"""
+        try:
             scores = [float(x.strip()) for x in response.split(',')]
-            
-            if len(scores) == 6:
-                return {
-                    "age_appropriateness": scores[0],
-                    "bedtime_suitability": scores[1],
-                    "story_structure": scores[2],
-                    "engagement": scores[3],
-                    "originality": scores[4],
-                    "educational_value": scores[5]
-                }
-        except:
-            pass
-        
-        # Default scores if LLM fails
+        except ValueError:
+            return self._fallback_scores(), True
+        
+        if len(scores) != len(LLM_SCORE_FIELDS):
+            return self._fallback_scores(), True
+        return dict(zip(LLM_SCORE_FIELDS, scores)), False
+    
+    def _fallback_scores(self) -> Dict:
+        """Default scores for a failed judgment, counted on the client's scheduler"""
+        self.client.scheduler.record_fallback()
+        telemetry.increment("judge_fallbacks")
         return self.default_llm_scores.copy()
     
-    def judge_story(self, story: str) -> Dict:
-        """Complete story evaluation"""
-        metrics = self.analyze_metrics(story)
-        llm_scores = self.get_llm_judgment(story)
+    def judge_batch(self, stories: List[str], bases: List[Optional[str]] = None) -> List[Dict]:
+        """judge_story for many stories, with several stories per LLM judge request.
+        
+        Local tiers run per story as usual. Stories that reach the LLM tier are
+        packed into batch requests (see batch_llm_judgments). `bases` gives each
+        story's previous version, as judge_story's `base` does.
+        """
+        bases = bases or [None] * len(stories)
+        evaluations = [self.evaluate_locally(story, base) for story, base in zip(stories, bases)]
+        wanted = [index for index, evaluation in enumerate(evaluations)
+                  if evaluation["passed"] or not self.skip_llm_on_local_failure]
+        judgments = self.batch_llm_judgments([stories[index] for index in wanted])
+        for index, judgment in zip(wanted, judgments):
+            self._add_llm_judgment(evaluations[index], *judgment)
+        return evaluations
+    
+    def batch_llm_judgments(self, stories: List[str]) -> List[Tuple[Dict, bool]]:
+        """(scores, fell_back) per story, judging several stories per request.
+        
+        Batch sizes are chosen from story length against the model's context
+        window. The response must be JSON matching a strict schema; entries
+        that are missing or invalid are re-judged in the next round, and any
+        still unjudged after max_rounds go through the single-story judge.
+        """
+        settings = config.get_batch_judge_settings()
+        results = [None] * len(stories)
+        pending = list(range(len(stories)))
+        for _ in range(settings["max_rounds"]):
+            if not pending:
+                break
+            failed = []
+            for batch in self._pack_batches(stories, pending, settings):
+                scores = self._judge_batch_request([stories[index] for index in batch], settings)
+                for position, index in enumerate(batch, start=1):
+                    if position in scores:
+                        results[index] = (scores[position], False)
+                    else:
+                        failed.append(index)
+            telemetry.increment("judge_batch_entries", len(pending) - len(failed), outcome="valid")
+            telemetry.increment("judge_batch_entries", len(failed), outcome="rejudged")
+            pending = failed
+        for index in pending:
+            results[index] = self._llm_judgment(stories[index])
+        return results
+    
+    @staticmethod
+    def _pack_batches(stories: List[str], indices: List[int], settings: Dict) -> List[List[int]]:
+        """Greedily group stories so each request's story text and expected output fit the context window"""
+        budget = settings["context_window_tokens"] - len(_batch_judge_prompt([])) // 4
+        batches, batch, used = [], [], 0
+        for index in indices:
+            # ~4 characters per token, as the scheduler estimates, plus this story's share of the response
+            cost = len(stories[index]) // 4 + settings["output_tokens_per_story"]
+            if batch and (used + cost > budget or len(batch) >= settings["max_stories_per_batch"]):
+                batches.append(batch)
+                batch, used = [], 0
+            batch.append(index)
+            used += cost
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    @timed("judge_batch")
+    def _judge_batch_request(self, stories: List[str], settings: Dict) -> Dict[int, Dict]:
+        """Judge one batch; returns valid scores by 1-based story id (empty if the call failed)"""
+        try:
+            response = self.client.call_model(
+                _batch_judge_prompt(stories),
+                max_tokens=len(stories) * settings["output_tokens_per_story"],
+                temperature=config.snapshot.openai_settings["judge_temperature"],
+                priority=BATCH,
+                call_site="judge_batch"
+            )
+        except model_errors():
+            return {}
+        return parse_batch_scores(response, len(stories))
+    
+    def judge_story(self, story: str, base: str = None) -> Dict:
+        """Complete story evaluation, run as ordered tiers.
+        
+        Tier 1 computes local metrics, tier 2 gates on length, grade level,
+        safety and composite score, and tier 3 asks the LLM judge. A story that
+        fails the local gate is headed for improvement anyway, so the LLM judge
+        is skipped for it. evaluation["tiers_run"] records which tiers ran.
+        Pass the previous version of a revised story as `base` so only its
+        changed paragraphs are re-measured.
+        """
+        evaluation = self.evaluate_locally(story, base)
+        if evaluation["passed"] or not self.skip_llm_on_local_failure:
+            self._add_llm_judgment(evaluation, *self._llm_judgment(story))
+        return evaluation
+    
+    async def ajudge_story(self, story: str, base: str = None) -> Dict:
+        """Async tiered story evaluation.
+        
+        With skip_llm_on_local_failure, the LLM judge is only called once the
+        local gate has passed, so failing stories cost no judge tokens.
+        Otherwise the judge call runs while the local metrics are computed.
+        """
+        if self.skip_llm_on_local_failure:
+            evaluation = await asyncio.to_thread(self.evaluate_locally, story, base)
+            if evaluation["passed"]:
+                self._add_llm_judgment(evaluation, *(await self._allm_judgment(story)))
+            return evaluation
+        llm_task = asyncio.create_task(self._allm_judgment(story))
+        evaluation = await asyncio.to_thread(self.evaluate_locally, story, base)
+        self._add_llm_judgment(evaluation, *(await llm_task))
+        return evaluation
+    
+    def judge_offline(self, story: str, use_cached_llm: bool = True) -> Dict:
+        """Tiered evaluation that never calls the API.
         
-        overall_score = sum(llm_scores.values()) / len(llm_scores)
+        The LLM judge tier is added only when this exact judge call is already
+        in the response cache; otherwise the evaluation stays local.
+        """
+        evaluation = self.evaluate_locally(story)
+        if use_cached_llm and (evaluation["passed"] or not self.skip_llm_on_local_failure):
+            openai_settings = config.snapshot.openai_settings
+            response = self.client.cached_response(
+                self._judge_prompt(story),
+                max_tokens=openai_settings["judge_max_tokens"],
+                temperature=openai_settings["judge_temperature"]
+            )
+            if response is not None:
+                self._add_llm_judgment(evaluation, *self._parse_llm_scores(response))
+        return evaluation
+    
+    def evaluate_locally(self, story: str, base: str = None) -> Dict:
+        """Run the local tiers only: automated metrics and the quality gate"""
+        return self._build_evaluation(self.analyze_metrics(story, base))
+    
+    def _local_gate_failures(self, metrics: Dict, composite_score: float) -> List[str]:
+        """Names of the local quality checks a story fails"""
+        failed_checks = []
+        if metrics["word_count"] < self.quality_thresholds["min_word_count"]:
+            failed_checks.append("word_count_low")
+        if metrics["word_count"] > self.quality_thresholds["max_word_count"]:
+            failed_checks.append("word_count_high")
+        if metrics["grade_level"] < self.quality_thresholds["min_reading_level"]:
+            failed_checks.append("grade_level_low")
+        if metrics["grade_level"] > self.quality_thresholds["max_reading_level"]:
+            failed_checks.append("grade_level_high")
+        if metrics["safety"] < self.quality_thresholds["min_safety_score"]:
+            failed_checks.append("safety")
+        if composite_score < self.quality_thresholds["min_composite_score"]:
+            failed_checks.append("composite_score")
+        return failed_checks
+    
+    def _add_llm_judgment(self, evaluation: Dict, llm_scores: Dict, fell_back: bool):
+        """Attach the LLM judge tier to a local evaluation"""
+        evaluation["llm_judge"] = llm_scores
+        evaluation["llm_judge_fallback"] = fell_back
+        evaluation["overall_score"] = sum(llm_scores.values()) / len(llm_scores)
+        evaluation["tiers_run"].append("llm_judge")
+    
+    def _build_evaluation(self, metrics: Dict) -> Dict:
+        """Score automated metrics into a local evaluation; LLM fields stay None until tier 3 runs"""
         
         # Component breakdown for composite score
         target_grade = self.age_level_scoring["target_grade"]
@@ -112,11 +346,17 @@ class StoryJudge:
             metrics["safety"] * self.composite_weights["safety"]
         )
         
+        failed_checks = self._local_gate_failures(metrics, composite_score)
+        
         return {
-            "llm_judge": llm_scores,
-            "overall_score": overall_score,
+            "llm_judge": None,
+            "overall_score": None,
+            "llm_judge_fallback": False,
             "metrics": metrics,
             "composite_score": composite_score,
+            "tiers_run": ["metrics", "local_gate"],
+            "failed_checks": failed_checks,
+            "passed": not failed_checks,
             "component_breakdown": {
                 "predictability": metrics["predictability"],
                 "vocabulary": vocabulary_score,
@@ -124,3 +364,120 @@ class StoryJudge:
                 "safety": metrics["safety"]
             }
         }
+    
+    def judge_many(self, stories: List[str]):
+        """Score a batch of stories on automated metrics and the composite formula.
+
+        Stories are tokenized and graded one by one, then the threshold,
+        penalty, clip and weighted-sum math runs as NumPy array operations over
+        the whole batch. The LLM judge is not called. Returns a NumPy record array
+        with one row per story.
+        """
+        import numpy as np  # only batch scoring needs NumPy
+        
+        count = len(stories)
+        columns = {name: np.empty(count, dtype=np.float64) for name in (
+            "word_count", "grade_level", "unique_word_count", "calming_hits", "unsafe_hits"
+        )}
+        for i, story in enumerate(stories):
+            scan = self.metrics_engine.scan(story)
+            columns["word_count"][i] = scan["word_count"]
+            # textstat rounds its averages before combining them, so the grade is computed per story
+            columns["grade_level"][i] = flesch_kincaid_grade(scan["lexicon_count"], scan["sentence_count"],
+                                                             scan["syllable_count"])
+            columns["unique_word_count"][i] = scan["unique_word_count"]
+            columns["calming_hits"][i] = len(scan["calming_hits"])
+            columns["unsafe_hits"][i] = len(scan["unsafe_hits"])
+        
+        words = columns["word_count"]
+        safe_words = np.where(words > 0, words, 1)
+        grade_level = columns["grade_level"]
+        vocabulary_richness = np.where(words > 0, columns["unique_word_count"] / safe_words * 100, 0.0)
+        predictability = np.minimum(columns["calming_hits"] / len(self.safety_filters["calming_words"]) * 100, 100)
+        safety = np.maximum(100 - columns["unsafe_hits"] * self.safety_filters["safety_penalty_per_word"], 0)
+        
+        target_grade = self.age_level_scoring["target_grade"]
+        penalty_per_diff = self.age_level_scoring["penalty_per_grade_diff"]
+        min_age_score = self.age_level_scoring["min_age_score"]
+        max_age_score = self.age_level_scoring["max_age_score"]
+        in_range = (
+            (grade_level >= self.quality_thresholds["min_reading_level"]) &
+            (grade_level <= self.quality_thresholds["max_reading_level"])
+        )
+        age_level_score = np.where(
+            in_range,
+            max_age_score,
+            np.maximum(min_age_score, max_age_score - np.abs(grade_level - target_grade) * penalty_per_diff)
+        )
+        
+        vocabulary_score = np.minimum(
+            vocabulary_richness * self.vocabulary_settings["richness_multiplier"],
+            self.vocabulary_settings["max_vocabulary_score"]
+        )
+        
+        composite_score = (
+            predictability * self.composite_weights["predictability"] +
+            vocabulary_score * self.composite_weights["vocabulary"] +
+            age_level_score * self.composite_weights["age_level"] +
+            safety * self.composite_weights["safety"]
+        )
+        
+        return np.rec.fromarrays(
+            [
+                words.astype(np.int64), grade_level, vocabulary_richness, predictability, safety,
+                vocabulary_score, age_level_score, composite_score
+            ],
+            names=[
+                "word_count", "grade_level", "vocabulary_richness", "predictability", "safety",
+                "vocabulary_score", "age_level_score", "composite_score"
+            ]
+        )
+
+def _batch_judge_prompt(stories: List[str]) -> str:
+    """Prompt asking for JSON scores for several stories, identified by 1-based id"""
+    fields = ", ".join(f'"{field}": <0-100>' for field in LLM_SCORE_FIELDS)
+    story_blocks = "\n\n".join(f'<story id="{number}">\n{story}\n</story>'
+                               for number, story in enumerate(stories, start=1))
+    return f"""
+            Rate each of these bedtime stories for children ages 5-10 (0-100 each) on
+            age appropriateness, bedtime suitability, story structure, engagement,
+            originality and educational value.
+
+            Respond with only this JSON object, one entry per story, and no other text:
+            {{"scores": [{{"id": <story id>, {fields}}}]}}
+
+            {story_blocks}
+            """
+
+def parse_batch_scores(response: str, batch_size: int) -> Dict[int, Dict[str, float]]:
+    """Validate a batch judge response and return scores by story id.
+    
+    Each entry must have an integer id from 1 to batch_size and exactly the
+    six score fields, each a number from 0 to 100. Invalid entries, and ids
+    that appear more than once, are left out so the caller re-judges them.
+    """
+    try:
+        payload = json.loads(CODE_FENCE.sub("", response.strip()))
+    except json.JSONDecodeError:
+        return {}
+    entries = payload.get("scores") if isinstance(payload, dict) else None
+    if not isinstance(entries, list):
+        return {}
+    
+    scores, duplicates = {}, set()
+    for entry in entries:
+        if not isinstance(entry, dict) or set(entry) != {"id", *LLM_SCORE_FIELDS}:
+            continue
+        story_id = entry["id"]
+        if not isinstance(story_id, int) or isinstance(story_id, bool) or not 1 <= story_id <= batch_size:
+            continue
+        values = [entry[field] for field in LLM_SCORE_FIELDS]
+        if not all(isinstance(value, (int, float)) and not isinstance(value, bool) and 0 <= value <= 100
+                   for value in values):
+            continue
+        if story_id in scores:
+            duplicates.add(story_id)
+        scores[story_id] = {field: float(value) for field, value in zip(LLM_SCORE_FIELDS, values)}
+    for story_id in duplicates:
+        del scores[story_id]
+    return scores
@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, Any, FrozenSet, List, Optional, Set
+from telemetry import telemetry
+
+# Large Mersenne prime for the MinHash permutations (a * h + b) mod P
+MINHASH_PRIME = (1 << 61) - 1
+NON_WORD = re.compile(r"[^a-z0-9\s]+")
+
+def normalize_request(request: str, stopwords: FrozenSet[str]) -> str:
+    """Lowercase, strip punctuation and drop filler words so rephrasings compare equal"""
+    words = NON_WORD.sub(" ", request.lower()).split()
+    return " ".join(word for word in words if word not in stopwords)
+
+class StoryLibrary:
+    """Persistent store of approved stories that can answer near-duplicate requests.
+
+    Stories live in SQLite with an FTS5 index over request and story text.
+    Requests are normalized (lowercased, punctuation and filler words such as
+    "tell me a story about" removed) and indexed by MinHash signatures of
+    their character shingles, bucketed with LSH. find_similar() only returns
+    a stored story when it is similar enough to the request, met the quality
+    floor when it was judged, and has not been served to the same user
+    within the freshness window.
+    """
+
+    def __init__(self, settings: Dict[str, Any]):
+        self.enabled = settings["enabled"]
+        self.reuse_policy = settings["reuse_policy"]
+        self.min_similarity = settings["min_similarity"]
+        self.min_composite_score = settings["min_composite_score"]
+        self.freshness_seconds = settings["user_freshness_days"] * 86400
+        self.max_variants_per_request = settings["max_variants_per_request"]
+        self.shingle_size = settings["shingle_size"]
+        self.num_permutations = settings["num_permutations"]
+        self.rows_per_band = self.num_permutations // settings["lsh_bands"]
+        self.stopwords = frozenset(settings["stopwords"])
+        self.stats = {"hits": 0, "misses": 0, "stored": 0}
+
+        rng = random.Random(settings["minhash_seed"])
+        self._permutations = [(rng.randrange(1, MINHASH_PRIME), rng.randrange(MINHASH_PRIME))
+                              for _ in range(self.num_permutations)]
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if self.enabled:
+            db_path = os.path.join(os.path.dirname(__file__), settings["db_path"])
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._create_schema()
+            self._load_index(settings)
+
+    def normalize(self, request: str) -> str:
+        return normalize_request(request, self.stopwords)
+
+    def shingles(self, normalized: str) -> Set[str]:
+        """Character n-grams of a normalized request; short requests are one shingle"""
+        if len(normalized) <= self.shingle_size:
+            return {normalized} if normalized else set()
+        return {normalized[i:i + self.shingle_size] for i in range(len(normalized) - self.shingle_size + 1)}
+
+    def signature(self, shingles: Set[str]) -> array:
+        hashes = [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+                  for shingle in shingles]
+        return array("Q", (min((a * h + b) % MINHASH_PRIME for h in hashes) for a, b in self._permutations))
+
+    def find_similar(self, request: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Best stored story for a request under the reuse policy, or None"""
+        if not self.enabled or self.reuse_policy == "off":
+            return None
+        normalized = self.normalize(request)
+        shingles = self.shingles(normalized)
+        if not shingles:
+            return self._record_lookup(None)
+
+        with self._lock:
+            if self.reuse_policy == "exact":
+                candidate_ids = {row[0] for row in self._db.execute(
+                    "SELECT id FROM stories WHERE normalized_request = ?", (normalized,))}
+            else:
+                candidate_ids = set()
+                for band_key in self._band_keys(self.signature(shingles)):
+                    candidate_ids.update(self._buckets.get(band_key, ()))
+            if not candidate_ids:
+                return self._record_lookup(None)
+
+            placeholders = ",".join("?" * len(candidate_ids))
+            rows = self._db.execute(
+                f"SELECT id, request, normalized_request, category, story, evaluation, composite_score "
+                f"FROM stories WHERE id IN ({placeholders}) AND passed = 1 AND composite_score >= ? "
+                f"AND id NOT IN (SELECT story_id FROM deliveries WHERE user_id = ? AND delivered_at > ?)",
+                (*candidate_ids, self.min_composite_score, user_id, time.time() - self.freshness_seconds)
+            ).fetchall()
+
+        best = None
+        for story_id, stored_request, stored_normalized, category, story, evaluation, composite_score in rows:
+            similarity = _jaccard(shingles, self.shingles(stored_normalized))
+            if similarity < self.min_similarity:
+                continue
+            rank = (similarity, composite_score)
+            if best is None or rank > best[0]:
+                best = (rank, {
+                    "id": story_id,
+                    "request": stored_request,
+                    "category": category,
+                    "story": story,
+                    "evaluation": json.loads(evaluation),
+                    "similarity": similarity
+                })
+        return self._record_lookup(best[1] if best else None)
+
+    def add(self, request: str, category: str, story: str, evaluation: Dict) -> Optional[int]:
+        """Store a story with its evaluation.
+
+        Storing is not a delivery: only record_delivery, called when the
+        library serves a story, counts towards per-user freshness. Returns
+        None without storing once the request already has
+        max_variants_per_request stories, which is enough variety for the
+        per-user freshness rule.
+        """
+        if not self.enabled:
+            return None
+        normalized = self.normalize(request)
+        signature = self.signature(self.shingles(normalized)) if normalized else None
+        now = time.time()
+        with self._lock:
+            variants = self._db.execute(
+                "SELECT COUNT(*) FROM stories WHERE normalized_request = ?", (normalized,)
+            ).fetchone()[0]
+            if variants >= self.max_variants_per_request:
+                return None
+            cursor = self._db.execute(
+                "INSERT INTO stories (request, normalized_request, category, story, evaluation, "
+                "composite_score, passed, signature, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (request, normalized, category, story, json.dumps(evaluation), evaluation["composite_score"],
+                 int(evaluation["passed"]), signature.tobytes() if signature else None, now)
+            )
+            story_id = cursor.lastrowid
+            self._db.execute("INSERT INTO stories_fts (rowid, request, story) VALUES (?, ?, ?)",
+                             (story_id, request, story))
+            self._db.commit()
+            if signature:
+                self._index(story_id, signature)
+            self.stats["stored"] += 1
+        return story_id
+
+    def record_delivery(self, story_id: int, user_id: str):
+        """Remember that a stored story was served, for per-user freshness"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._db.execute("INSERT INTO deliveries (story_id, user_id, delivered_at) VALUES (?, ?, ?)",
+                             (story_id, user_id, time.time()))
+            self._db.commit()
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Full-text search over stored requests and stories, best match first"""
+        if not self.enabled:
+            return []
+        # Quote each term so user input is never parsed as FTS query syntax
+        terms = " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+        if not terms:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT s.id, s.request, s.category, s.story, s.composite_score FROM stories_fts "
+                "JOIN stories s ON s.id = stories_fts.rowid WHERE stories_fts MATCH ? ORDER BY rank LIMIT ?",
+                (terms, limit)
+            ).fetchall()
+        return [{"id": row[0], "request": row[1], "category": row[2], "story": row[3], "composite_score": row[4]}
+                for row in rows]
+
+    def _record_lookup(self, match: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        self.stats["hits" if match else "misses"] += 1
+        telemetry.increment("library_lookups", outcome="hit" if match else "miss")
+        return match
+
+    def _band_keys(self, signature: array) -> List[tuple]:
+        rows = self.rows_per_band
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes())
+                for band in range(self.num_permutations // rows)]
+
+    def _index(self, story_id: int, signature: array):
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, []).append(story_id)
+
+    def _create_schema(self):
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS stories (
+                id INTEGER PRIMARY KEY,
+                request TEXT NOT NULL,
+                normalized_request TEXT NOT NULL,
+                category TEXT NOT NULL,
+                story TEXT NOT NULL,
+                evaluation TEXT NOT NULL,
+                composite_score REAL NOT NULL,
+                passed INTEGER NOT NULL,
+                signature BLOB,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS stories_normalized_request ON stories (normalized_request);
+            CREATE VIRTUAL TABLE IF NOT EXISTS stories_fts USING fts5 (request, story);
+            CREATE TABLE IF NOT EXISTS deliveries (
+                story_id INTEGER NOT NULL,
+                user_id TEXT NOT NULL,
+                delivered_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS deliveries_user ON deliveries (user_id, delivered_at);
+            CREATE TABLE IF NOT EXISTS library_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+        self._db.commit()
+
+    def _load_index(self, settings: Dict[str, Any]):
+        """Rebuild the in-memory LSH buckets, re-signing stored requests if MinHash settings changed"""
+        params = json.dumps([settings["minhash_seed"], self.num_permutations, self.shingle_size])
+        row = self._db.execute("SELECT value FROM library_meta WHERE key = 'minhash'").fetchone()
+        resign = row is None or row[0] != params
+
+        rows = self._db.execute("SELECT id, normalized_request, signature FROM stories").fetchall()
+        for story_id, normalized, blob in rows:
+            if not normalized:
+                continue
+            if resign or blob is None:
+                signature = self.signature(self.shingles(normalized))
+                self._db.execute("UPDATE stories SET signature = ? WHERE id = ?", (signature.tobytes(), story_id))
+            else:
+                signature = array("Q")
+                signature.frombytes(blob)
+            self._index(story_id, signature)
+        self._db.execute("INSERT OR REPLACE INTO library_meta (key, value) VALUES ('minhash', ?)", (params,))
+        self._db.commit()
+
+def _jaccard(left: Set[str], right: Set[str]) -> float:
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
@@ -0,0 +1,168 @@
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, Optional, Tuple
+from openai_client import model_errors
+from request_scheduler import BATCH
+from story_library import normalize_request
+from story_teller import StoryTeller
+from story_judge import StoryJudge
+from telemetry import telemetry
+
+class StoryPool:
+    """Warm pool of pre-generated, pre-judged stories for bare category requests.
+
+    Most requests are a single category name ("animals", "magic") or no topic
+    at all ("a bedtime story"). For those, background worker threads keep up
+    to target_size stories per category that already passed the judge's
+    quality gate, so take() answers from memory. Taking a story that leaves
+    low_watermark or fewer queues an asynchronous refill; stories older than
+    ttl_seconds are discarded rather than served. Refills run on the batch
+    lane, so interactive calls always go first.
+    """
+
+    def __init__(self, storyteller: StoryTeller, judge: StoryJudge, settings: Dict[str, Any],
+                 stopwords: Iterable[str]):
+        self.storyteller = storyteller
+        self.judge = judge
+        self.enabled = settings["enabled"]
+        self.target_size = settings["target_size"]
+        self.low_watermark = settings["low_watermark"]
+        self.ttl_seconds = settings["ttl_seconds"]
+        self.workers = settings["workers"]
+        self.max_attempts_per_story = settings["max_attempts_per_story"]
+        self.sweep_interval = settings["sweep_interval_seconds"]
+        self.general_request = settings["general_request"]
+        self.stopwords = frozenset(stopwords)
+        self.categories = [*storyteller.categories, "general"]
+        self.stats = {"hits": 0, "misses": 0, "generated": 0, "rejected": 0, "expired": 0}
+
+        self._stories = {category: deque() for category in self.categories}
+        self._pending = set()
+        self._refills = queue.Queue()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Start the refill workers and queue an initial fill of every category"""
+        if not self.enabled or self._threads:
+            return
+        self._stop.clear()
+        with self._lock:
+            for category in self.categories:
+                self._schedule(category)
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"story-pool-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stop refilling; a worker mid-generation finishes that story and exits (daemon threads never block exit)"""
+        self._stop.set()
+        self._threads = []
+
+    def bare_category(self, user_input: str) -> Optional[str]:
+        """Pool category for a request that names nothing but a category, else None"""
+        words = normalize_request(user_input, self.stopwords).split()
+        if not words:
+            return "general"
+        if len(words) > 1:
+            return None
+        word = words[0]
+        for category in self.categories:
+            # "animal" and "animals" both ask for the animals category
+            if word in (category, category + "s") or word + "s" == category:
+                return category
+        return None
+
+    def take(self, user_input: str) -> Optional[Tuple[str, str, Dict]]:
+        """Return (story, category, evaluation) from the pool, or None if the request must be generated"""
+        if not self.enabled:
+            return None
+        category = self.bare_category(user_input)
+        if category is None:
+            return None
+        with self._lock:
+            stories = self._stories[category]
+            self._expire(stories)
+            entry = stories.popleft() if stories else None
+            self.stats["hits" if entry else "misses"] += 1
+            if len(stories) <= self.low_watermark:
+                self._schedule(category)
+        telemetry.increment("pool_requests", category=category, outcome="hit" if entry else "miss")
+        if entry is None:
+            return None
+        _, story, evaluation = entry
+        return story, category, evaluation
+
+    def levels(self) -> Dict[str, int]:
+        """Number of ready stories per category"""
+        with self._lock:
+            return {category: len(stories) for category, stories in self._stories.items()}
+
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def _schedule(self, category: str):
+        """Queue a refill unless one is already queued or running (caller holds the lock)"""
+        if category not in self._pending:
+            self._pending.add(category)
+            self._refills.put(category)
+
+    def _expire(self, stories: deque):
+        """Drop stories past their TTL from the front; entries are kept oldest first (caller holds the lock)"""
+        cutoff = time.time() - self.ttl_seconds
+        while stories and stories[0][0] <= cutoff:
+            stories.popleft()
+            self.stats["expired"] += 1
+
+    def _sweep(self):
+        with self._lock:
+            for category, stories in self._stories.items():
+                self._expire(stories)
+                if len(stories) <= self.low_watermark:
+                    self._schedule(category)
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                category = self._refills.get(timeout=self.sweep_interval)
+            except queue.Empty:
+                self._sweep()
+                continue
+            try:
+                self._fill(category)
+            finally:
+                with self._lock:
+                    self._pending.discard(category)
+
+    def _fill(self, category: str):
+        """Generate and judge stories until the category is full; only passing stories are kept"""
+        request = self.general_request if category == "general" else category
+        # Built for the pool's own category: a bare name such as "animals" is not one of its keywords
+        prompt = self.storyteller.create_prompt(request, category)
+        failures = 0
+        while not self._stop.is_set() and failures < self.max_attempts_per_story:
+            with self._lock:
+                if len(self._stories[category]) >= self.target_size:
+                    return
+            try:
+                story = self.storyteller.generate_from_prompt(prompt, category, priority=BATCH)
+                evaluation = self.judge.judge_story(story)
+            except model_errors():
+                # Leave the rest to the next refill instead of retrying against a failing API
+                telemetry.increment("pool_generated", category=category, outcome="error")
+                return
+            if not evaluation["passed"]:
+                failures += 1
+                self.stats["rejected"] += 1
+                telemetry.increment("pool_generated", category=category, outcome="rejected")
+                continue
+            failures = 0
+            with self._lock:
+                self._stories[category].append((time.time(), story, evaluation))
+                self.stats["generated"] += 1
+            telemetry.increment("pool_generated", category=category, outcome="stored")
@@ -0,0 +1,116 @@
+import json
+import re
+from typing import Dict, Iterable, List, Tuple
+
+# Paragraphs are separated by one or more blank lines
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+# Models sometimes wrap JSON in a markdown code fence despite being told not to
+CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+PATCH_OPS = ("replace", "insert_after", "delete")
+
+class PatchError(ValueError):
+    """Raised when a model-proposed story patch cannot be applied"""
+
+def split_paragraphs(story: str) -> List[str]:
+    return [paragraph.strip() for paragraph in PARAGRAPH_BREAK.split(story.strip()) if paragraph.strip()]
+
+def parse_patch(response: str) -> List[Dict]:
+    """Parse a {"edits": [...]} patch from the model, raising PatchError if it is malformed"""
+    try:
+        patch = json.loads(CODE_FENCE.sub("", response.strip()))
+    except json.JSONDecodeError as e:
+        raise PatchError(f"Patch is not valid JSON: {e}")
+    edits = patch.get("edits") if isinstance(patch, dict) else None
+    if not isinstance(edits, list) or not edits:
+        raise PatchError("Patch has no edits")
+    for edit in edits:
+        if not isinstance(edit, dict) or edit.get("op") not in PATCH_OPS:
+            raise PatchError(f"Unknown patch operation: {edit!r}")
+        if not isinstance(edit.get("paragraph"), int) or isinstance(edit["paragraph"], bool):
+            raise PatchError(f"Patch edit has no paragraph number: {edit!r}")
+        if edit["op"] != "delete" and not (isinstance(edit.get("text"), str) and edit["text"].strip()):
+            raise PatchError(f"Patch edit has no text: {edit!r}")
+    return edits
+
+def apply_patch(paragraphs: List[str], edits: List[Dict]) -> List[str]:
+    """Apply paragraph edits; numbers are 1-based and refer to the story before any edit.
+
+    insert_after 0 inserts before the first paragraph. Replacing or deleting
+    the same paragraph twice is rejected as ambiguous.
+    """
+    replaced, deleted = {}, set()
+    inserted = {index: [] for index in range(len(paragraphs) + 1)}
+    for edit in edits:
+        number = edit["paragraph"]
+        if edit["op"] == "insert_after":
+            if not 0 <= number <= len(paragraphs):
+                raise PatchError(f"Cannot insert after paragraph {number} of {len(paragraphs)}")
+            inserted[number].extend(split_paragraphs(edit["text"]))
+            continue
+        if not 1 <= number <= len(paragraphs):
+            raise PatchError(f"Paragraph {number} does not exist (story has {len(paragraphs)})")
+        if number in replaced or number in deleted:
+            raise PatchError(f"Paragraph {number} is edited more than once")
+        if edit["op"] == "replace":
+            replaced[number] = split_paragraphs(edit["text"])
+        else:
+            deleted.add(number)
+
+    result = list(inserted[0])
+    for number, paragraph in enumerate(paragraphs, start=1):
+        if number not in deleted:
+            result.extend(replaced.get(number, [paragraph]))
+        result.extend(inserted[number])
+    if not result:
+        raise PatchError("Patch deletes the whole story")
+    return result
+
+class StorySession:
+    """Conversation state for one story across feedback rounds.
+
+    Only the current story is sent in full. Earlier rounds are kept as short
+    (feedback, patch) exchanges, up to max_history_rounds, so the model sees
+    what was already asked for without the prompt growing with every round.
+    """
+
+    def __init__(self, request: str, story: str, category: str, max_history_rounds: int,
+                 history: Iterable[Tuple[str, str]] = ()):
+        self.request = request
+        self.category = category
+        self.paragraphs = split_paragraphs(story)
+        self.max_history_rounds = max_history_rounds
+        # Earlier (feedback, reply) rounds, e.g. sent back by a client of the stateless HTTP service
+        self.history = [(feedback, reply) for feedback, reply in history]
+        self.rounds = len(self.history)
+
+    @property
+    def story(self) -> str:
+        return "\n\n".join(self.paragraphs)
+
+    def numbered_story(self) -> str:
+        return "\n\n".join(f"[{number}] {paragraph}" for number, paragraph in enumerate(self.paragraphs, start=1))
+
+    def messages(self, system_prompt: str, edit_prompt: str) -> List[Dict[str, str]]:
+        """Message history for the next round: system rules, recent rounds, then the current story"""
+        messages = [{"role": "system", "content": system_prompt}]
+        messages.append({"role": "user", "content": f"Original request: {self.request}"})
+        for feedback, reply in self.recent_history():
+            messages.append({"role": "user", "content": f"Feedback: {feedback}"})
+            messages.append({"role": "assistant", "content": reply})
+        messages.append({"role": "user", "content": f"{edit_prompt}\n\nCurrent story paragraphs:\n{self.numbered_story()}"})
+        return messages
+
+    def record_patch(self, feedback: str, patch_response: str, paragraphs: List[str]):
+        self.history.append((feedback, patch_response.strip()))
+        self.paragraphs = paragraphs
+        self.rounds += 1
+
+    def recent_history(self) -> List[Tuple[str, str]]:
+        """The rounds the next request will include"""
+        return self.history[-self.max_history_rounds:]
+
+    def record_rewrite(self, feedback: str, story: str):
+        self.history.append((feedback, "(rewrote the whole story)"))
+        self.paragraphs = split_paragraphs(story)
+        self.rounds += 1
@@ -1,25 +1,49 @@
-from openai_client import OpenAIClient
-from typing import Dict
+from openai_client import OpenAIClient, shared_client
+from request_scheduler import INTERACTIVE
+from safety_guard import STREAM_RESTART, StreamSafetyScanner
+from story_session import StorySession, PatchError, parse_patch, apply_patch
+from telemetry import telemetry, timed
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
 from config_loader import config
 
 class StoryTeller:
     """Generates bedtime stories with category-based prompting"""
     
-    def __init__(self):
-        self.client = OpenAIClient()
-        self.categories = config.get_story_categories()
-        self.generation_settings = config.get_story_generation_settings()
-        self.quality_thresholds = config.get_quality_thresholds()
+    def __init__(self, client: OpenAIClient = None):
+        # Share one client (and its connection pool) with StoryJudge when provided
+        self.client = client or shared_client()
     
+    # Settings are read from the current config snapshot, so hot reloads apply to the next call
+    @property
+    def categories(self):
+        return config.snapshot.story_categories
+    
+    @property
+    def keyword_matcher(self):
+        return config.snapshot.keyword_matcher
+    
+    @property
+    def generation_settings(self):
+        return config.snapshot.story_generation
+    
+    @property
+    def quality_thresholds(self):
+        return config.snapshot.quality_thresholds
+    
+    @property
+    def safety_guard(self):
+        return config.snapshot.sections["safety_guard"]
+    
+    @timed("categorize_request")
     def categorize_request(self, user_input: str) -> str:
-        """Categorize story request based on keywords"""
-        user_lower = user_input.lower()
-        for category, category_config in self.categories.items():
-            keywords = category_config["keywords"]
-            if any(keyword in user_lower for keyword in keywords):
-                return category
-        return "general"
+        """Categorize story request based on keywords; the first matching category in config order wins"""
+        return self.keyword_matcher.first(user_input)
     
+    def match_categories(self, user_input: str) -> List[Tuple[str, int]]:
+        """Return every matching category with its keyword hit count, best match first"""
+        return self.keyword_matcher.rank(user_input)
+    
+    @timed("create_prompt")
     def create_prompt(self, user_input: str, category: str) -> str:
         """Create category-specific story prompt"""
         min_words = self.quality_thresholds["min_word_count"]
@@ -56,40 +80,298 @@ class StoryTeller:
         Write the complete story now:
         """
     
-    def generate_story(self, user_input: str) -> tuple:
-        """Generate story and return (story, category)"""
+    def generate_story(self, user_input: str, stream: bool = False, priority: int = INTERACTIVE) -> tuple:
+        """Generate story and return (story, category)
+
+        With stream=True, the story is returned as an iterator of text chunks.
+        Background work such as pool refills passes priority=BATCH. With the
+        safety guard on, a draft is abandoned as soon as it uses more unsafe
+        words than the judge's safety check allows, and is regenerated with a
+        stricter prompt; a stream then yields STREAM_RESTART before the new draft.
+        Without stream, the whole draft is checked once it is complete, so the
+        call can be sized by the token sizer.
+        """
+        category = self.categorize_request(user_input)
+        prompt = self.create_prompt(user_input, category)
+        if self.safety_guard["enabled"]:
+            if stream:
+                return self._guarded_stream(prompt, priority, category), category
+            return self._guarded_text(prompt, priority, category), category
+        if stream:
+            chunks = self.client.call_model(prompt, stream=True, priority=priority, call_site="generate",
+                                            category=category)
+            return self._lstrip_stream(chunks), category
+        story = self.client.call_model(prompt, priority=priority, call_site="generate", category=category)
+        return story.strip(), category
+    
+    async def agenerate_story(self, user_input: str, stream: bool = False) -> tuple:
+        """Async variant of generate_story; stream=True gives an async iterator of text chunks"""
         category = self.categorize_request(user_input)
         prompt = self.create_prompt(user_input, category)
-        story = self.client.call_model(prompt)
+        if self.safety_guard["enabled"]:
+            if stream:
+                return self._aguarded_stream(prompt, category), category
+            return await self._aguarded_text(prompt, category), category
+        if stream:
+            chunks = await self.client.acall_model(prompt, stream=True, call_site="generate", category=category)
+            return self._alstrip_stream(chunks), category
+        story = await self.client.acall_model(prompt, call_site="generate", category=category)
         return story.strip(), category
     
-    def improve_story(self, story: str, feedback: Dict) -> str:
-        """Improve story based on evaluation feedback"""
-        improvements = []
+    def generate_from_prompt(self, prompt: str, category: str, call_site: str = "generate",
+                             priority: int = INTERACTIVE) -> str:
+        """Generate one story for an already built prompt, through the safety guard when it is on"""
+        if self.safety_guard["enabled"]:
+            return self._guarded_text(prompt, priority, category, call_site)
+        story = self.client.call_model(prompt, priority=priority, call_site=call_site, category=category)
+        return story.strip()
+    
+    async def agenerate_from_prompt(self, prompt: str, category: str, call_site: str = "generate") -> str:
+        """Generate one story for an already built prompt, through the safety guard when it is on"""
+        if self.safety_guard["enabled"]:
+            return await self._aguarded_text(prompt, category, call_site)
+        story = await self.client.acall_model(prompt, call_site=call_site, category=category)
+        return story.strip()
+    
+    def _guarded_stream(self, prompt: str, priority: int, category: str, call_site: str = "generate") -> Iterator:
+        """Stream a story, restarting with a stricter prompt when the draft turns unsafe.
         
-        min_words = self.quality_thresholds["min_word_count"]
-        max_words = self.quality_thresholds["max_word_count"]
-        max_reading = self.quality_thresholds["max_reading_level"]
-        min_bedtime_score = self.quality_thresholds["min_safety_score"]
+        Restarted drafts are labelled with the "safety_retry" call site. The
+        last allowed attempt is streamed unguarded; the judge and the improve
+        step handle whatever it produces.
+        """
+        max_retries = self.safety_guard["max_retries"]
+        first_call_site = call_site
+        for attempt in range(max_retries + 1):
+            call_site = first_call_site if attempt == 0 else "safety_retry"
+            response = self.client.call_model(prompt, stream=True, priority=priority, call_site=call_site,
+                                              category=category)
+            chunks = self._lstrip_stream(response)
+            if attempt == max_retries:
+                yield from chunks
+                return
+            scanner = self._safety_scanner()
+            for chunk in chunks:
+                text = scanner.feed(chunk)
+                if scanner.tripped:
+                    break
+                if text:
+                    yield text
+            else:
+                text = scanner.finish()
+                if not scanner.tripped:
+                    if text:
+                        yield text
+                    return
+            # Closing the response drops the connection, so the rest of the draft is never generated
+            chunks.close()
+            getattr(response, "close", lambda: None)()
+            self._record_safety_abort(scanner, call_site)
+            yield STREAM_RESTART
+            prompt = self._strict_prompt(prompt)
+    
+    async def _aguarded_stream(self, prompt: str, category: str, call_site: str = "generate") -> AsyncIterator:
+        """Async variant of _guarded_stream"""
+        max_retries = self.safety_guard["max_retries"]
+        first_call_site = call_site
+        for attempt in range(max_retries + 1):
+            call_site = first_call_site if attempt == 0 else "safety_retry"
+            response = await self.client.acall_model(prompt, stream=True, call_site=call_site, category=category)
+            chunks = self._alstrip_stream(response)
+            if attempt == max_retries:
+                async for chunk in chunks:
+                    yield chunk
+                return
+            scanner = self._safety_scanner()
+            async for chunk in chunks:
+                text = scanner.feed(chunk)
+                if scanner.tripped:
+                    break
+                if text:
+                    yield text
+            else:
+                text = scanner.finish()
+                if not scanner.tripped:
+                    if text:
+                        yield text
+                    return
+            await chunks.aclose()
+            await response.aclose()
+            self._record_safety_abort(scanner, call_site)
+            yield STREAM_RESTART
+            prompt = self._strict_prompt(prompt)
+    
+    def _guarded_text(self, prompt: str, priority: int, category: str, call_site: str = "generate") -> str:
+        """Generate a story without streaming, replacing a draft that turns out unsafe.
         
-        if feedback["metrics"]["word_count"] < min_words:
-            improvements.append(f"expand to {min_words}-{max_words} words with more details")
+        Nothing is shown before the draft is complete, so the call is sized by
+        the token sizer and a draft cut off by a sized limit is asked again by
+        the client. The last allowed attempt is kept unchecked, as in
+        _guarded_stream.
+        """
+        max_retries = self.safety_guard["max_retries"]
+        first_call_site = call_site
+        for attempt in range(max_retries + 1):
+            call_site = first_call_site if attempt == 0 else "safety_retry"
+            story = self.client.call_model(prompt, priority=priority, call_site=call_site, category=category).strip()
+            if attempt == max_retries or not self._is_unsafe(story, call_site):
+                return story
+            prompt = self._strict_prompt(prompt)
+    
+    async def _aguarded_text(self, prompt: str, category: str, call_site: str = "generate") -> str:
+        """Async variant of _guarded_text"""
+        max_retries = self.safety_guard["max_retries"]
+        first_call_site = call_site
+        for attempt in range(max_retries + 1):
+            call_site = first_call_site if attempt == 0 else "safety_retry"
+            story = (await self.client.acall_model(prompt, call_site=call_site, category=category)).strip()
+            if attempt == max_retries or not self._is_unsafe(story, call_site):
+                return story
+            prompt = self._strict_prompt(prompt)
+    
+    def _is_unsafe(self, story: str, call_site: str) -> bool:
+        """Scan a complete draft, recording a safety abort when it is unsafe"""
+        scanner = self._safety_scanner()
+        scanner.feed(story)
+        scanner.finish()
+        if scanner.tripped:
+            self._record_safety_abort(scanner, call_site)
+        return scanner.tripped
+    
+    def _safety_scanner(self) -> StreamSafetyScanner:
+        snapshot = config.snapshot
+        penalty = snapshot.safety_filters["safety_penalty_per_word"]
+        # The judge fails a story once 100 - distinct unsafe words * penalty drops below min_safety_score
+        if penalty > 0:
+            allowed_hits = int((100 - self.quality_thresholds["min_safety_score"]) // penalty)
+        else:
+            allowed_hits = len(snapshot.unsafe_words)
+        return StreamSafetyScanner(snapshot.unsafe_words, allowed_hits,
+                                   inflections=snapshot.safety_filters.get("inflections"))
+    
+    def _strict_prompt(self, prompt: str) -> str:
+        instructions = self.safety_guard["retry_instructions"].format(
+            unsafe_words=", ".join(sorted(config.snapshot.unsafe_words))
+        )
+        return f"{prompt}\n{instructions}\n"
+    
+    def _record_safety_abort(self, scanner: StreamSafetyScanner, call_site: str):
+        """Count an abandoned draft and how far into the target story length it got"""
+        telemetry.increment("safety_aborts", call_site=call_site)
+        telemetry.increment("safety_abort_words", scanner.words_seen, call_site=call_site)
+        position = min(scanner.words_seen / self.quality_thresholds["max_word_count"], 1.0)
+        telemetry.observe("safety_abort_position", position, call_site=call_site)
+    
+    @staticmethod
+    def _lstrip_stream(chunks: Iterator[str]) -> Iterator[str]:
+        """Drop leading whitespace from a chunk stream, like str.strip() does for full responses"""
+        started = False
+        for chunk in chunks:
+            if not started:
+                chunk = chunk.lstrip()
+                if not chunk:
+                    continue
+                started = True
+            yield chunk
+    
+    @staticmethod
+    async def _alstrip_stream(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Async variant of _lstrip_stream"""
+        started = False
+        async for chunk in chunks:
+            if not started:
+                chunk = chunk.lstrip()
+                if not chunk:
+                    continue
+                started = True
+            yield chunk
+    
+    @staticmethod
+    async def _aiter_text(text: str) -> AsyncIterator[str]:
+        yield text
+    
+    @timed("improve_story")
+    def improve_story(self, story: str, feedback: Dict, stream: bool = False, temperature: float = None):
+        """Improve story based on evaluation feedback
+
+        With stream=True, the improved story is returned as an iterator of text chunks.
+        temperature defaults to the first step of the improvement controller's schedule.
+        """
+        full_prompt = self._improvement_prompt(story, feedback)
+        if full_prompt is None:
+            return iter([story]) if stream else story
         
-        if feedback["metrics"]["grade_level"] > max_reading:
-            improvements.append(f"use simpler vocabulary for Grade {self.quality_thresholds['min_reading_level']}-{max_reading}")
+        if temperature is None:
+            temperature = config.get_improvement_controller_settings()["temperature_schedule"][0]
+        improved = self.client.call_model(
+            full_prompt, 
+            temperature=temperature,
+            stream=stream,
+            call_site="improve"
+        )
+        return self._lstrip_stream(improved) if stream else improved
+    
+    @timed("improve_story")
+    async def aimprove_story(self, story: str, feedback: Dict, stream: bool = False, temperature: float = None):
+        """Async variant of improve_story; stream=True gives an async iterator of text chunks"""
+        full_prompt = self._improvement_prompt(story, feedback)
+        if full_prompt is None:
+            return self._aiter_text(story) if stream else story
         
-        if feedback["llm_judge"]["bedtime_suitability"] < min_bedtime_score:
-            improvements.append("make more calming and bedtime suitable")
+        if temperature is None:
+            temperature = config.get_improvement_controller_settings()["temperature_schedule"][0]
+        improved = await self.client.acall_model(
+            full_prompt,
+            temperature=temperature,
+            stream=stream,
+            call_site="improve"
+        )
+        return self._alstrip_stream(improved) if stream else improved
+    
+    def improvement_instructions(self, feedback: Dict) -> List[str]:
+        """One instruction per problem in an evaluation: each failed local check and each weak LLM judge aspect"""
+        min_words = self.quality_thresholds["min_word_count"]
+        max_words = self.quality_thresholds["max_word_count"]
+        min_reading = self.quality_thresholds["min_reading_level"]
+        max_reading = self.quality_thresholds["max_reading_level"]
+        fixes = {
+            "word_count_low": f"expand to {min_words}-{max_words} words with more details",
+            "word_count_high": f"shorten to {min_words}-{max_words} words, keeping the plot",
+            "grade_level_high": f"use simpler vocabulary for Grade {min_reading}-{max_reading}",
+            "grade_level_low": f"use slightly longer sentences and richer words for Grade {min_reading}-{max_reading}",
+            "safety": "remove anything scary, violent or dangerous",
+            "composite_score": "use more calming bedtime imagery and more varied vocabulary"
+        }
+        improvements = [fixes[check] for check in feedback["failed_checks"] if check in fixes]
         
+        # The LLM judge tier is skipped when local checks already failed
+        llm_judge = feedback["llm_judge"]
+        if llm_judge is not None:
+            if llm_judge["bedtime_suitability"] < self.quality_thresholds["min_safety_score"]:
+                improvements.append("make more calming and bedtime suitable")
+            aspect_fixes = {
+                "age_appropriateness": "make it suitable for children aged 5-10",
+                "story_structure": "give it a clear beginning, middle and gentle ending",
+                "engagement": "make the characters and events more engaging",
+                "originality": "make the plot less predictable",
+                "educational_value": "weave in a simple lesson"
+            }
+            improvements.extend(fix for aspect, fix in aspect_fixes.items()
+                                if llm_judge[aspect] < self.quality_thresholds["min_overall_score"])
+        return improvements
+    
+    def _improvement_prompt(self, story: str, feedback: Dict) -> Optional[str]:
+        """Build the improvement prompt, or None when the evaluation asks for no changes"""
+        improvements = self.improvement_instructions(feedback)
         if not improvements:
-            return story
+            return None
 
         improvement_feedback = '; '.join(improvements)
         improvement_prompt = self.generation_settings["improvement_prompt_template"].format(
             feedback=improvement_feedback
         )
         
-        full_prompt = f"""
+        return f"""
         {improvement_prompt}
 
         Requirements:
@@ -102,15 +384,158 @@ class StoryTeller:
 
         Improved story:
         """
+    
+    def modify_story_with_feedback(self, story: str, feedback: str, category: str, stream: bool = False):
+        """Modify story based on user feedback
+
+        With stream=True, the modified story is returned as an iterator of text
+        chunks. The safety guard applies as in generate_story.
+        """
+        prompt = self._modification_prompt(story, feedback, category)
+        if self.safety_guard["enabled"]:
+            if stream:
+                return self._guarded_stream(prompt, INTERACTIVE, category, call_site="modify")
+            return self._guarded_text(prompt, INTERACTIVE, category, call_site="modify")
+        openai_settings = config.snapshot.openai_settings
+        modified = self.client.call_model(
+            prompt, 
+            temperature=openai_settings["temperature"],
+            stream=stream,
+            call_site="modify",
+            category=category
+        )
+        return self._lstrip_stream(modified) if stream else modified
+    
+    def start_session(self, user_input: str, story: str, category: str, history=()) -> StorySession:
+        """Open a feedback session for a story so later modifications can be paragraph edits.
         
-        openai_settings = config.get_openai_settings()
-        return self.client.call_model(
-            full_prompt, 
-            temperature=openai_settings["temperature"] - 0.2  # Slightly lower for improvements
+        `history` resumes earlier (feedback, reply) rounds of the same story.
+        """
+        return StorySession(user_input, story, category, config.snapshot.sections["story_sessions"]["max_history_rounds"],
+                            history)
+    
+    @timed("modify_in_session")
+    def modify_in_session(self, session: StorySession, feedback: str, stream: bool = False) -> Tuple[Any, bool]:
+        """Apply user feedback as paragraph-level edits and return (story, patched).
+        
+        The model only writes the paragraphs that change, as a JSON patch that
+        is applied locally. A patch that fails to parse or apply falls back to
+        a full rewrite (patched is then False). With stream=True, the story is
+        an iterator of text chunks: a patched story arrives as one chunk, and
+        a rewrite streams through the safety guard as it is generated and is
+        recorded in the session once the iterator is exhausted.
+        """
+        session_settings = config.snapshot.sections["story_sessions"]
+        if session_settings["enabled"]:
+            response = self.client.call_chat(
+                self._patch_messages(session, feedback),
+                max_tokens=session_settings["patch_max_tokens"],
+                temperature=config.snapshot.openai_settings["temperature"],
+                call_site="modify_patch"
+            )
+            if self._apply_session_patch(session, feedback, response):
+                return (iter([session.story]) if stream else session.story), True
+        
+        if stream:
+            chunks = self.modify_story_with_feedback(session.story, feedback, session.category, stream=True)
+            return self._record_rewrite(session, feedback, chunks), False
+        story = self.modify_story_with_feedback(session.story, feedback, session.category).strip()
+        session.record_rewrite(feedback, story)
+        return session.story, False
+    
+    async def amodify_in_session(self, session: StorySession, feedback: str, stream: bool = False) -> Tuple[Any, bool]:
+        """Async variant of modify_in_session; stream=True gives an async iterator of text chunks"""
+        session_settings = config.snapshot.sections["story_sessions"]
+        if session_settings["enabled"]:
+            response = await self.client.acall_chat(
+                self._patch_messages(session, feedback),
+                max_tokens=session_settings["patch_max_tokens"],
+                temperature=config.snapshot.openai_settings["temperature"],
+                call_site="modify_patch"
+            )
+            if self._apply_session_patch(session, feedback, response):
+                return (self._aiter_text(session.story) if stream else session.story), True
+        
+        if stream:
+            chunks = await self.amodify_story_with_feedback(session.story, feedback, session.category, stream=True)
+            return self._arecord_rewrite(session, feedback, chunks), False
+        story = (await self.amodify_story_with_feedback(session.story, feedback, session.category)).strip()
+        session.record_rewrite(feedback, story)
+        return session.story, False
+    
+    def _patch_messages(self, session: StorySession, feedback: str) -> List[Dict[str, str]]:
+        return session.messages(
+            self._session_system_prompt(session.category),
+            self.generation_settings["patch_prompt_template"].format(user_feedback=feedback)
+        )
+    
+    @staticmethod
+    def _apply_session_patch(session: StorySession, feedback: str, response: str) -> bool:
+        """Apply a patch response to the session; False when it must fall back to a full rewrite"""
+        try:
+            paragraphs = apply_patch(session.paragraphs, parse_patch(response))
+        except PatchError:
+            telemetry.increment("session_edits", outcome="rewrite")
+            return False
+        telemetry.increment("session_edits", outcome="patch")
+        session.record_patch(feedback, response, paragraphs)
+        return True
+    
+    @staticmethod
+    def _record_rewrite(session: StorySession, feedback: str, chunks: Iterator) -> Iterator:
+        """Pass a rewrite stream through, recording the finished story in the session"""
+        parts = []
+        for chunk in chunks:
+            if chunk is STREAM_RESTART:
+                parts.clear()
+            else:
+                parts.append(chunk)
+            yield chunk
+        session.record_rewrite(feedback, "".join(parts).strip())
+    
+    @staticmethod
+    async def _arecord_rewrite(session: StorySession, feedback: str, chunks: AsyncIterator) -> AsyncIterator:
+        """Async variant of _record_rewrite"""
+        parts = []
+        async for chunk in chunks:
+            if chunk is STREAM_RESTART:
+                parts.clear()
+            else:
+                parts.append(chunk)
+            yield chunk
+        session.record_rewrite(feedback, "".join(parts).strip())
+    
+    def _session_system_prompt(self, category: str) -> str:
+        if category in self.categories:
+            context = f"keeping its {self.categories[category]['prompt_strategy']}"
+        else:
+            context = "keeping the story's essence"
+        return self.generation_settings["session_system_prompt_template"].format(
+            context=context,
+            word_count=f"{self.quality_thresholds['min_word_count']}-{self.quality_thresholds['max_word_count']}",
+            min_reading_level=self.quality_thresholds["min_reading_level"],
+            max_reading_level=self.quality_thresholds["max_reading_level"]
+        )
+    
+    async def amodify_story_with_feedback(self, story: str, feedback: str, category: str, stream: bool = False):
+        """Async variant of modify_story_with_feedback; stream=True gives an async iterator of text chunks"""
+        prompt = self._modification_prompt(story, feedback, category)
+        if self.safety_guard["enabled"]:
+            if stream:
+                return self._aguarded_stream(prompt, category, call_site="modify")
+            return await self._aguarded_text(prompt, category, call_site="modify")
+        openai_settings = config.snapshot.openai_settings
+        modified = await self.client.acall_model(
+            prompt,
+            temperature=openai_settings["temperature"],
+            stream=stream,
+            call_site="modify",
+            category=category
         )
+        return self._alstrip_stream(modified) if stream else modified
     
-    def modify_story_with_feedback(self, story: str, feedback: str, category: str) -> str:
-        """Modify story based on user feedback"""
+    def _modification_prompt(self, story: str, feedback: str, category: str) -> str:
+        """Build the prompt that rewrites a story around the user's feedback"""
         # Get category strategy for context
         if category in self.categories:
             category_strategy = self.categories[category]["prompt_strategy"]
@@ -122,7 +547,7 @@ class StoryTeller:
             user_feedback=feedback
         )
         
-        full_prompt = f"""
+        return f"""
         {modification_prompt}
 
         Modification context: {context}
@@ -138,9 +563,3 @@ class StoryTeller:
 
         Modified story:
         """
-        
-        openai_settings = config.get_openai_settings()
-        return self.client.call_model(
-            full_prompt, 
-            temperature=openai_settings["temperature"]
-        )
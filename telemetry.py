@@ -0,0 +1,184 @@
+import functools
+import inspect
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Tuple
+from config_loader import config
+
+# Latency bucket upper bounds in seconds, from sub-millisecond local work up to slow model calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+class Histogram:
+    """Fixed-bucket histogram: constant memory, O(log buckets) per observation"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.bounds = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        """Estimate the q-th percentile (0-100) by interpolating inside its bucket"""
+        if self.count == 0:
+            return 0.0
+        rank = q / 100 * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = self.bounds[index - 1] if index > 0 else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else self.max
+                lower, upper = max(lower, self.min), min(upper, self.max)
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min or 0.0,
+            "max": self.max or 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99)
+        }
+
+class Telemetry:
+    """Process-wide spans, histograms and counters with JSON and Prometheus export"""
+
+    def __init__(self, enabled: Optional[bool] = None):
+        # None defers to telemetry.enabled in config.json, read on first use rather than at import
+        self._enabled = enabled
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        if self._enabled is None:
+            self._enabled = config.get_telemetry_settings()["enabled"]
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value: bool):
+        self._enabled = value
+
+    @contextmanager
+    def span(self, stage: str, cpu: bool = False, **labels):
+        """Time a block of work into the stage_seconds histogram.
+
+        With cpu=True, the calling thread's CPU time is also recorded under
+        stage_cpu_seconds, separating local compute from waiting.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        cpu_start = time.thread_time() if cpu else None
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - start, stage=stage, **labels)
+            if cpu:
+                self.observe("stage_cpu_seconds", time.thread_time() - cpu_start, stage=stage, **labels)
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-serializable view of every histogram summary and counter"""
+        with self._lock:
+            return {
+                "histograms": [
+                    {"name": name, "labels": dict(labels), **histogram.summary()}
+                    for (name, labels), histogram in sorted(self._histograms.items())
+                ],
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ]
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                metric = f"story_{name}"
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.bounds, histogram.bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f"{metric}_bucket{_format_labels(labels, le=bound)} {cumulative}")
+                lines.append(f"{metric}_bucket{_format_labels(labels, le='+Inf')} {histogram.count}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"story_{name}_total{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str, export_format: str = "json"):
+        """Write a snapshot to disk as JSON or Prometheus text"""
+        content = self.to_prometheus() if export_format == "prometheus" else self.to_json()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+def _format_labels(labels: Tuple, **extra) -> str:
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+def timed(stage: str, cpu: bool = False):
+    """Decorator recording each call of a function or coroutine as a telemetry span"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with telemetry.span(stage, cpu=cpu):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with telemetry.span(stage, cpu=cpu):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Global telemetry instance
+telemetry = Telemetry()
@@ -1,105 +1,100 @@
 import sys
 import os
+import time
 sys.path.append(os.getcwd())
 
 from story_teller import StoryTeller
 from story_judge import StoryJudge
+from improvement_controller import ImprovementController
+from openai_client import usage_scope
 from config_loader import config
 
-def test_prompt(prompt_text, prompt_name):
-    storyteller = StoryTeller()
-    judge = StoryJudge()
+def test_prompts(prompts, level, storyteller, judge, controller):
+    """Generate a story per prompt, judge them in batches, then improve the failing ones within the budget"""
+    results, costs = [], []
+    for i, prompt_text in enumerate(prompts, 1):
+        start = time.perf_counter()
+        try:
+            with usage_scope() as usage:
+                story, category = storyteller.generate_story(prompt_text)
+            results.append((prompt_text, f"{level} Level {i}", story, category))
+            costs.append((time.perf_counter() - start, usage.total))
+        except Exception as e:
+            print(f"ERROR generating {level} Level {i}: {str(e)}")
+    
+    evaluations = judge.judge_batch([story for _, _, story, _ in results])
     
+    # Improve the stories that failed the judge's tiered checks; generation counts against each budget
+    for index, evaluation in enumerate(evaluations):
+        if evaluation["passed"]:
+            continue
+        prompt_text, prompt_name, story, category = results[index]
+        generation_seconds, generation_tokens = costs[index]
+        print(f"Improving {prompt_name} based on evaluation...")
+        result = controller.improve(story, evaluation, started=time.perf_counter() - generation_seconds,
+                                    spent_tokens=generation_tokens)
+        print(f"   {result.rounds} pass(es), stopped: {result.stop_reason}, composite "
+              f"{' -> '.join(f'{score:.1f}' for score in result.composite_history)}")
+        results[index] = (prompt_text, prompt_name, result.story, category)
+        evaluations[index] = result.evaluation
+    
+    for (prompt_text, prompt_name, story, category), evaluation in zip(results, evaluations):
+        print_result(prompt_text, prompt_name, story, category, evaluation)
+
+def print_result(prompt_text, prompt_name, story, category, evaluation):
     print(f"\n{'='*80}")
     print(f"TESTING: {prompt_name}")
     print(f"PROMPT: {prompt_text}")
     print(f"{'='*80}")
+    print(f"\nStory Category: {category.title()}")
     
-    try:
-        # Generate story
-        story, category = storyteller.generate_story(prompt_text)
-        print(f"\nStory Category: {category.title()}")
-        
-        # Evaluate story
-        evaluation = judge.evaluate_story(story)
-        
-        # Get thresholds from config
-        quality_thresholds = config.get_quality_thresholds()
-        story_settings = config.get_story_settings()
-        
-        # Check if improvement needed using config values
-        if (evaluation["composite_score"] < quality_thresholds["min_composite_score"] or 
-            evaluation["metrics"]["word_count"] < story_settings["min_word_count"] or 
-            evaluation["metrics"]["word_count"] > story_settings["max_word_count"] or
-            evaluation["metrics"]["grade_level"] > story_settings["max_grade_level"] or
-            evaluation["metrics"]["grade_level"] < story_settings["min_grade_level"]):
-            
-            print("Improving story based on evaluation...")
-            story = storyteller.improve_story(story, evaluation)
-            evaluation = judge.evaluate_story(story)
-        
-        # Print story
-        print(f"\n{'-'*60}")
-        print("YOUR BEDTIME STORY")
-        print(f"{'-'*60}")
-        print(story)
-        
-        # Print evaluation
-        print(f"\n{'-'*60}")
-        print("BEDTIME STORY EVALUATION")
-        print(f"{'-'*60}")
-        print(f"\nStory Category: {category.title()}")
+    # Print story
+    print(f"\n{'-'*60}")
+    print("YOUR BEDTIME STORY")
+    print(f"{'-'*60}")
+    print(story)
+    
+    # Print evaluation
+    print(f"\n{'-'*60}")
+    print("BEDTIME STORY EVALUATION")
+    print(f"{'-'*60}")
+    print(f"\nStory Category: {category.title()}")
+    print(f"\nEvaluation tiers run: {', '.join(evaluation['tiers_run'])}")
+    if evaluation["llm_judge"] is not None:
         print("\nLLM Judge Evaluation:")
         for key, value in evaluation["llm_judge"].items():
             formatted_key = key.replace("_", " ").title()
             print(f"   {formatted_key}: {value:.0f}/100")
         
         print(f"\nOverall Score: {evaluation['overall_score']:.0f}/100")
-        
-        quality_thresholds = config.get_quality_thresholds()
-        composite_rating = "Excellent" if evaluation["composite_score"] >= 90 else \
-                          "Very Good" if evaluation["composite_score"] >= quality_thresholds["min_composite_score"] + 10 else \
-                          "Good" if evaluation["composite_score"] >= quality_thresholds["min_composite_score"] else \
-                          "Needs Improvement"
-        
-        print(f"Comprehensive Metrics ({composite_rating}):")
-        print(f"   Text predictability: {evaluation['metrics']['predictability']:.1f}/100")
-        print(f"   Vocabulary richness: {evaluation['metrics']['vocabulary_richness']:.1f}%")
-        print(f"   Reading level: Grade {evaluation['metrics']['grade_level']:.2f}")
-        print(f"   Content safety: {evaluation['metrics']['safety']:.1f}/100")
-        print(f"   Composite Score: {evaluation['composite_score']:.1f}/100")
+    else:
+        print(f"\nLLM Judge skipped, failed local checks: {', '.join(evaluation['failed_checks'])}")
+    
+    quality_thresholds = config.snapshot.quality_thresholds
+    composite_rating = "Excellent" if evaluation["composite_score"] >= 90 else \
+                      "Very Good" if evaluation["composite_score"] >= quality_thresholds["min_composite_score"] + 10 else \
+                      "Good" if evaluation["composite_score"] >= quality_thresholds["min_composite_score"] else \
+                      "Needs Improvement"
+    
+    print(f"Comprehensive Metrics ({composite_rating}):")
+    print(f"   Text predictability: {evaluation['metrics']['predictability']:.1f}/100")
+    print(f"   Vocabulary richness: {evaluation['metrics']['vocabulary_richness']:.1f}%")
+    print(f"   Reading level: Grade {evaluation['metrics']['grade_level']:.2f}")
+    print(f"   Content safety: {evaluation['metrics']['safety']:.1f}/100")
+    print(f"   Composite Score: {evaluation['composite_score']:.1f}/100")
 
-        story_settings = config.get_story_settings()
-        print(f"\nStory Length: {evaluation['metrics']['word_count']} words (target: {story_settings['min_word_count']}-{story_settings['max_word_count']})")
-        
-    except Exception as e:
-        print(f"ERROR: {str(e)}")
+    min_words, max_words = config.snapshot.word_count_range
+    print(f"\nStory Length: {evaluation['metrics']['word_count']} words (target: {min_words}-{max_words})")
 
 def main():
-    # Easy Level Prompts
-    easy_prompts = [
-        "A story about a sleepy cat.",
-        "A friendly dog who likes to play.",
-        "Tell me about a little bird learning to fly.",
-        "A story about a bear getting ready for bed.",
-        "A rabbit who finds a carrot in the garden."
-    ]
-    
-    # Medium Level Prompts
-    medium_prompts = [
-        "Tell me a story about a brave lion who helps other animals in the forest.",
-        "Create a story about a little girl who finds a magical garden.",
-        "Write a story about two best friends who help a lost puppy find its way home.",
-        "Tell me about a family that bakes cookies together on a rainy day.",
-        "A story about a curious child who learns about butterflies in the garden."
-    ]
-    
-    # Hard Level Prompts
-    hard_prompts = [
-        "Tell me an adventure story about a young boy who discovers a hidden cave with sparkling crystals and meets a friendly dragon who teaches him about courage and kindness.",
-        "Create a magical story about three animal friends who must work together to save their enchanted forest home from losing its magic, learning about teamwork and the power of friendship along the way.",
-        "Write a story about a little girl who finds a mysterious music box that transports her to different lands where she meets talking animals and helps them solve problems while learning valuable life lessons."
-    ]
+    # Prompt sets live in config.json so benchmarks replay the same requests
+    prompt_sets = config.get_test_prompts()
+    easy_prompts = prompt_sets["easy"]
+    medium_prompts = prompt_sets["medium"]
+    hard_prompts = prompt_sets["hard"]
+    storyteller = StoryTeller()
+    judge = StoryJudge()
+    controller = ImprovementController(storyteller, judge)
     
     print("BEDTIME STORY GENERATOR - COMPREHENSIVE TEST RESULTS")
     print("="*80)
@@ -109,24 +104,30 @@ def main():
     print("EASY LEVEL PROMPTS")
     print(f"{'#'*80}")
     
-    for i, prompt in enumerate(easy_prompts, 1):
-        test_prompt(prompt, f"Easy Level {i}")
+    test_prompts(easy_prompts, "Easy", storyteller, judge, controller)
     
     # Test Medium Level
     print(f"\n{'#'*80}")
     print("MEDIUM LEVEL PROMPTS")
     print(f"{'#'*80}")
     
-    for i, prompt in enumerate(medium_prompts, 1):
-        test_prompt(prompt, f"Medium Level {i}")
+    test_prompts(medium_prompts, "Medium", storyteller, judge, controller)
     
     # Test Hard Level
     print(f"\n{'#'*80}")
     print("HARD LEVEL PROMPTS")
     print(f"{'#'*80}")
     
-    for i, prompt in enumerate(hard_prompts, 1):
-        test_prompt(prompt, f"Hard Level {i}")
+    test_prompts(hard_prompts, "Hard", storyteller, judge, controller)
+    
+    summary = controller.summary()
+    print(f"\n{'#'*80}")
+    print("IMPROVEMENT CONVERGENCE")
+    print(f"{'#'*80}")
+    print(f"Improved stories: {summary['runs']}, pass rate after improvement: {summary['pass_rate']:.0%}")
+    print(f"Mean passes: {summary['mean_rounds']:.2f}, mean time: {summary['mean_seconds']:.1f}s, "
+          f"mean tokens: {summary['mean_tokens']:.0f}")
+    print(f"Stop reasons: {', '.join(f'{reason} {count}' for reason, count in summary['stop_reasons'].items())}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+from backends import BackendRouter
+
+class RetryableError(Exception):
+    pass
+
+def router(*names, delay=0.05):
+    settings = {
+        "endpoints": [{"name": name} for name in names],
+        "hedge": {"enabled": True, "call_sites": ["generate"], "quantile": 95, "min_samples": 20,
+                  "min_delay_seconds": delay, "max_delay_seconds": delay},
+        "circuit_breaker": {"failure_threshold": 2, "cooldown_seconds": 60}
+    }
+    return BackendRouter(settings, {"model": "gpt", "request_timeout": 5}, lambda: (RetryableError,))
+
+class Admissions:
+    """Records admit(wait) calls and answers them with `allow`"""
+
+    def __init__(self, allow=True):
+        self.allow = allow
+        self.calls = []
+
+    def __call__(self, wait):
+        self.calls.append(wait)
+        return self.allow or wait
+
+def test_single_backend_is_never_hedged():
+    calls = []
+
+    def request(backend):
+        calls.append(backend.name)
+        time.sleep(0.15)
+        return "story"
+    admit = Admissions()
+    assert router("primary").call(request, "generate", stream=False, admit=admit) == "story"
+    assert calls == ["primary"]
+    assert admit.calls == []
+
+def test_slow_backend_is_hedged_and_the_loser_is_discarded():
+    release = threading.Event()
+    discarded = []
+
+    def request(backend):
+        if backend.name == "primary":
+            release.wait(5)
+        return backend.name
+    admit = Admissions()
+    result = router("primary", "fallback").call(request, "generate", stream=False, admit=admit,
+                                                 discard=discarded.append)
+    assert result == "fallback"
+    assert admit.calls == [False]  # The duplicate was admitted without waiting
+    release.set()
+    deadline = time.monotonic() + 5
+    while not discarded and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert discarded == ["primary"]
+
+def test_no_duplicate_when_the_rate_budget_is_full():
+    calls = []
+
+    def request(backend):
+        calls.append(backend.name)
+        time.sleep(0.15)
+        return backend.name
+    admit = Admissions(allow=False)
+    assert router("primary", "fallback").call(request, "generate", stream=False, admit=admit) == "primary"
+    assert calls == ["primary"]
+
+def test_failover_waits_for_admission_and_opens_the_circuit():
+    backends = router("primary", "fallback")
+
+    def request(backend):
+        if backend.name == "primary":
+            raise RetryableError()
+        return backend.name
+    for _ in range(2):
+        admit = Admissions()
+        assert backends.call(request, "judge", stream=False, admit=admit) == "fallback"
+        assert admit.calls == [True]
+    assert backends.backends[0].breaker.state == "open"
+    assert [backend.name for backend in backends.candidates()] == ["fallback"]
+
+def test_async_hedge_cancels_the_loser():
+    cancelled = []
+
+    async def request(backend):
+        if backend.name == "primary":
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(backend.name)
+                raise
+        return backend.name
+
+    async def aadmit(wait):
+        return True
+    result = asyncio.run(router("primary", "fallback").acall(request, "generate", stream=False, aadmit=aadmit))
+    assert result == "fallback"
+    assert cancelled == ["primary"]
@@ -0,0 +1,51 @@
+import pytest
+from contextlib import asynccontextmanager
+from best_of_n import BestOfNGenerator
+from story_judge import StoryJudge
+from story_teller import StoryTeller
+
+CALM_STORY = " ".join(["The sleepy bunny curled up in her soft warm bed."] * 40)
+
+class FakeAsyncClient:
+    """Streams prepared drafts in order and tracks whether the private session was used"""
+
+    def __init__(self, *drafts):
+        self.drafts = list(drafts)
+        self.prompts = []
+        self.in_private_session = False
+
+    @asynccontextmanager
+    async def private_session(self):
+        self.in_private_session = True
+        yield
+        self.in_private_session = False
+
+    async def acall_model(self, prompt, stream=False, **kwargs):
+        assert self.in_private_session
+        self.prompts.append(prompt)
+        draft = self.drafts.pop(0)
+        if isinstance(draft, Exception):
+            raise draft
+        if not stream:
+            return "".join(draft)
+
+        async def chunks():
+            for chunk in draft:
+                yield chunk
+        return chunks()
+
+def generator(client, candidates):
+    best_of_n = BestOfNGenerator(StoryTeller(client), StoryJudge(client))
+    best_of_n.candidates = candidates
+    return best_of_n
+
+def test_candidates_go_through_the_safety_guard():
+    client = FakeAsyncClient(["Two monsters ", "started to fight"], [CALM_STORY])
+    story, _, _ = generator(client, candidates=1).generate("a bunny story")
+    assert story == CALM_STORY
+    assert len(client.prompts) == 2  # The unsafe draft was restarted with the stricter prompt
+
+def test_generate_raises_when_every_candidate_fails():
+    client = FakeAsyncClient(ConnectionError(), ConnectionError())
+    with pytest.raises(RuntimeError):
+        generator(client, candidates=2).generate("a bunny story")
@@ -0,0 +1,96 @@
+import copy
+import json
+import time
+import pytest
+from conftest import REPO_ROOT
+from config_loader import ConfigLoader, compile_config, validate_config
+
+with open(REPO_ROOT / "config.json", encoding="utf-8") as f:
+    RAW = json.load(f)
+
+def edited(**changes) -> dict:
+    """A copy of config.json with "section.key" paths replaced"""
+    raw = copy.deepcopy(RAW)
+    for path, value in changes.items():
+        *parents, key = path.split(".")
+        node = raw
+        for parent in parents:
+            node = node[parent]
+        node[key] = value
+    return raw
+
+def test_shipped_config_is_valid():
+    assert validate_config(copy.deepcopy(RAW)) == []
+
+def test_every_problem_is_reported_at_once():
+    raw = edited(**{"story_evaluation.quality_thresholds.min_word_count": "250",
+                    "story_library.max_variants_per_request": True})
+    del raw["telemetry"]
+    problems = [
+        "story_evaluation.quality_thresholds.min_word_count: expected int, got str",
+        "story_library.max_variants_per_request: expected int, got a boolean",
+        "telemetry: missing",
+    ]
+    assert sorted(validate_config(raw)) == problems
+    with pytest.raises(ValueError) as error:
+        compile_config(raw, version=1)
+    assert all(problem in str(error.value) for problem in problems)
+
+def test_semantic_checks_run_on_a_well_typed_config():
+    raw = edited(**{"story_evaluation.quality_thresholds.min_word_count": 900,
+                    "story_library.reuse_policy": "sometimes",
+                    "story_categories.animals.inflections": {"owl": ["owls"]},
+                    "safety_filters.inflections": {"sleep": "sleepy"}})
+    assert validate_config(raw) == [
+        "story_evaluation.quality_thresholds: min_word_count exceeds max_word_count",
+        "story_categories.animals.inflections: expected configured word -> list of non-empty strings",
+        "story_library.reuse_policy: expected one of off, exact, similar",
+        "safety_filters.inflections: expected configured word -> list of non-empty strings",
+    ]
+
+def test_snapshot_is_read_only():
+    snapshot = compile_config(copy.deepcopy(RAW), version=1)
+    with pytest.raises(TypeError):
+        snapshot.sections["service"]["port"] = 1
+    assert isinstance(snapshot.sections["safety_filters"]["calming_words"], tuple)
+    assert snapshot.word_count_range == (RAW["story_evaluation"]["quality_thresholds"]["min_word_count"],
+                                         RAW["story_evaluation"]["quality_thresholds"]["max_word_count"])
+
+def write(path, raw):
+    path.write_text(json.dumps(raw), encoding="utf-8")
+
+def test_changed_file_is_reloaded_and_an_invalid_edit_keeps_the_live_snapshot(tmp_path, capsys):
+    path = tmp_path / "config.json"
+    write(path, RAW)
+    loader = ConfigLoader(str(path))
+    assert loader.snapshot.version == 1
+    assert not loader.reload_if_changed()
+    assert loader.snapshot.keyword_matcher.first("a sleepy owl") == "general"
+
+    write(path, edited(**{"story_categories.animals.keywords": [*RAW["story_categories"]["animals"]["keywords"], "owl"],
+                          "story_evaluation.quality_thresholds.min_word_count": 120}))
+    assert loader.reload_if_changed()
+    assert loader.snapshot.version == 2
+    assert loader.get_quality_thresholds()["min_word_count"] == 120
+    assert loader.snapshot.keyword_matcher.first("a sleepy owl") == "animals"
+
+    path.write_text("{ not json", encoding="utf-8")
+    assert not loader.reload_if_changed()
+    assert loader.snapshot.version == 2
+    assert "Invalid JSON" in loader.last_reload_error
+    assert "keeping version 2" in capsys.readouterr().out
+
+def test_watcher_picks_up_an_edit(tmp_path):
+    path = tmp_path / "config.json"
+    write(path, RAW)
+    loader = ConfigLoader(str(path))
+    assert loader.snapshot.version == 1
+    loader.start_watching(poll_interval=0.01)
+    try:
+        write(path, edited(**{"service.port": 9999}))
+        deadline = time.monotonic() + 2
+        while loader.snapshot.version == 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        loader.stop_watching()
+    assert loader.get("service.port") == 9999
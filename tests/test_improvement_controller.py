@@ -0,0 +1,83 @@
+import time
+import pytest
+from improvement_controller import ImprovementController
+from openai_client import _count_tokens, load_openai
+
+SETTINGS = {"max_rounds": 3, "time_budget_seconds": 60, "token_budget": 10000, "min_composite_gain": 2,
+            "temperature_schedule": [0.9, 0.7]}
+
+def evaluation(score: float, passed: bool = False, changes: bool = True) -> dict:
+    return {"composite_score": score, "passed": passed, "changes": changes}
+
+class FakeStoryteller:
+    """Each improve round returns the next numbered story and spends `round_tokens` tokens"""
+
+    def __init__(self, round_tokens: int = 0, error: Exception = None):
+        self.round_tokens = round_tokens
+        self.error = error
+        self.temperatures = []
+
+    def improvement_instructions(self, evaluation):
+        return "shorter sentences" if evaluation["changes"] else ""
+
+    def improve_story(self, story, evaluation, temperature):
+        if self.error is not None:
+            raise self.error
+        self.temperatures.append(temperature)
+        _count_tokens("completion_tokens", self.round_tokens, "improve")
+        return f"story {int(story.split()[1]) + 1}"
+
+class FakeJudge:
+    """Evaluations of "story 1", "story 2", ... in order"""
+
+    def __init__(self, *evaluations):
+        self.evaluations = evaluations
+
+    def judge_story(self, story, base=None):
+        return self.evaluations[int(story.split()[1]) - 1]
+
+def improve(storyteller, *evaluations, first=evaluation(50), settings=SETTINGS, **kwargs):
+    controller = ImprovementController(storyteller, FakeJudge(*evaluations), settings)
+    return controller, controller.improve("story 0", first, **kwargs)
+
+def test_stops_when_a_round_passes():
+    _, result = improve(FakeStoryteller(), evaluation(80, passed=True))
+    assert (result.stop_reason, result.rounds, result.best_round, result.story) == ("passed", 1, 1, "story 1")
+
+def test_stops_when_a_round_gains_too_little_and_keeps_the_best_story():
+    _, result = improve(FakeStoryteller(), evaluation(60), evaluation(59))
+    assert (result.stop_reason, result.rounds, result.best_round, result.story) == ("converged", 2, 1, "story 1")
+    assert result.composite_history == [50, 60, 59]
+
+def test_stops_after_max_rounds_following_the_temperature_schedule():
+    storyteller = FakeStoryteller()
+    _, result = improve(storyteller, evaluation(60), evaluation(70), evaluation(80), evaluation(90))
+    assert (result.stop_reason, result.rounds) == ("max_rounds", 3)
+    assert storyteller.temperatures == [0.9, 0.7, 0.7]
+
+def test_stops_when_the_evaluation_asks_for_no_changes():
+    _, result = improve(FakeStoryteller(), first=evaluation(50, changes=False))
+    assert (result.stop_reason, result.rounds, result.story) == ("no_changes", 0, "story 0")
+
+def test_stops_before_a_round_that_would_exceed_the_token_budget():
+    _, result = improve(FakeStoryteller(round_tokens=400), evaluation(60), evaluation(70),
+                        settings={**SETTINGS, "token_budget": 900}, spent_tokens=150)
+    # 150 + 400 spent; another 400-token round would pass 900
+    assert (result.stop_reason, result.rounds, result.tokens) == ("token_budget", 1, 550)
+
+def test_stops_when_the_time_budget_is_spent():
+    _, result = improve(FakeStoryteller(), evaluation(60), started=time.perf_counter() - 61)
+    assert (result.stop_reason, result.rounds) == ("time_budget", 0)
+
+def test_stops_on_a_model_error_with_the_best_story_so_far():
+    error = load_openai().error.APIError("down")
+    _, result = improve(FakeStoryteller(error=error), evaluation(60))
+    assert (result.stop_reason, result.rounds, result.story) == ("error", 0, "story 0")
+
+def test_summary_counts_stop_reasons():
+    controller = ImprovementController(FakeStoryteller(), FakeJudge(evaluation(80, passed=True)), SETTINGS)
+    controller.improve("story 0", evaluation(50))
+    controller.improve("story 0", evaluation(90, passed=True))
+    summary = controller.summary()
+    assert summary["stop_reasons"] == {"passed": 2}
+    assert summary["pass_rate"] == 1.0 and summary["mean_rounds"] == pytest.approx(0.5)
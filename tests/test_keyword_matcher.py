@@ -0,0 +1,42 @@
+import pytest
+from config_loader import config
+from keyword_matcher import KeywordMatcher
+from story_teller import StoryTeller
+
+def baseline_category(user_input: str) -> str:
+    """categorize_request as it was before KeywordMatcher: first category with a keyword substring"""
+    user_lower = user_input.lower()
+    for category, category_config in config.snapshot.sections["story_categories"].items():
+        if any(keyword in user_lower for keyword in category_config["keywords"]):
+            return category
+    return "general"
+
+TEST_PROMPTS = [prompt for prompts in config.get_test_prompts().values() for prompt in prompts]
+
+@pytest.mark.parametrize("prompt", TEST_PROMPTS)
+def test_test_prompts_keep_their_baseline_category(prompt):
+    assert StoryTeller(client=object()).categorize_request(prompt) == baseline_category(prompt)
+
+@pytest.mark.parametrize("text, category", [
+    ("a magical garden", "magic"),
+    ("puppies playing", "friendship"),
+    ("exploring the woods", "adventure"),
+    ("two foxes", "animals"),
+    ("she helps", "friendship"),
+])
+def test_inflected_keywords_match(text, category):
+    assert config.snapshot.keyword_matcher.first(text) == category
+
+@pytest.mark.parametrize("text", [
+    "a boy bearing gifts",
+    "the homer who hit a ball",
+    "a cater waiter",
+    "a catalog of dadaist paintings",
+])
+def test_suffixed_words_that_are_not_inflections_do_not_match(text):
+    assert config.snapshot.keyword_matcher.match(text) == {}
+
+def test_keywords_do_not_match_inside_other_words():
+    matcher = KeywordMatcher({"animals": {"keywords": ["cat"]}, "learning": {"keywords": ["art"]}})
+    assert matcher.match("an education at the start") == {}
+    assert matcher.first("an education") == "general"
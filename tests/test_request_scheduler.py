@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import time
+import pytest
+from request_scheduler import BATCH, INTERACTIVE, RequestDeadlineExceeded, RequestScheduler
+
+class Flaky(Exception):
+    pass
+
+def scheduler(**overrides) -> RequestScheduler:
+    settings = {"requests_per_minute": 600, "tokens_per_minute": 100000, "max_retries": 2,
+                "base_backoff_seconds": 0, "max_backoff_seconds": 0, "deadline_seconds": 5, **overrides}
+    return RequestScheduler(settings, retryable_errors=lambda: (Flaky,))
+
+def failing(times: int):
+    calls = []
+    def call():
+        calls.append(1)
+        if len(calls) <= times:
+            raise Flaky()
+        return "story"
+    return call, calls
+
+def returning(result):
+    async def call():
+        return result
+    return call
+
+def test_retryable_errors_are_retried_until_max_retries():
+    limiter = scheduler()
+    call, calls = failing(2)
+    assert limiter.run(call) == "story"
+    assert len(calls) == 3
+    call, calls = failing(3)
+    with pytest.raises(Flaky):
+        limiter.run(call)
+    assert len(calls) == 3
+    assert limiter.stats["retries"] == 4 and limiter.stats["failures"] == 1 and limiter.stats["requests"] == 6
+
+def test_other_errors_are_not_retried():
+    limiter = scheduler()
+    with pytest.raises(ValueError):
+        limiter.run(lambda: int("x"))
+    assert limiter.stats["retries"] == 0
+
+def test_wait_beyond_the_deadline_is_refused():
+    limiter = scheduler(tokens_per_minute=60, deadline_seconds=0.2)
+    limiter.token_bucket.tokens = 0
+    with pytest.raises(RequestDeadlineExceeded):
+        limiter.run(lambda: "story", tokens=30)
+    with pytest.raises(RequestDeadlineExceeded):
+        asyncio.run(limiter.arun(returning("story"), tokens=30))
+
+def test_interactive_calls_are_admitted_before_waiting_batch_calls():
+    limiter = scheduler()
+    limiter.request_bucket.tokens = 0
+    admitted = []
+    def wait(priority):
+        limiter.acquire(priority, 0)
+        admitted.append(priority)
+    batch = threading.Thread(target=wait, args=(BATCH,))
+    batch.start()
+    time.sleep(0.02)
+    interactive = threading.Thread(target=wait, args=(INTERACTIVE,))
+    interactive.start()
+    batch.join(2)
+    interactive.join(2)
+    assert admitted == [INTERACTIVE, BATCH]
+
+def test_identical_in_flight_calls_share_one_result():
+    limiter = scheduler()
+    release = threading.Event()
+    calls = []
+    def call():
+        calls.append(1)
+        release.wait(2)
+        return "story"
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(limiter.run(call, key="k"))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+    assert results == ["story"] * 3
+    assert len(calls) == 1 and limiter.stats["coalesced"] == 2
+
+def test_identical_in_flight_async_calls_share_one_result():
+    limiter = scheduler()
+    calls = []
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "story"
+    async def main():
+        return await asyncio.gather(*(limiter.arun(call, key="k") for _ in range(3)))
+    assert asyncio.run(main()) == ["story"] * 3
+    assert len(calls) == 1 and limiter.stats["coalesced"] == 2
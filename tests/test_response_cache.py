@@ -0,0 +1,46 @@
+import response_cache
+from response_cache import ResponseCache, make_cache_key
+
+def settings(tmp_path, **overrides):
+    return {"enabled": True, "max_memory_entries": 2, "db_path": str(tmp_path / "cache.sqlite3"),
+            "ttl_seconds": 60, "max_cacheable_temperature": 0.3, **overrides}
+
+def test_key_covers_every_request_parameter():
+    key = make_cache_key("model", "prompt", 0.0, 100)
+    assert key == make_cache_key("model", "prompt", 0.0, 100)
+    assert len({key, make_cache_key("other", "prompt", 0.0, 100), make_cache_key("model", "prompt!", 0.0, 100),
+                make_cache_key("model", "prompt", 0.2, 100), make_cache_key("model", "prompt", 0.0, 200)}) == 5
+
+def test_memory_tier_evicts_least_recently_used_and_disk_tier_keeps_it(tmp_path):
+    cache = ResponseCache(settings(tmp_path))
+    cache.put("a", "story a")
+    cache.put("b", "story b")
+    assert cache.get("a") == "story a"
+    cache.put("c", "story c")
+    assert list(cache._memory) == ["a", "c"]
+    assert cache.get("b") == "story b"
+    assert cache.stats == {"memory_hits": 1, "disk_hits": 1, "misses": 0, "bypassed": 0}
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    ResponseCache(settings(tmp_path)).put("a", "story a")
+    cache = ResponseCache(settings(tmp_path))
+    assert cache.get("a") == "story a"
+    assert cache.get("a") == "story a"
+    assert cache.stats["disk_hits"] == 1 and cache.stats["memory_hits"] == 1
+
+def test_expired_entries_are_dropped_from_both_tiers(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache = ResponseCache(settings(tmp_path))
+    cache.put("a", "story a")
+    now[0] += 61
+    assert cache.get("a") is None
+    assert cache.stats["misses"] == 1
+    assert cache._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 0
+
+def test_memory_only_cache_without_db_path(tmp_path):
+    cache = ResponseCache(settings(tmp_path, db_path=""))
+    cache.put("a", "story a")
+    assert cache._db is None
+    assert cache.get("a") == "story a"
+    assert cache.get("b") is None
@@ -0,0 +1,74 @@
+import asyncio
+from safety_guard import STREAM_RESTART, StreamSafetyScanner
+from story_teller import StoryTeller
+
+UNSAFE_WORDS = frozenset({"monster", "fight", "hurt"})
+
+def test_scanner_counts_inflected_words_split_across_chunks():
+    scanner = StreamSafetyScanner(UNSAFE_WORDS, max_hits=1, inflections={"fight": ["fighting"]})
+    shown = [scanner.feed(chunk) for chunk in ("The mon", "sters were ", "figh", "ting.")]
+    assert not scanner.tripped
+    assert "".join(shown) == "The monsters were "
+    assert scanner.finish() == "fighting."
+    assert scanner.tripped
+    assert scanner.hits == {"monster", "fight"}
+
+class FakeClient:
+    """Streams prepared drafts in order and records which were closed early"""
+
+    def __init__(self, *drafts):
+        self.drafts = list(drafts)
+        self.prompts = []
+
+    def call_model(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        return iter(self.drafts.pop(0))
+
+def test_guarded_stream_restarts_when_the_last_word_is_unsafe():
+    client = FakeClient(["Two monsters ", "started to fight"], ["A calm ", "night."])
+    chunks = list(StoryTeller(client)._guarded_stream("prompt", priority=0, category="animals"))
+    # The unsafe last word is caught at the end of the stream, before it is shown
+    assert chunks == ["Two monsters ", "started to ", STREAM_RESTART, "A calm ", "night."]
+    assert len(client.prompts) == 2
+
+class FakeAsyncClient(FakeClient):
+    async def acall_model(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        draft = self.drafts.pop(0)
+
+        async def chunks():
+            for chunk in draft:
+                yield chunk
+        return chunks()
+
+def test_async_guarded_stream_checks_the_last_word():
+    client = FakeAsyncClient(["Two monsters ", "started to fight"], ["A calm ", "night."])
+
+    async def collect():
+        return [chunk async for chunk in StoryTeller(client)._aguarded_stream("prompt", category="animals")]
+    assert asyncio.run(collect()) == ["Two monsters ", "started to ", STREAM_RESTART, "A calm ", "night."]
+
+class FakeChatClient(FakeClient):
+    def call_chat(self, messages, **kwargs):
+        return "not a patch"
+
+def test_rewrite_fallback_streams_through_the_guard():
+    client = FakeChatClient(["Two monsters ", "started to fight"], ["A calm ", "night."])
+    storyteller = StoryTeller(client)
+    session = storyteller.start_session("a story", "The first story.", "animals")
+    chunks, patched = storyteller.modify_in_session(session, "make it calmer", stream=True)
+    assert not patched
+    assert list(chunks) == ["Two monsters ", "started to ", STREAM_RESTART, "A calm ", "night."]
+    assert session.story == "A calm night."
+
+class FakeTextClient(FakeClient):
+    def call_model(self, prompt, stream=False, **kwargs):
+        assert not stream  # Buffered generation is not streamed, so it can be sized
+        self.prompts.append(prompt)
+        return "".join(self.drafts.pop(0))
+
+def test_unstreamed_generation_replaces_an_unsafe_draft():
+    client = FakeTextClient(["Two monsters started to fight."], ["A calm night."])
+    story, _ = StoryTeller(client).generate_story("a story about the night")
+    assert story == "A calm night."
+    assert len(client.prompts) == 2
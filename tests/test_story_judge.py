@@ -0,0 +1,90 @@
+import asyncio
+import json
+import pytest
+from story_judge import LLM_SCORE_FIELDS, StoryJudge, parse_batch_scores
+from test_text_metrics import recorded_stories
+
+class CountingClient:
+    """Records judge calls; any call means judge tokens were spent"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def acall_model(self, prompt, **kwargs):
+        self.calls += 1
+        return "{}"
+
+def test_async_judge_is_not_called_when_the_local_gate_fails():
+    client = CountingClient()
+    judge = StoryJudge(client=client)
+    evaluation = asyncio.run(judge.ajudge_story("Too short."))
+    assert not evaluation["passed"]
+    assert evaluation["llm_judge"] is None
+    assert client.calls == 0
+
+def test_judge_many_matches_judge_story_per_story():
+    stories = [*recorded_stories(), "Too short.", ""]
+    judge = StoryJudge(client=object())
+    rows = judge.judge_many(stories)
+    assert len(rows) == len(stories)
+    for row, story in zip(rows, stories):
+        evaluation = judge.evaluate_locally(story) if story else None
+        if evaluation is None:
+            assert row.word_count == 0 and row.vocabulary_richness == 0
+            continue
+        assert row.word_count == evaluation["metrics"]["word_count"]
+        assert row.grade_level == pytest.approx(evaluation["metrics"]["grade_level"])
+        for name, value in evaluation["component_breakdown"].items():
+            column = {"vocabulary": "vocabulary_score", "age_level": "age_level_score"}.get(name, name)
+            assert row[column] == pytest.approx(value), name
+        assert row.composite_score == pytest.approx(evaluation["composite_score"])
+
+def batch_entry(story_id, score=80.0, **overrides):
+    return {"id": story_id, **{field: score for field in LLM_SCORE_FIELDS}, **overrides}
+
+def test_parse_batch_scores_keeps_only_valid_entries():
+    response = json.dumps({"scores": [
+        batch_entry(1, 90),
+        batch_entry(2, age_appropriateness=101),
+        batch_entry(3, engagement=True),
+        {"id": 4, "age_appropriateness": 80},
+        batch_entry(5, extra=1),
+        batch_entry(6), batch_entry(6),
+        batch_entry(7, 70),
+        batch_entry(9),
+        batch_entry("8"),
+    ]})
+    scores = parse_batch_scores(response, batch_size=8)
+    assert set(scores) == {1, 7}
+    assert scores[1] == {field: 90.0 for field in LLM_SCORE_FIELDS}
+
+@pytest.mark.parametrize("response", ["not json", "[]", '{"scores": {}}', '{"other": []}'])
+def test_parse_batch_scores_rejects_malformed_responses(response):
+    assert parse_batch_scores(response, batch_size=2) == {}
+
+def test_parse_batch_scores_accepts_a_code_fence():
+    response = "```json\n" + json.dumps({"scores": [batch_entry(1)]}) + "\n```"
+    assert set(parse_batch_scores(response, batch_size=1)) == {1}
+
+class BatchJudgeClient:
+    """Answers batch judge calls from a script, and single-story judge calls with fixed scores"""
+
+    def __init__(self, *batch_responses):
+        self.batch_responses = list(batch_responses)
+        self.calls = []
+
+    def call_model(self, prompt, call_site, **kwargs):
+        self.calls.append(call_site)
+        if call_site == "judge_batch":
+            return json.dumps({"scores": self.batch_responses.pop(0)})
+        return "50, 50, 50, 50, 50, 50"
+
+def test_invalid_batch_entries_are_rejudged_then_judged_singly():
+    # Round one misses story 2 and gets an invalid story 3; round two renumbers them 1 and 2
+    client = BatchJudgeClient([batch_entry(1, 90), batch_entry(3, 200)],
+                              [batch_entry(1, 70), batch_entry(2, 101)])
+    results = StoryJudge(client=client).batch_llm_judgments(["one", "two", "three"])
+    assert client.calls == ["judge_batch", "judge_batch", "judge"]
+    assert results[0] == ({field: 90.0 for field in LLM_SCORE_FIELDS}, False)
+    assert results[1] == ({field: 70.0 for field in LLM_SCORE_FIELDS}, False)
+    assert results[2] == ({field: 50.0 for field in LLM_SCORE_FIELDS}, False)
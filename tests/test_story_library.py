@@ -0,0 +1,15 @@
+from config_loader import config
+from story_library import StoryLibrary
+
+EVALUATION = {"composite_score": 90, "passed": True}
+
+def test_saved_story_is_served_until_it_was_delivered(tmp_path):
+    settings = dict(config.get_story_library_settings(), db_path=str(tmp_path / "library.sqlite3"))
+    library = StoryLibrary(settings)
+    story_id = library.add("a sleepy cat", "animals", "The cat slept.", EVALUATION)
+    # The author gets their saved story back on a matching request
+    match = library.find_similar("Tell me a story about a sleepy cat.", "local")
+    assert match["id"] == story_id
+    library.record_delivery(story_id, "local")
+    assert library.find_similar("a sleepy cat", "local") is None
+    assert library.find_similar("a sleepy cat", "someone else")["id"] == story_id
@@ -0,0 +1,30 @@
+from story_pool import StoryPool
+from story_teller import StoryTeller
+
+class FakeClient:
+    """Returns a fixed story and records the prompt and category of each call"""
+
+    def __init__(self):
+        self.calls = []
+
+    def call_model(self, prompt, **kwargs):
+        self.calls.append((prompt, kwargs["category"]))
+        return "A calm story."
+
+class PassingJudge:
+    def judge_story(self, story):
+        return {"passed": True}
+
+SETTINGS = {"enabled": True, "target_size": 2, "low_watermark": 0, "ttl_seconds": 600, "workers": 1,
+            "max_attempts_per_story": 1, "sweep_interval_seconds": 60, "general_request": "a bedtime story"}
+
+def test_refill_prompts_use_the_pool_category():
+    client = FakeClient()
+    storyteller = StoryTeller(client)
+    pool = StoryPool(storyteller, PassingJudge(), SETTINGS, stopwords=())
+    pool._fill("animals")
+    pool._fill("general")
+    strategy = storyteller.categories["animals"]["prompt_strategy"]
+    assert [category for _, category in client.calls] == ["animals"] * 2 + ["general"] * 2
+    assert all(strategy in prompt for prompt, _ in client.calls[:2])
+    assert pool.take("animals") is not None
@@ -0,0 +1,29 @@
+import asyncio
+import json
+from story_teller import StoryTeller
+
+STORY = "The cat slept.\n\nThe moon rose."
+
+class FakePatchClient:
+    """Answers every patch request with a replacement of the last paragraph and records the messages"""
+
+    def __init__(self):
+        self.messages = []
+
+    async def acall_chat(self, messages, **kwargs):
+        self.messages.append(messages)
+        return json.dumps({"edits": [{"op": "replace", "paragraph": 2, "text": f"Round {len(self.messages)}."}]})
+
+def test_sessions_resume_from_returned_history():
+    client = FakePatchClient()
+    storyteller = StoryTeller(client)
+    story, history = STORY, []
+    for feedback in ("shorter", "calmer"):
+        session = storyteller.start_session("a cat", story, "animals", history)
+        story, patched = asyncio.run(storyteller.amodify_in_session(session, feedback))
+        history = session.recent_history()
+    assert patched
+    assert story == "The cat slept.\n\nRound 2."
+    assert [feedback for feedback, _ in history] == ["shorter", "calmer"]
+    # The second round's request showed the model the first round
+    assert any(message["content"] == "Feedback: shorter" for message in client.messages[1])
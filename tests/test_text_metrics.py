@@ -0,0 +1,95 @@
+import json
+import re
+import pytest
+import textstat
+from conftest import REPO_ROOT
+from config_loader import config
+from keyword_matcher import word_forms
+from story_judge import StoryJudge
+from text_metrics import TextMetricsEngine
+
+def recorded_stories():
+    with open(REPO_ROOT / "recorded_stories.jsonl", encoding="utf-8") as f:
+        return [json.loads(line)["story"] for line in f if line.strip()]
+
+def whole_word_hits(words, story_lower: str) -> set:
+    """Configured words found as whole words, in plural form or as a configured inflection"""
+    forms = word_forms(words, config.get_safety_filters().get("inflections"))
+    return {word for form, word in forms.items() if re.search(rf"\b{re.escape(form)}\b", story_lower)}
+
+def baseline_metrics(story: str) -> dict:
+    """The judge's metrics as they were computed before TextMetricsEngine, straight from textstat.
+
+    Calming and unsafe words are counted as whole words, not substrings as they once were.
+    """
+    filters = config.get_safety_filters()
+    words = story.split()
+    story_lower = story.lower()
+    calming_found = len(whole_word_hits(filters["calming_words"], story_lower))
+    unsafe_found = len(whole_word_hits(filters["unsafe_words"], story_lower))
+    return {
+        "word_count": len(words),
+        "grade_level": textstat.flesch_kincaid_grade(story),
+        "vocabulary_richness": len(set(word.lower() for word in words)) / len(words) * 100,
+        "predictability": min(calming_found / len(filters["calming_words"]) * 100, 100),
+        "safety": max(100 - unsafe_found * filters["safety_penalty_per_word"], 0)
+    }
+
+@pytest.fixture
+def judge():
+    # Metrics never call the model
+    return StoryJudge(client=object())
+
+@pytest.mark.parametrize("story", recorded_stories())
+def test_metrics_match_baseline_on_recorded_stories(judge, story):
+    metrics = judge.analyze_metrics(story)
+    for name, expected in baseline_metrics(story).items():
+        assert metrics[name] == pytest.approx(expected), name
+
+@pytest.mark.parametrize("story", [
+    "Title Line\n\nOnce upon a time... a cat. Hi! \"Yes,\" she said!! ... Then we went home\n\nand slept well.",
+    "end.Next one is here. A-b c—d — e didn't well-known 3.5 km\n\n\n  ... ok ok ok ok",
+    "Short. Two words. Three words here? no end here"
+])
+def test_sentences_and_grade_match_baseline_across_paragraphs(judge, story):
+    metrics = judge.analyze_metrics(story)
+    assert metrics["grade_level"] == baseline_metrics(story)["grade_level"]
+
+def test_inflected_unsafe_and_calming_words_are_counted(judge):
+    story = "The monsters were fighting and the kids got hurts... sleepy... dreams... asleep"
+    metrics = judge.analyze_metrics(story)
+    assert metrics["safety"] == 40
+    assert metrics["predictability"] == pytest.approx(100 * 2 / 12)
+
+def test_words_inside_other_words_are_not_counted(judge):
+    metrics = judge.analyze_metrics("Meanwhile a nightingale and a lovebird met a bloodhound.")
+    assert metrics["safety"] == 100
+    assert metrics["predictability"] == 0
+
+def revisions(story: str, other: str):
+    """Edits a feedback round could make: paragraphs removed, replaced, added, reordered or repeated"""
+    paragraphs, extra = story.split("\n\n"), other.split("\n\n")[0]
+    yield "\n\n".join(paragraphs[1:])
+    yield "\n\n".join([extra, *paragraphs[1:]])
+    yield "\n\n".join([*paragraphs, extra])
+    yield "\n\n".join(reversed(paragraphs))
+    yield "\n\n".join([*paragraphs, paragraphs[0]])
+    yield story.replace(".", ". The end.", 1)
+
+def new_engine() -> TextMetricsEngine:
+    filters = config.get_safety_filters()
+    return TextMetricsEngine(filters["calming_words"], filters["unsafe_words"])
+
+STORIES = recorded_stories()
+
+@pytest.mark.parametrize("index", range(len(STORIES)))
+def test_incremental_scan_matches_a_full_scan(index):
+    story = STORIES[index]
+    for revision in revisions(story, STORIES[(index + 1) % len(STORIES)]):
+        engine = new_engine()
+        engine.scan(story)
+        incremental = engine.scan(revision, base=story)
+        assert engine.stats["incremental_merges"] == 1
+        full = new_engine().scan(revision)
+        assert dict(incremental.pop("word_counts")) == dict(full.pop("word_counts"))
+        assert incremental == full
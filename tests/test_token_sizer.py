@@ -0,0 +1,15 @@
+from token_sizer import TokenSizer
+
+SETTINGS = {"enabled": True, "percentile": 0.95, "margin_ratio": 0.2, "min_tokens": 100,
+            "min_samples": 5, "window": 50, "widen_factor": 1.5, "stream_usage": True}
+
+def test_truncated_lengths_raise_the_floor_but_are_not_sampled():
+    sizer = TokenSizer(SETTINGS)
+    for _ in range(5):
+        sizer.record("generate", "animals", 400, 1000, truncated=False)
+    assert sizer.limit("generate", "animals", 1000) == 480
+
+    for _ in range(20):
+        sizer.record("generate", "animals", 480, 480, truncated=True)
+    assert sizer.stats()["generate/animals"] == {"samples": 5, "floor": 720, "truncations": 20}
+    assert sizer.limit("generate", "animals", 1000) == 720
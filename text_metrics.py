@@ -0,0 +1,220 @@
+import hashlib
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional
+from keyword_matcher import word_forms
+
+# Words, sentences and syllables follow textstat's rules, which the judge used
+# before it tokenized stories itself: words are whitespace-separated chunks,
+# punctuation is dropped before counting syllables, and a sentence runs up to
+# the next run of terminal punctuation.
+PUNCTUATION = re.compile(r"[^\w\s]")
+WORD_CHARACTER = re.compile(r"\w")
+# Calming and unsafe words are matched against the letter/digit runs of each chunk
+WORD_PART = re.compile(r"\w+")
+SENTENCE_END = re.compile(r"[.!?]+")
+# Whitespace only, so paragraphs can be scanned independently
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+@lru_cache(maxsize=65536)
+def count_syllables(word: str) -> int:
+    """Syllables in a single lowercase word without punctuation, memoized across stories"""
+    # textstat loads its dictionaries on import (~0.25s), so only runs that measure text pay for it
+    import textstat
+    return textstat.syllable_count(word)
+
+def flesch_kincaid_grade(lexicon_count: int, sentence_count: int, syllable_count: int) -> float:
+    """Flesch-Kincaid grade level from precomputed totals, rounded as textstat rounds it"""
+    sentence_length = _round(lexicon_count / sentence_count, 1) if sentence_count else 0.0
+    syllables_per_word = _round(syllable_count / lexicon_count, 1) if lexicon_count else 0.0
+    return _round(0.39 * sentence_length + 11.8 * syllables_per_word - 15.59, 1)
+
+def matching_words(forms: Mapping[str, str], chunks: Iterable[str]) -> FrozenSet[str]:
+    """The configured words that lowercase whitespace-separated chunks contain as whole words.
+
+    `forms` maps each accepted surface form to its word (see keyword_matcher.word_forms),
+    so "monsters" counts as "monster" but "meanwhile" does not count as "mean".
+    """
+    return frozenset(forms[part] for chunk in chunks for part in WORD_PART.findall(chunk) if part in forms)
+
+@dataclass(frozen=True)
+class ParagraphCounts:
+    """Counts for one paragraph, plus what is needed to stitch sentences across paragraph breaks"""
+    word_counts: Counter    # whitespace-separated chunks, as str.split() gives them
+    word_count: int
+    lexicon_count: int      # chunks with at least one letter or digit
+    syllable_count: int
+    sentences: int          # sentences of more than two words both started and ended inside the paragraph
+    leading_words: int      # words before the first terminal punctuation; they may continue the previous sentence
+    has_end: bool           # the paragraph contains terminal punctuation
+    trailing_words: int     # words after the last terminal punctuation, in a sentence that runs on
+    calming_hits: FrozenSet[str]
+    unsafe_hits: FrozenSet[str]
+
+class _StoryTotals:
+    """Whole-story word multiset and totals, kept up to date as paragraphs are added and removed"""
+
+    def __init__(self):
+        self.parts = {}
+        self.paragraph_keys = Counter()
+        self.word_counts = Counter()
+        self.word_count = 0
+        self.lexicon_count = 0
+        self.syllable_count = 0
+
+    def add(self, key: str, part: ParagraphCounts, times: int):
+        self.parts[key] = part
+        self.paragraph_keys[key] += times
+        for _ in range(times):
+            self.word_counts += part.word_counts
+        self.word_count += times * part.word_count
+        self.lexicon_count += times * part.lexicon_count
+        self.syllable_count += times * part.syllable_count
+
+    def remove(self, key: str, times: int):
+        part = self.parts[key]
+        self.paragraph_keys[key] -= times
+        if self.paragraph_keys[key] <= 0:
+            del self.paragraph_keys[key]
+            del self.parts[key]
+        for _ in range(times):
+            self.word_counts -= part.word_counts  # Counter subtraction also drops words that reach zero
+        self.word_count -= times * part.word_count
+        self.lexicon_count -= times * part.lexicon_count
+        self.syllable_count -= times * part.syllable_count
+
+class TextMetricsEngine:
+    """Tokenizes stories paragraph by paragraph and merges the counts StoryJudge needs.
+
+    Paragraph counts are cached by content hash, so re-scoring a story after
+    a feedback round only tokenizes the paragraphs that changed. Given the
+    previous version of the story as `base`, scan() also updates the cached
+    whole-story totals from the removed and added paragraphs instead of
+    summing every paragraph again.
+    """
+
+    def __init__(self, calming_words: Iterable[str], unsafe_words: Iterable[str],
+                 max_cached_paragraphs: int = 4096, max_cached_stories: int = 256,
+                 inflections: Optional[Mapping[str, Iterable[str]]] = None):
+        self.calming_words = frozenset(word.lower() for word in calming_words)
+        self.unsafe_words = frozenset(word.lower() for word in unsafe_words)
+        self.calming_forms = word_forms(self.calming_words, inflections)
+        self.unsafe_forms = word_forms(self.unsafe_words, inflections)
+        self.max_cached_paragraphs = max_cached_paragraphs
+        self.max_cached_stories = max_cached_stories
+        self.stats = {"paragraph_hits": 0, "paragraph_misses": 0, "incremental_merges": 0, "full_merges": 0}
+        self._paragraphs = OrderedDict()
+        self._stories = OrderedDict()
+        self._lock = threading.Lock()
+
+    def scan(self, text: str, base: Optional[str] = None) -> Dict:
+        """Return word, sentence and syllable totals plus calming/unsafe word hits.
+
+        `base` is an earlier version of the same story, e.g. before an improve
+        or modify step. word_counts is a read-only view of cached totals and
+        changes if this story is later used as another scan's base.
+        """
+        paragraphs = PARAGRAPH_BREAK.split(text.lower())
+        keys = [_content_key(paragraph) for paragraph in paragraphs]
+        parts = [self._scan_paragraph(key, paragraph) for key, paragraph in zip(keys, paragraphs)]
+
+        with self._lock:
+            totals = self._story_totals(_content_key(text), keys, parts, base)
+            return {
+                "word_count": totals.word_count,
+                "unique_word_count": len(totals.word_counts),
+                "lexicon_count": totals.lexicon_count,
+                "sentence_count": _count_sentences(parts),
+                "syllable_count": totals.syllable_count,
+                "word_counts": MappingProxyType(totals.word_counts),
+                # Hits come from each paragraph's chunks, so no match spans a paragraph break
+                "calming_hits": frozenset().union(*(part.calming_hits for part in parts)),
+                "unsafe_hits": frozenset().union(*(part.unsafe_hits for part in parts))
+            }
+
+    def _story_totals(self, story_key: str, keys: List[str], parts: List[ParagraphCounts],
+                      base: Optional[str]) -> "_StoryTotals":
+        """Cached totals for a story, derived from its base's totals when those are cached (lock held)"""
+        totals = self._stories.get(story_key)
+        if totals is not None:
+            self._stories.move_to_end(story_key)
+            return totals
+
+        wanted = Counter(keys)
+        part_by_key = dict(zip(keys, parts))
+        # The base's totals are taken over, not copied; the old version is not scored again in a feedback loop
+        totals = self._stories.pop(_content_key(base), None) if base is not None else None
+        if totals is None:
+            totals = _StoryTotals()
+            self.stats["full_merges"] += 1
+        else:
+            for key, times in (totals.paragraph_keys - wanted).items():
+                totals.remove(key, times)
+            self.stats["incremental_merges"] += 1
+        for key, times in (wanted - totals.paragraph_keys).items():
+            totals.add(key, part_by_key[key], times)
+
+        self._stories[story_key] = totals
+        while len(self._stories) > self.max_cached_stories:
+            self._stories.popitem(last=False)
+        return totals
+
+    def _scan_paragraph(self, key: str, paragraph: str) -> ParagraphCounts:
+        with self._lock:
+            part = self._paragraphs.get(key)
+            if part is not None:
+                self._paragraphs.move_to_end(key)
+                self.stats["paragraph_hits"] += 1
+                return part
+            self.stats["paragraph_misses"] += 1
+
+        word_counts = Counter(paragraph.split())
+        # Chunks made only of punctuation are not words for the grade level
+        words = {chunk: PUNCTUATION.sub("", chunk) for chunk in word_counts}
+        segments = [_lexicon_count(segment) for segment in SENTENCE_END.split(paragraph)]
+        part = ParagraphCounts(
+            word_counts=word_counts,
+            word_count=sum(word_counts.values()),
+            lexicon_count=sum(count for chunk, count in word_counts.items() if words[chunk]),
+            syllable_count=sum(count_syllables(words[chunk]) * count
+                               for chunk, count in word_counts.items() if words[chunk]),
+            sentences=sum(1 for count in segments[1:-1] if count > 2),
+            leading_words=segments[0],
+            has_end=len(segments) > 1,
+            trailing_words=segments[-1] if len(segments) > 1 else 0,
+            calming_hits=matching_words(self.calming_forms, word_counts),
+            unsafe_hits=matching_words(self.unsafe_forms, word_counts)
+        )
+        with self._lock:
+            self._paragraphs[key] = part
+            while len(self._paragraphs) > self.max_cached_paragraphs:
+                self._paragraphs.popitem(last=False)
+        return part
+
+def _content_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _lexicon_count(text: str) -> int:
+    return sum(1 for chunk in text.split() if WORD_CHARACTER.search(chunk))
+
+def _count_sentences(parts: List[ParagraphCounts]) -> int:
+    """Sentence total as textstat counts it in the joined paragraphs: sentences of two words or
+    fewer are ignored, and there is always at least one"""
+    sentences = 0
+    open_words = 0
+    for part in parts:
+        open_words += part.leading_words
+        if part.has_end:
+            sentences += (open_words > 2) + part.sentences
+            open_words = part.trailing_words
+    return max(1, sentences + (open_words > 2))
+
+def _round(number: float, points: int) -> float:
+    """Half away from zero, like textstat's legacy rounding"""
+    scale = 10 ** points
+    return math.floor(number * scale + math.copysign(0.5, number)) / scale
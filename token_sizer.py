@@ -0,0 +1,74 @@
+import math
+import threading
+from collections import deque
+from typing import Any, Dict, Mapping, Optional
+
+class TokenSizer:
+    """Chooses max_tokens per (call site, category) from the completion lengths seen so far.
+
+    A story reserves the configured max_tokens (the ceiling) until min_samples
+    completions of its kind have been recorded. From then on the limit is the
+    given percentile of the last `window` completion lengths times
+    (1 + margin_ratio), kept between min_tokens and the ceiling. Categories
+    without enough samples of their own use the call site's samples. A
+    truncated completion (finish_reason "length") raises that kind's floor to
+    widen_factor times the limit that cut it off, so a limit that proved too
+    tight is never chosen again. Truncated lengths are not added to the
+    samples: they only show that the answer needed more than the limit, and
+    counting them would pull the percentile down.
+    """
+
+    def __init__(self, settings: Mapping[str, Any]):
+        self.enabled = settings["enabled"]
+        self.percentile = settings["percentile"]
+        self.margin_ratio = settings["margin_ratio"]
+        self.min_tokens = settings["min_tokens"]
+        self.min_samples = settings["min_samples"]
+        self.window = settings["window"]
+        self.widen_factor = settings["widen_factor"]
+        self._samples = {}
+        self._floors = {}
+        self._truncations = {}
+        self._lock = threading.Lock()
+
+    def limit(self, call_site: str, category: Optional[str], ceiling: int) -> int:
+        """max_tokens for the next call of this kind"""
+        if not self.enabled:
+            return ceiling
+        with self._lock:
+            for key in ((call_site, category), (call_site, None)):
+                samples = self._samples.get(key)
+                if samples is not None and len(samples) >= self.min_samples:
+                    break
+            else:
+                return ceiling
+            observed = sorted(samples)
+            high = observed[min(len(observed) - 1, math.ceil(self.percentile * len(observed)) - 1)]
+            limit = max(math.ceil(high * (1 + self.margin_ratio)), self.min_tokens, self._floors.get(key, 0))
+        return min(limit, ceiling)
+
+    def record(self, call_site: str, category: Optional[str], completion_tokens: int, limit: int,
+               truncated: bool):
+        """Record one finished completion; the category's and the call site's samples both get it"""
+        with self._lock:
+            for key in {(call_site, category), (call_site, None)}:
+                samples = self._samples.get(key)
+                if samples is None:
+                    samples = self._samples[key] = deque(maxlen=self.window)
+                if truncated:
+                    self._floors[key] = max(self._floors.get(key, 0), math.ceil(limit * self.widen_factor))
+                    self._truncations[key] = self._truncations.get(key, 0) + 1
+                else:
+                    samples.append(completion_tokens)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Samples, current floor and truncations per "call_site/category" ("call_site/*" for the whole call site)"""
+        with self._lock:
+            return {
+                f"{call_site}/{category or '*'}": {
+                    "samples": len(samples),
+                    "floor": self._floors.get((call_site, category), 0),
+                    "truncations": self._truncations.get((call_site, category), 0)
+                }
+                for (call_site, category), samples in self._samples.items()
+            }